@@ -0,0 +1,174 @@
+"""
+checkpoint blob编码
+
+- ZstdSerializer：在默认序列化（msgpack）之上做zstd压缩
+- ChannelDeltaEncoder：列表类通道（messages）只存相对上一版本的增量，每隔N个版本存一次全量快照，
+  长对话每一步只写新增的几条消息，而不是整段历史
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Tuple
+
+import zstandard
+from langgraph.checkpoint.serde.base import SerializerProtocol
+
+# 增量blob的type前缀，后面接内层序列化的type，例如 delta/msgpack+zstd
+DELTA_PREFIX = "delta/"
+_ZSTD_SUFFIX = "+zstd"
+# 小于该字节数的blob压缩收益不大，不压缩
+_COMPRESS_MIN_BYTES = 256
+# 最多记住多少个通道的最近写入版本
+_MEMO_MAX_CHANNELS = 2048
+
+
+class ZstdSerializer(SerializerProtocol):
+    """zstd压缩包装，type追加+zstd后缀；未压缩的历史数据照常读取"""
+
+    def __init__(self, inner: SerializerProtocol, level: int = 3):
+        self._inner = inner
+        self._level = level
+        # zstd压缩/解压对象不是线程安全的，每个线程各一个
+        self._local = threading.local()
+
+    def _compressor(self) -> zstandard.ZstdCompressor:
+        c = getattr(self._local, "c", None)
+        if c is None:
+            c = self._local.c = zstandard.ZstdCompressor(level=self._level)
+        return c
+
+    def _decompressor(self) -> zstandard.ZstdDecompressor:
+        d = getattr(self._local, "d", None)
+        if d is None:
+            d = self._local.d = zstandard.ZstdDecompressor()
+        return d
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        type_, data = self._inner.dumps_typed(obj)
+        if self._level > 0 and data is not None and len(data) >= _COMPRESS_MIN_BYTES:
+            return type_ + _ZSTD_SUFFIX, self._compressor().compress(data)
+        return type_, data
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, blob = data
+        if type_.endswith(_ZSTD_SUFFIX):
+            return self._inner.loads_typed((type_[:-len(_ZSTD_SUFFIX)], self._decompressor().decompress(blob)))
+        return self._inner.loads_typed(data)
+
+
+def is_delta(type_: str) -> bool:
+    return type_.startswith(DELTA_PREFIX)
+
+
+def _common_prefix(old: list, new: list) -> int:
+    n = min(len(old), len(new))
+    i = 0
+    # 同一进程内相邻版本的消息通常是同一个对象，先比身份再比值
+    while i < n and (old[i] is new[i] or old[i] == new[i]):
+        i += 1
+    return i
+
+
+def decode_delta(serde: SerializerProtocol, type_: str, blob: bytes,
+                 fetch: Callable[[List[str]], Dict[str, Tuple[str, bytes]]]) -> list:
+    """
+    还原增量blob
+
+    增量内容为 [chain, prefix, tail]：chain是从直接基版本到最近快照的版本号（新到旧），
+    还原值 = 基版本值[:prefix] + tail。fetch按版本号一次取回整条链上的blob。
+    """
+    chain, prefix, tail = serde.loads_typed((type_[len(DELTA_PREFIX):], blob))
+    rows = fetch(chain)
+    missing = [v for v in chain if v not in rows]
+    if missing:
+        raise ValueError(f"checkpoint增量链不完整，缺少版本{missing}")
+    snapshot_type, snapshot_blob = rows[chain[-1]]
+    value = list(serde.loads_typed((snapshot_type, snapshot_blob)))
+    for version in reversed(chain[:-1]):
+        step_type, step_blob = rows[version]
+        _, step_prefix, step_tail = serde.loads_typed((step_type[len(DELTA_PREFIX):], step_blob))
+        value = value[:step_prefix] + step_tail
+    return value[:prefix] + tail
+
+
+class ChannelDeltaEncoder:
+    """
+    列表通道增量编码
+
+    记住每个(thread_id, checkpoint_ns, channel)最近写入的版本和值，下次写入时只编码公共前缀之后的部分。
+    进程重启或写入失败后没有记录，下一次写全量快照。基版本不要求是父checkpoint，只要求已落库。
+    记录可能过期（其他进程写入了更新的版本、基版本被清理），写入前由调用方对照库中最新版本校验（见base_versions）。
+    """
+
+    def __init__(self, serde: SerializerProtocol, snapshot_every: int):
+        self._serde = serde
+        self._snapshot_every = snapshot_every
+        # key -> (version, value, chain)，chain为该版本的增量链，快照为空
+        self._memo: OrderedDict[tuple, Tuple[str, list, tuple]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.full_bytes = 0
+        self.delta_bytes = 0
+
+    def dump(self, thread_id: str, checkpoint_ns: str, channel: str, version: str, value: Any) -> Tuple[str, bytes]:
+        if not isinstance(value, list) or self._snapshot_every <= 1:
+            return self._serde.dumps_typed(value)
+
+        key = (thread_id, checkpoint_ns, channel)
+        with self._lock:
+            base = self._memo.get(key)
+        type_, blob, chain = None, None, ()
+        if base is not None and base[0] != version and len(base[2]) + 1 < self._snapshot_every:
+            base_version, base_value, base_chain = base
+            prefix = _common_prefix(base_value, value)
+            if prefix > 0:
+                chain = (base_version, *base_chain)
+                inner_type, blob = self._serde.dumps_typed([list(chain), prefix, value[prefix:]])
+                type_ = DELTA_PREFIX + inner_type
+                self.delta_bytes += len(blob)
+        if type_ is None:
+            chain = ()
+            type_, blob = self._serde.dumps_typed(value)
+            self.full_bytes += len(blob)
+        self.remember(thread_id, checkpoint_ns, channel, version, value, chain)
+        return type_, blob
+
+    def remember(self, thread_id: str, checkpoint_ns: str, channel: str, version: str, value: list,
+                 chain: tuple = (), only_if_absent: bool = False) -> None:
+        key = (thread_id, checkpoint_ns, channel)
+        with self._lock:
+            if only_if_absent and key in self._memo:
+                return
+            self._memo[key] = (version, list(value), tuple(chain))
+            self._memo.move_to_end(key)
+            while len(self._memo) > _MEMO_MAX_CHANNELS:
+                self._memo.popitem(last=False)
+
+    def base_versions(self, thread_id: str, checkpoint_ns: str, channels) -> Dict[str, str]:
+        """各通道记住的增量基版本，没有记录的通道不返回"""
+        with self._lock:
+            return {channel: memo[0] for channel in channels
+                    if (memo := self._memo.get((thread_id, checkpoint_ns, channel))) is not None}
+
+    def forget_channel(self, thread_id: str, checkpoint_ns: str, channel: str) -> None:
+        with self._lock:
+            self._memo.pop((thread_id, checkpoint_ns, channel), None)
+
+    def chain_of(self, type_: str, blob: bytes) -> tuple:
+        """增量blob所在的链（用于读取后回填记录），快照返回空"""
+        if not is_delta(type_):
+            return ()
+        chain, _, _ = self._serde.loads_typed((type_[len(DELTA_PREFIX):], blob))
+        return tuple(chain)
+
+    def forget(self, thread_id: str | None = None) -> None:
+        """写入回滚后调用，记录的版本可能没有落库，丢弃后下一次写全量快照"""
+        with self._lock:
+            if thread_id is None:
+                self._memo.clear()
+                return
+            for key in [k for k in self._memo if k[0] == thread_id]:
+                del self._memo[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            channels = len(self._memo)
+        return {"channels": channels, "full_bytes": self.full_bytes, "delta_bytes": self.delta_bytes}
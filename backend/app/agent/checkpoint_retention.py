@@ -0,0 +1,217 @@
+"""
+checkpoint表保留与清理
+
+- 每个会话（thread_id + checkpoint_ns）只保留最近N个checkpoint，清理更早的checkpoint、writes和不再被引用的blob
+- 已软删除的会话（conversation.status=0）整段删除
+- 后台线程定时执行，每批删除后休眠，避免长事务和锁等待；多进程部署时用GET_LOCK保证只有一个进程执行
+"""
+import json
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from app.agent.checkpoint_codec import DELTA_PREFIX, is_delta
+from app.agent.mysql_agent_saver import get_hybrid_checkpoint_saver
+from app.infra.log import logger
+from app.infra.mysql import mysql_manager
+from app.infra.settings import get_settings
+
+_TABLES = ("checkpoints", "checkpoint_blobs", "checkpoint_writes")
+_LOCK_NAME = "jp_ai_checkpoint_retention"
+
+
+class CheckpointRetention:
+
+    def __init__(self, keep: int, batch_size: int, sleep_ms: int):
+        if keep < 1:
+            raise ValueError("checkpoint保留数量至少为1")
+        self._keep = keep
+        self._batch_size = batch_size
+        self._sleep = sleep_ms / 1000
+        self._saver = get_hybrid_checkpoint_saver()
+
+    # ---------------- 入口 ----------------
+    def run_once(self) -> Optional[dict]:
+        """执行一轮清理，返回报告；其他进程正在执行时返回None"""
+        start = time.perf_counter_ns()
+        reclaimed = {table: 0 for table in _TABLES}
+        with mysql_manager.raw_connection() as conn:
+            if not self._acquire(conn):
+                logger.info("checkpoint清理任务正在其他进程执行，跳过")
+                return None
+            try:
+                deleted_threads = self._purge_deleted_conversations(reclaimed)
+                pruned_threads = self._prune_threads(reclaimed)
+                report = {
+                    "deleted_threads": deleted_threads,
+                    "pruned_threads": pruned_threads,
+                    "reclaimed_rows": reclaimed,
+                    "tables": self.table_sizes(),
+                    "ms": round((time.perf_counter_ns() - start) / 1e6, 2),
+                }
+            finally:
+                self._release(conn)
+        logger.info("checkpoint清理完成：%s", json.dumps(report, ensure_ascii=False))
+        return report
+
+    def table_sizes(self) -> Dict[str, dict]:
+        """各表行数（估算）、数据与索引大小（MB）"""
+        sql = ("SELECT TABLE_NAME, TABLE_ROWS, DATA_LENGTH, INDEX_LENGTH FROM information_schema.TABLES "
+               "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({})").format(",".join(["%s"] * len(_TABLES)))
+        rows = self._fetchall(sql, _TABLES)
+        return {
+            name: {"rows": table_rows, "data_mb": round(data / 1024 / 1024, 2),
+                   "index_mb": round(index / 1024 / 1024, 2)}
+            for name, table_rows, data, index in rows
+        }
+
+    # ---------------- 软删除会话 ----------------
+    def _purge_deleted_conversations(self, reclaimed: Dict[str, int]) -> int:
+        threads = 0
+        while True:
+            # checkpoints最后删，中途中断时下一轮还能查到该会话继续删
+            conv_ids = [r[0] for r in self._fetchall(
+                "SELECT c.conv_id FROM conversation c WHERE c.status = 0 "
+                "AND EXISTS (SELECT 1 FROM checkpoints k WHERE k.thread_id = c.conv_id) LIMIT %s",
+                (self._batch_size,))]
+            if not conv_ids:
+                return threads
+            for thread_id in conv_ids:
+                for table in ("checkpoint_writes", "checkpoint_blobs", "checkpoints"):
+                    reclaimed[table] += self._delete_in_batches(
+                        f"DELETE FROM {table} WHERE thread_id = %s LIMIT {self._batch_size}", (thread_id,))
+                self._saver.evict_thread(thread_id)
+                threads += 1
+
+    def _delete_in_batches(self, sql: str, args: tuple) -> int:
+        total = 0
+        while True:
+            with mysql_manager.raw_transaction() as conn, conn.cursor() as cur:
+                n = cur.execute(sql, args)
+            total += n
+            if n < self._batch_size:
+                return total
+            time.sleep(self._sleep)
+
+    # ---------------- 只保留最近N个 ----------------
+    def _prune_threads(self, reclaimed: Dict[str, int]) -> int:
+        thread_ids = [r[0] for r in self._fetchall(
+            "SELECT DISTINCT thread_id FROM ("
+            "  SELECT thread_id FROM checkpoints GROUP BY thread_id, checkpoint_ns_hash HAVING COUNT(*) > %s"
+            ") t", (self._keep,))]
+        for thread_id in thread_ids:
+            self._prune_thread(thread_id, reclaimed)
+            time.sleep(self._sleep)
+        return len(thread_ids)
+
+    def _prune_thread(self, thread_id: str, reclaimed: Dict[str, int]) -> None:
+        rows = self._fetchall(
+            "SELECT checkpoint_ns, checkpoint_id, JSON_EXTRACT(checkpoint, '$.channel_versions') FROM checkpoints "
+            "WHERE thread_id = %s ORDER BY checkpoint_ns, checkpoint_id DESC", (thread_id,))
+        kept_per_ns: Dict[str, int] = {}
+        victims: List[str] = []
+        keep_blobs: Set[Tuple[str, str, str]] = set()
+        victim_blobs: Set[Tuple[str, str, str]] = set()
+        for ns, checkpoint_id, channel_versions in rows:
+            kept = kept_per_ns.get(ns, 0) < self._keep
+            if kept:
+                kept_per_ns[ns] = kept_per_ns.get(ns, 0) + 1
+            else:
+                victims.append(checkpoint_id)
+            for channel, version in json.loads(channel_versions or "{}").items():
+                (keep_blobs if kept else victim_blobs).add((ns, channel, str(version)))
+        if not victims:
+            return
+
+        # 只删除仅被待删checkpoint引用的blob版本：读取checkpoints之后才写入的blob（进行中的对话、
+        # write-behind先于checkpoint行落库的blob）不在待删checkpoint的引用中，不会被误删；
+        # 新checkpoint沿用的旧版本来自最新的checkpoint，一定在保留范围内
+        blob_rows = self._fetchall(
+            "SELECT checkpoint_ns, channel, version, type FROM checkpoint_blobs WHERE thread_id = %s", (thread_id,))
+        # 保留的增量blob依赖其增量链上的所有版本
+        for ns, channel, version, type_ in blob_rows:
+            if (ns, channel, version) in keep_blobs and is_delta(type_):
+                for base in self._delta_chain(thread_id, ns, channel, version):
+                    keep_blobs.add((ns, channel, base))
+        blob_victims = [(thread_id, ns, channel, version) for ns, channel, version, _ in blob_rows
+                        if (ns, channel, version) in victim_blobs and (ns, channel, version) not in keep_blobs]
+
+        for ids in _chunks(victims, self._batch_size):
+            placeholders = ",".join(["%s"] * len(ids))
+            with mysql_manager.raw_transaction() as conn, conn.cursor() as cur:
+                reclaimed["checkpoint_writes"] += cur.execute(
+                    f"DELETE FROM checkpoint_writes WHERE thread_id = %s AND checkpoint_id IN ({placeholders})",
+                    (thread_id, *ids))
+                reclaimed["checkpoints"] += cur.execute(
+                    f"DELETE FROM checkpoints WHERE thread_id = %s AND checkpoint_id IN ({placeholders})",
+                    (thread_id, *ids))
+            time.sleep(self._sleep)
+        for keys in _chunks(blob_victims, self._batch_size):
+            with mysql_manager.raw_transaction() as conn, conn.cursor() as cur:
+                cur.executemany(
+                    "DELETE FROM checkpoint_blobs WHERE thread_id = %s AND checkpoint_ns_hash = UNHEX(MD5(%s)) "
+                    "AND channel = %s AND version = %s", keys)
+                reclaimed["checkpoint_blobs"] += cur.rowcount
+            time.sleep(self._sleep)
+
+    def _delta_chain(self, thread_id: str, ns: str, channel: str, version: str) -> List[str]:
+        rows = self._fetchall(
+            "SELECT type, `blob` FROM checkpoint_blobs WHERE thread_id = %s AND checkpoint_ns_hash = UNHEX(MD5(%s)) "
+            "AND channel = %s AND version = %s", (thread_id, ns, channel, version))
+        if not rows:
+            return []
+        type_, blob = rows[0]
+        chain, _, _ = self._saver.get_db_saver().serde.loads_typed((type_[len(DELTA_PREFIX):], blob))
+        return list(chain)
+
+    # ---------------- 工具 ----------------
+    @staticmethod
+    def _fetchall(sql: str, args: Iterable) -> list:
+        with mysql_manager.raw_connection() as conn, conn.cursor() as cur:
+            cur.execute(sql, tuple(args))
+            return list(cur.fetchall())
+
+    @staticmethod
+    def _acquire(conn) -> bool:
+        with conn.cursor() as cur:
+            cur.execute("SELECT GET_LOCK(%s, 0)", (_LOCK_NAME,))
+            return cur.fetchone()[0] == 1
+
+    @staticmethod
+    def _release(conn) -> None:
+        with conn.cursor() as cur:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (_LOCK_NAME,))
+
+
+def _chunks(items: list, size: int) -> Iterable[list]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+_retention_thread: Optional[threading.Thread] = None
+_retention_lock = threading.Lock()
+
+
+def start_checkpoint_retention() -> None:
+    """启动后台清理线程，AGENT_CKPT_RETENTION_KEEP<=0 时不启动"""
+    global _retention_thread
+    settings = get_settings()
+    if settings.AGENT_CKPT_RETENTION_KEEP <= 0:
+        return
+    with _retention_lock:
+        if _retention_thread is not None:
+            return
+        retention = CheckpointRetention(keep=settings.AGENT_CKPT_RETENTION_KEEP,
+                                        batch_size=settings.AGENT_CKPT_RETENTION_BATCH,
+                                        sleep_ms=settings.AGENT_CKPT_RETENTION_SLEEP_MS)
+
+        def loop():
+            while True:
+                time.sleep(settings.AGENT_CKPT_RETENTION_INTERVAL_S)
+                try:
+                    retention.run_once()
+                except Exception as e:
+                    logger.exception("checkpoint清理失败: %s", e)
+
+        _retention_thread = threading.Thread(target=loop, name="Checkpoint-Retention", daemon=True)
+        _retention_thread.start()
@@ -0,0 +1,153 @@
+"""
+分级路由：大多数消息不调用路由大模型
+
+1. 只注册了一个子agent：直接路由
+2. embedding分类：问题与各子agent的描述、触发条件、示例问题算余弦相似度，置信度够高时直接路由
+3. 会话粘滞：上一轮已路由过，且embedding没有明确指向别的子agent时，沿用上一轮的子agent
+4. 以上都不满足时返回None，由调用方走路由大模型
+"""
+import asyncio
+import json
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage
+
+from app.infra.log import logger
+
+if TYPE_CHECKING:
+    from app.agent.router_agent import AgentInfo
+
+# 从示例中取出用户问题，示例格式：用户：'明天上海天气怎么样？', 你：{...}
+_EXAMPLE_QUESTION = re.compile(r"用户[:：]\s*['‘\"“](.+?)['’\"”]")
+
+
+@dataclass
+class RouteDecision:
+    agent_id: str
+    agent_name: str
+    # single/embedding/sticky/llm/fallback/cache_thread/cache_question
+    tier: str
+    score: float = 1.0
+    # 路由大模型的原始输出，快速通道为None
+    message: Optional[AIMessage] = None
+
+    def to_message(self) -> AIMessage:
+        """与路由大模型的输出格式一致，前端和历史记录按同样方式展示"""
+        if self.message is not None:
+            return self.message
+        content = {"route_agent_id": self.agent_id, "reason_and_mode": self.default_reason}
+        return AIMessage(content=json.dumps(content, ensure_ascii=False))
+
+    @property
+    def default_reason(self) -> str:
+        return f"我将转发给【{self.agent_name}】来处理......"
+
+
+class FastRouter:
+    """
+    路由快速通道
+
+    agents为 {agent_id: AgentInfo}；子agent的样例向量在第一次分类时计算（加载embedding模型较慢）。
+    threshold：最高相似度至少为多少才直接路由；margin：最高与次高相似度至少相差多少。
+    """
+
+    def __init__(self, agents: Dict[str, "AgentInfo"], embeddings: Embeddings, threshold: float, margin: float):
+        self._agents = agents
+        self._embeddings = embeddings
+        self._threshold = threshold
+        self._margin = margin
+        self._lock = threading.Lock()
+        # 样例向量（已归一化）及其所属agent_id
+        self._matrix: Optional[np.ndarray] = None
+        self._labels: List[str] = []
+        self._stats_lock = threading.Lock()
+        self.tier_counts: Dict[str, int] = {}
+
+    @staticmethod
+    def _exemplars(agent_info) -> List[str]:
+        texts = [agent_info.description]
+        texts += [c.lstrip("-* ").strip() for c in agent_info.trigger_conditions]
+        texts += _EXAMPLE_QUESTION.findall(agent_info.example or "")
+        return [t for t in texts if t]
+
+    def _index(self) -> Tuple[np.ndarray, List[str]]:
+        if self._matrix is None:
+            with self._lock:
+                if self._matrix is None:
+                    texts, labels = [], []
+                    for agent_id, agent_info in self._agents.items():
+                        for text in self._exemplars(agent_info):
+                            texts.append(text)
+                            labels.append(agent_id)
+                    matrix = np.asarray(self._embeddings.embed_documents(texts), dtype=np.float32)
+                    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+                    self._labels = labels
+                    self._matrix = matrix
+        return self._matrix, self._labels
+
+    def warm_up(self) -> None:
+        """预先计算样例向量（只有一个子agent时用不到embedding）"""
+        if len(self._agents) > 1:
+            self._index()
+
+    def classify(self, question: str) -> List[Tuple[str, float]]:
+        """各子agent的得分（与其样例的最高相似度），从高到低"""
+        matrix, labels = self._index()
+        query = np.asarray(self._embeddings.embed_query(question), dtype=np.float32)
+        query /= np.linalg.norm(query) + 1e-12
+        scores: Dict[str, float] = {}
+        for label, sim in zip(labels, matrix @ query):
+            scores[label] = max(scores.get(label, -1.0), float(sim))
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+
+    def _confident(self, ranked: List[Tuple[str, float]]) -> Optional[Tuple[str, float]]:
+        if not ranked:
+            return None
+        top_id, top_score = ranked[0]
+        second = ranked[1][1] if len(ranked) > 1 else -1.0
+        if top_score >= self._threshold and top_score - second >= self._margin:
+            return top_id, top_score
+        return None
+
+    def _decide(self, question: str, previous_agent_id: Optional[str]) -> Optional[RouteDecision]:
+        if len(self._agents) == 1:
+            agent_id = next(iter(self._agents))
+            return RouteDecision(agent_id, self._agents[agent_id].name, "single")
+
+        confident = self._confident(self.classify(question))
+        if confident is not None:
+            agent_id, score = confident
+            return RouteDecision(agent_id, self._agents[agent_id].name, "embedding", score)
+        if previous_agent_id in self._agents:
+            return RouteDecision(previous_agent_id, self._agents[previous_agent_id].name, "sticky")
+        return None
+
+    async def aroute(self, question: str, previous_agent_id: Optional[str] = None) -> Optional[RouteDecision]:
+        """返回路由结果，置信度不够时返回None"""
+        start = time.perf_counter_ns()
+        if len(self._agents) == 1:
+            decision = self._decide(question, previous_agent_id)
+        else:
+            # embedding推理是CPU密集的，放到线程池
+            decision = await asyncio.to_thread(self._decide, question, previous_agent_id)
+        self.record(decision.tier if decision else "llm")
+        if decision is not None:
+            logger.debug("快速路由到%s（%s，score=%.3f），耗时%.2fms", decision.agent_id, decision.tier,
+                         decision.score, (time.perf_counter_ns() - start) / 1e6)
+        return decision
+
+    def record(self, tier: str) -> None:
+        with self._stats_lock:
+            self.tier_counts[tier] = self.tier_counts.get(tier, 0) + 1
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            counts = dict(self.tier_counts)
+        total = sum(counts.values())
+        return {"tiers": counts, "llm_rate": round(counts.get("llm", 0) / total, 4) if total else 0.0}
@@ -1,13 +1,13 @@
 from typing import Any
 
 from langchain_community.tools.asknews.tool import SearchInput
-from langchain_core.tools import BaseTool
 from pydantic import BaseModel
 
+from app.agent.tool_executor import PooledTool
 from app.rag.service import rag_service
 
 
-class KnowledgeTool(BaseTool):
+class KnowledgeTool(PooledTool):
     name: str
     description: str
     args_schema: type[BaseModel] = SearchInput
@@ -1,28 +1,140 @@
-from typing import Any
+import json
+from typing import Any, Awaitable, Callable, Dict, List
 
-from langchain.agents import AgentState
-from langchain.agents.middleware import before_model
-from langchain_core.messages import RemoveMessage
-from langgraph.graph.message import REMOVE_ALL_MESSAGES
-from langgraph.runtime import Runtime
+from langchain.agents.middleware import AgentMiddleware, ModelRequest, ModelResponse
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, ToolMessage
 
+from app.agent.prompt_cache import cacheable_system_message
+from app.agent.running_summary import RUNNING_SUMMARY
+from app.infra.log import logger
 from app.infra.settings import get_settings
+from app.infra.tokenizer import count_tokens, truncate_tokens
 
 
-@before_model
-def trim_messages(state: AgentState, runtime: Runtime) -> dict[str, Any] | None:
-    """Keep only the last few messages to fit context window."""
-    settings = get_settings()
-    messages = state["messages"]
-    to_keep = settings.AGENT_MSG_TRIM_TO_KEEP
-    if len(messages) <= to_keep:
-        return None  # No changes needed
-    first_msg = messages[0]
-    recent_messages = messages[-to_keep:] if len(messages) % 2 == 0 else messages[-to_keep + 1:]
-    new_messages = [first_msg] + recent_messages
-    return {
-        "messages": [
-            RemoveMessage(id=REMOVE_ALL_MESSAGES),
-            *new_messages
-        ]
-    }
\ No newline at end of file
+# 每条消息的格式开销（角色标记、分隔符等）
+_MESSAGE_OVERHEAD = 4
+# 最新一组消息仍超预算时，每条工具结果至少保留的token数
+_MIN_TOOL_TOKENS = 200
+
+
+def message_tokens(message: AnyMessage) -> int:
+    tokens = _MESSAGE_OVERHEAD + count_tokens(message.text)
+    if isinstance(message, AIMessage) and message.tool_calls:
+        tokens += count_tokens(json.dumps(message.tool_calls, ensure_ascii=False, sort_keys=True))
+    return tokens
+
+
+def _truncate_tool_message(message: ToolMessage, max_tokens: int) -> ToolMessage:
+    total = count_tokens(message.text)
+    if total <= max_tokens:
+        return message
+    note = f"\n……（内容过长已截断，原文约{total}个token）"
+    content = truncate_tokens(message.text, max(max_tokens - count_tokens(note), 0)) + note
+    return message.model_copy(update={"content": content})
+
+
+def _group_messages(messages: List[AnyMessage]) -> List[List[AnyMessage]]:
+    """带工具调用的AI消息和它的工具结果作为一组，裁剪时一起保留或一起丢弃"""
+    groups: List[List[AnyMessage]] = []
+    for message in messages:
+        if isinstance(message, ToolMessage) and groups:
+            groups[-1].append(message)
+        else:
+            groups.append([message])
+    return groups
+
+
+class TokenBudgetMiddleware(AgentMiddleware):
+    """
+    按token预算裁剪发给模型的历史消息，只影响本次请求，不修改state
+
+    1. 超长的工具结果先截断到tool_max_tokens
+    2. 本轮（最后一条用户消息及之后的工具调用、工具结果）先占预算，始终保留
+    3. 本轮本身就超预算时（如一次检索返回大量片段），把本轮的工具结果按剩余预算平分截断，用户问题不动
+    4. 剩余预算从最新的历史消息往前保留，放不下的更早消息整组丢弃，工具调用和工具结果不拆开；保留的历史从用户消息开始
+    开头的滚动摘要消息始终保留，系统提示词计入预算
+    """
+
+    def __init__(self, max_tokens: int, tool_max_tokens: int):
+        super().__init__()
+        self.max_tokens = max_tokens
+        self.tool_max_tokens = tool_max_tokens
+
+    @staticmethod
+    def _shrink(messages: List[AnyMessage], budget: int) -> List[AnyMessage]:
+        tools = [message for message in messages if isinstance(message, ToolMessage)]
+        if not tools:
+            return messages
+        fixed = sum(message_tokens(message) for message in messages if not isinstance(message, ToolMessage))
+        share = max(_MIN_TOOL_TOKENS, (budget - fixed) // len(tools) - _MESSAGE_OVERHEAD)
+        return [_truncate_tool_message(message, share) if isinstance(message, ToolMessage) else message
+                for message in messages]
+
+    def _prepare(self, request: ModelRequest) -> ModelRequest:
+        messages = [_truncate_tool_message(message, self.tool_max_tokens) if isinstance(message, ToolMessage)
+                    else message for message in request.messages]
+        pinned = [messages.pop(0)] if messages and messages[0].id == RUNNING_SUMMARY else []
+        budget = self.max_tokens - count_tokens(request.system_prompt or "") \
+            - sum(message_tokens(message) for message in pinned)
+
+        # 本轮：从最后一条用户消息开始，没有用户消息时全部算作本轮
+        start = next((i for i in range(len(messages) - 1, -1, -1) if isinstance(messages[i], HumanMessage)), 0)
+        history, current = messages[:start], messages[start:]
+        used = sum(message_tokens(message) for message in current)
+        if used > budget:
+            current = self._shrink(current, budget)
+            used = sum(message_tokens(message) for message in current)
+
+        kept: List[List[AnyMessage]] = []
+        for group in reversed(_group_messages(history)):
+            tokens = sum(message_tokens(message) for message in group)
+            if used + tokens > budget:
+                break
+            kept.append(group)
+            used += tokens
+        kept.reverse()
+        while kept and not isinstance(kept[0][0], HumanMessage):
+            kept.pop(0)
+
+        trimmed = pinned + [message for group in kept for message in group] + current
+        if len(trimmed) < len(request.messages) or used > budget:
+            logger.debug("上下文按token预算裁剪：%d条消息保留%d条，约%d个token",
+                         len(request.messages), len(trimmed), used)
+        return request.override(messages=trimmed)
+
+    def wrap_model_call(self, request: ModelRequest,
+                        handler: Callable[[ModelRequest], ModelResponse]) -> ModelResponse:
+        return handler(self._prepare(request))
+
+    async def awrap_model_call(self, request: ModelRequest,
+                               handler: Callable[[ModelRequest], Awaitable[ModelResponse]]) -> ModelResponse:
+        return await handler(self._prepare(request))
+
+
+def _tool_name(tool: Any) -> str:
+    if isinstance(tool, dict):
+        return tool.get("name") or tool.get("function", {}).get("name", "")
+    return getattr(tool, "name", "")
+
+
+class PromptCacheMiddleware(AgentMiddleware):
+    """
+    子agent的模型调用：工具按名称排序，系统提示词换成可缓存的系统消息
+
+    create_agent的system_prompt只能是字符串，这里在调用模型前接管，保证每轮请求的前缀（工具+系统提示词）字节一致
+    """
+
+    def _prepare(self, request: ModelRequest) -> ModelRequest:
+        overrides: Dict[str, Any] = {"tools": sorted(request.tools, key=_tool_name)}
+        if request.system_prompt and get_settings().LLM_PROMPT_CACHE_EXPLICIT:
+            overrides["system_prompt"] = None
+            overrides["messages"] = [cacheable_system_message(request.system_prompt), *request.messages]
+        return request.override(**overrides)
+
+    def wrap_model_call(self, request: ModelRequest,
+                        handler: Callable[[ModelRequest], ModelResponse]) -> ModelResponse:
+        return handler(self._prepare(request))
+
+    async def awrap_model_call(self, request: ModelRequest,
+                               handler: Callable[[ModelRequest], Awaitable[ModelResponse]]) -> ModelResponse:
+        return await handler(self._prepare(request))
@@ -1,36 +1,611 @@
+import asyncio
+import atexit
+import functools
+import json
+import os
+import queue
 import random
+import re
+import struct
 import threading
-from typing import Any, Iterator, Sequence
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Iterator, Sequence
 
+import pymysql
 from langchain_core.runnables import RunnableConfig
 from langgraph.checkpoint.base import BaseCheckpointSaver, CheckpointTuple, Checkpoint, CheckpointMetadata, \
-    ChannelVersions
+    ChannelVersions, get_checkpoint_id
 from langgraph.checkpoint.mysql.pymysql import PyMySQLSaver
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from sqlalchemy import exc as sa_exc
 
+from app.agent.checkpoint_codec import ChannelDeltaEncoder, ZstdSerializer, decode_delta, is_delta
 from app.infra.agent_memory import get_agent_memory
+from app.infra.log import logger
 from app.infra.mysql import mysql_manager
+from app.infra.settings import get_settings
+
+
+class PooledPyMySQLSaver(PyMySQLSaver):
+    """
+    连接池版PyMySQLSaver，全局一个实例
+
+    - 每次操作通过mysql_manager.raw_connection()借连接、用完归还，同一线程嵌套调用复用同一连接
+    - 去掉父类的全局锁：连接按线程独占，不再需要串行化
+    - 已在raw_transaction()中时，写入并入外层事务（write-behind批量落库）
+    - PyMySQL只支持客户端参数化，没有服务端prepared statement；查询SQL按where子句缓存，只拼接一次
+    - blob使用msgpack+zstd，列表通道（messages）增量存储，见checkpoint_codec
+    """
+
+    _SELECT_BLOBS_SQL = ("SELECT version, type, `blob` FROM checkpoint_blobs "
+                         "WHERE thread_id = %s AND checkpoint_ns_hash = UNHEX(MD5(%s)) AND channel = %s "
+                         "AND version IN ({})")
+    _LATEST_VERSIONS_SQL = ("SELECT JSON_EXTRACT(checkpoint, '$.channel_versions') AS channel_versions FROM checkpoints "
+                            "WHERE thread_id = %s AND checkpoint_ns_hash = UNHEX(MD5(%s)) "
+                            "ORDER BY checkpoint_id DESC LIMIT 1")
+
+    def __init__(self, snapshot_every: int, zstd_level: int) -> None:
+        super().__init__(conn=mysql_manager.engine.pool,
+                         serde=ZstdSerializer(JsonPlusSerializer(), level=zstd_level))
+        self._delta = ChannelDeltaEncoder(self.serde, snapshot_every)
+
+    @contextmanager
+    def _cursor(self, *, pipeline: bool = False) -> Iterator[Any]:
+        if pipeline:
+            with mysql_manager.raw_transaction() as conn, self._get_cursor_from_connection(conn) as cur:
+                yield cur
+        else:
+            with mysql_manager.raw_connection() as conn, self._get_cursor_from_connection(conn) as cur:
+                yield cur
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def _select_sql(where: str) -> str:
+        return PyMySQLSaver._select_sql(where)
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def _select_pending_sends_sql(num_ids: int) -> str:
+        return PyMySQLSaver._select_pending_sends_sql(num_ids)
+
+    def list(self, config: RunnableConfig | None, **kwargs) -> Iterator[CheckpointTuple]:
+        # 父类是生成器，迭代期间一直占着连接；这里一次取完立即归还连接
+        return iter(list(super().list(config, **kwargs)))
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        try:
+            self._check_bases(config["configurable"]["thread_id"], config["configurable"].get("checkpoint_ns", ""),
+                              new_versions)
+            return super().put(config, checkpoint, metadata, new_versions)
+        except Exception:
+            self._delta.forget(config["configurable"]["thread_id"])
+            raise
+
+    def _check_bases(self, thread_id: str, checkpoint_ns: str, new_versions: ChannelVersions) -> None:
+        """
+        增量基版本必须仍是库中最新checkpoint的版本：其他进程可能已写入更新的版本，或基版本已被清理，
+        这时基于进程内的记录写增量，读取方无法还原。不一致的通道丢弃记录，本次写全量快照。
+        write-behind批量写入时在同一事务内查询，能看到本批前面的写入
+        """
+        bases = self._delta.base_versions(thread_id, checkpoint_ns, new_versions)
+        if not bases:
+            return
+        with self._cursor() as cur:
+            cur.execute(self._LATEST_VERSIONS_SQL, (thread_id, checkpoint_ns))
+            row = cur.fetchone()
+        stored = json.loads(row["channel_versions"]) if row and row["channel_versions"] else {}
+        for channel, version in bases.items():
+            if str(stored.get(channel)) != str(version):
+                self._delta.forget_channel(thread_id, checkpoint_ns, channel)
+
+    def write_batch(self, ops: Sequence[tuple]) -> None:
+        """在一个事务中依次执行多个put/put_writes"""
+        try:
+            with mysql_manager.raw_transaction():
+                for op, args in ops:
+                    getattr(self, op)(*args)
+        except Exception:
+            # 整批回滚，批内记录的增量基版本都没有落库
+            self._delta.forget()
+            raise
+
+    def forget_thread(self, thread_id: str) -> None:
+        self._delta.forget(thread_id)
+
+    def delta_stats(self) -> dict:
+        return self._delta.stats()
+
+    def _dump_blobs(self, thread_id: str, checkpoint_ns: str, values: dict[str, Any],
+                    versions: ChannelVersions) -> Sequence[tuple]:
+        return [
+            (thread_id, checkpoint_ns, checkpoint_ns, k, ver,
+             *(self._delta.dump(thread_id, checkpoint_ns, k, ver, values[k]) if k in values else ("empty", None)))
+            for k, ver in versions.items()
+        ]
+
+    def _fetch_blobs(self, thread_id: str, checkpoint_ns: str, channel: str,
+                     versions: Sequence[str]) -> dict[str, tuple[str, bytes]]:
+        sql = self._SELECT_BLOBS_SQL.format(",".join(["%s"] * len(versions)))
+        with self._cursor() as cur:
+            cur.execute(sql, (thread_id, checkpoint_ns, channel, *versions))
+            return {row["version"]: (row["type"], row["blob"]) for row in cur.fetchall()}
+
+    def _load_checkpoint_tuple(self, value: dict[str, Any]) -> CheckpointTuple:
+        blobs = value["channel_values"] or []
+        if not any(is_delta(t) for _, t, _ in blobs):
+            tup = super()._load_checkpoint_tuple(value)
+            self._remember_loaded(tup, blobs)
+            return tup
+
+        thread_id, checkpoint_ns = value["thread_id"], value["checkpoint_ns"]
+        resolved = {}
+        for channel, type_, blob in blobs:
+            if is_delta(type_):
+                resolved[channel] = decode_delta(
+                    self.serde, type_, blob,
+                    lambda versions, c=channel: self._fetch_blobs(thread_id, checkpoint_ns, c, versions))
+        value["channel_values"] = [b for b in blobs if not is_delta(b[1])]
+        tup = super()._load_checkpoint_tuple(value)
+        tup.checkpoint["channel_values"].update(resolved)
+        self._remember_loaded(tup, blobs)
+        return tup
+
+    def _remember_loaded(self, tup: CheckpointTuple, blobs: Sequence[tuple]) -> None:
+        """进程重启后读到的列表通道记为增量基版本，下一次写入不必再存全量（写入前仍会校验是否为库中最新版本）"""
+        configurable = tup.config["configurable"]
+        channel_versions = tup.checkpoint["channel_versions"]
+        for channel, type_, blob in blobs:
+            val = tup.checkpoint["channel_values"].get(channel)
+            if isinstance(val, list) and channel in channel_versions:
+                self._delta.remember(configurable["thread_id"], configurable["checkpoint_ns"], channel,
+                                     channel_versions[channel], val, self._delta.chain_of(type_, blob),
+                                     only_if_absent=True)
+
+
+# 连接类错误、锁等待超时、死锁：稍后重试能成功
+_TRANSIENT_MYSQL_CODES = {1040, 1205, 1213, 2003, 2006, 2013, 2055}
+
+
+def _is_transient(e: BaseException) -> bool:
+    if isinstance(e, (sa_exc.TimeoutError, sa_exc.DisconnectionError, ConnectionError, TimeoutError)):
+        return True
+    # sqlalchemy包装的驱动异常取原始异常
+    e = getattr(e, "orig", None) or e
+    if isinstance(e, pymysql.err.InterfaceError):
+        return True
+    if isinstance(e, pymysql.err.OperationalError):
+        return bool(e.args) and e.args[0] in _TRANSIENT_MYSQL_CODES
+    return False
+
+
+def _frame(serde: SerializerProtocol, record: tuple) -> bytes:
+    type_, data = serde.dumps_typed(list(record))
+    type_bytes = type_.encode()
+    return struct.pack(">HI", len(type_bytes), len(data)) + type_bytes + data
+
+
+def _thread_of(args: Sequence) -> str:
+    """put/put_writes的第一个参数是config"""
+    try:
+        return args[0]["configurable"]["thread_id"]
+    except (IndexError, KeyError, TypeError):
+        return ""
+
+
+class CheckpointWriteBehind:
+    """
+    checkpoint写后落库：put/put_writes先进有界队列，后台线程攒批，一个事务写入多条
+
+    - 队列满时调用方阻塞等待（背压），不丢数据
+    - journal_path配置后，入队前先追加到本地日志并fsync，进程崩溃后启动时重放；
+      未配置时崩溃最多丢失队列中尚未落库的写入
+    - 日志分段（journal_path.N），当前段超过journal_segment_bytes后切到新段，旧段的记录全部落库后删除，
+      持续有写入时日志也不会无限增长；当前段的记录全部落库时清空复用
+    - 启动时读出上次未落库的记录，由后台线程先于新写入、按正常落库流程重放（不阻塞启动，MySQL不可用时退避重试），
+      重放完成前这些会话的回源读取会等待
+    - 落库失败：连接断开、锁等待超时等暂时性错误一直退避重试；其他错误（序列化、超长、约束冲突等）
+      整批重试max_retries次后改为逐条写入，仍失败的记录转入死信文件（dead_letter_path，格式同日志）并打error，
+      不让一条坏记录卡死后台线程、写满队列阻塞对话
+    - 进程退出时（atexit）把队列刷完再退出
+    """
+
+    _STOP = object()
+
+    def __init__(self, writer: Callable[[list], None], serde: SerializerProtocol, queue_max: int,
+                 batch_size: int, flush_interval_ms: int, journal_path: str | None = None,
+                 max_retries: int = 3, dead_letter_path: str | None = None,
+                 journal_segment_bytes: int = 64 << 20):
+        self._writer = writer
+        self._serde = serde
+        self._max_retries = max_retries
+        # 默认放在日志旁边
+        self._dead_letter_path = dead_letter_path or (f"{journal_path}.dead" if journal_path else None)
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_max)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval_ms / 1000
+        # thread_id -> 尚未落库的写入数，读缓存未命中时据此等待，保证读到自己的写
+        self._pending: dict[str, int] = {}
+        self._pending_cond = threading.Condition()
+        self._journal_path = journal_path
+        self._journal_segment_bytes = journal_segment_bytes
+        self._journal_lock = threading.Lock()
+        # 日志段路径 -> 段内尚未落库的记录数
+        self._segments: dict[str, int] = {}
+        self._journal = None
+        self._journal_current: str | None = None
+        self._journal_seq = 0
+        # 上次进程未落库的记录，后台线程先重放
+        self._replay: list = []
+        if journal_path:
+            self._load_journal()
+            self._open_segment()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="Checkpoint-WriteBehind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ---------------- 生产者 ----------------
+    def submit(self, op: str, thread_id: str, *args) -> None:
+        if self._closed:
+            raise RuntimeError("checkpoint write-behind已关闭")
+        segment = self._journal_append((op, *args)) if self._journal is not None else None
+        with self._pending_cond:
+            self._pending[thread_id] = self._pending.get(thread_id, 0) + 1
+        item = (op, thread_id, args, segment)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            logger.warning("checkpoint写队列已满(%d)，等待落库", self._queue.maxsize)
+            self._queue.put(item)
+
+    def wait_thread(self, thread_id: str, timeout: float = 10.0) -> bool:
+        """等待某个thread已提交的写入全部落库"""
+        with self._pending_cond:
+            return self._pending_cond.wait_for(lambda: self._pending.get(thread_id, 0) == 0, timeout)
+
+    def wait_all(self, timeout: float = 10.0) -> bool:
+        with self._pending_cond:
+            return self._pending_cond.wait_for(lambda: not self._pending, timeout)
+
+    def close(self, timeout: float = 30.0) -> None:
+        """停止接收新写入，刷完队列"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error("checkpoint写队列关闭超时，剩余%d条未落库", self._queue.qsize())
+        if self._journal is not None:
+            self._journal.close()
+
+    # ---------------- 后台线程 ----------------
+    def _run(self) -> None:
+        replay, self._replay = self._replay, []
+        for i in range(0, len(replay), self._batch_size):
+            self._flush_with_retry(replay[i:i + self._batch_size])
+        if replay:
+            logger.info("checkpoint日志重放%d条", len(replay))
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is self._STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self._flush_interval
+            while len(batch) < self._batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush_with_retry(batch)
+
+    def _write(self, ops: list) -> BaseException | None:
+        """写入ops，成功返回None；暂时性错误一直退避重试，其他错误重试max_retries次后返回该异常"""
+        backoff = 0.1
+        failures = 0
+        while True:
+            try:
+                start = time.perf_counter_ns()
+                self._writer(ops)
+                logger.debug("checkpoint批量落库%d条，耗时%.2fms", len(ops), (time.perf_counter_ns() - start) / 1e6)
+                return None
+            except Exception as e:
+                if not _is_transient(e):
+                    failures += 1
+                    if failures > self._max_retries:
+                        return e
+                # 持续的暂时性错误期间队列写满，调用方被背压
+                logger.error("checkpoint落库失败（%d条），%.1fs后重试: %s", len(ops), backoff, e)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+
+    def _flush_with_retry(self, batch: list) -> None:
+        error = self._write([(op, args) for op, _, args, _ in batch])
+        if error is not None:
+            # 找出坏记录：逐条写入，其余记录照常落库
+            logger.error("checkpoint批量落库%d条持续失败，改为逐条写入: %s", len(batch), error)
+            for op, thread_id, args, _ in batch:
+                error = self._write([(op, args)])
+                if error is not None:
+                    self._dead_letter(op, thread_id, args, error)
+        self._journal_ack(batch)
+        with self._pending_cond:
+            for _, thread_id, _, _ in batch:
+                left = self._pending[thread_id] - 1
+                if left:
+                    self._pending[thread_id] = left
+                else:
+                    del self._pending[thread_id]
+            self._pending_cond.notify_all()
+
+    def _dead_letter(self, op: str, thread_id: str, args: tuple, error: BaseException) -> None:
+        """无法落库的记录写入死信文件，之后可修复数据后按日志格式重放"""
+        logger.error("checkpoint记录无法落库，转入死信（%s）：op=%s thread_id=%s: %r",
+                     self._dead_letter_path or "未配置死信文件，已丢弃", op, thread_id, error)
+        if not self._dead_letter_path:
+            return
+        try:
+            self._append_dead_letter(_frame(self._serde, (op, *args)))
+        except Exception as e:
+            logger.error("checkpoint死信写入失败：op=%s thread_id=%s: %s", op, thread_id, e)
+
+    def _append_dead_letter(self, frame: bytes) -> None:
+        with open(self._dead_letter_path, "ab") as f:
+            f.write(frame)
+            f.flush()
+            os.fsync(f.fileno())
+
+    # ---------------- 本地日志 ----------------
+    def _journal_append(self, record: tuple) -> str:
+        """追加一条记录并fsync，返回所在的日志段"""
+        frame = _frame(self._serde, record)
+        with self._journal_lock:
+            if os.fstat(self._journal.fileno()).st_size >= self._journal_segment_bytes:
+                self._open_segment()
+            self._journal.write(frame)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._segments[self._journal_current] += 1
+            return self._journal_current
+
+    def _journal_ack(self, batch: list) -> None:
+        """按已落库（含转入死信）的记录所在段计数，段内记录全部落库后清理该段"""
+        if self._journal_path is None:
+            return
+        with self._journal_lock:
+            for *_, segment in batch:
+                left = self._segments[segment] - 1
+                self._segments[segment] = left
+                if left:
+                    continue
+                if segment == self._journal_current:
+                    # 当前段的记录都已落库，清空复用
+                    if not self._journal.closed:
+                        self._journal.truncate(0)
+                else:
+                    # 已切走的段（含上次进程留下的段）全部落库，删除
+                    del self._segments[segment]
+                    self._remove_segment(segment)
+
+    def _open_segment(self) -> None:
+        """切到新的日志段，旧段留到其中的记录全部落库后删除"""
+        if self._journal is not None:
+            self._journal.close()
+            if not self._segments[self._journal_current]:
+                del self._segments[self._journal_current]
+                self._remove_segment(self._journal_current)
+        self._journal_current = f"{self._journal_path}.{self._journal_seq}"
+        self._journal_seq += 1
+        self._journal = open(self._journal_current, "ab")
+        self._segments[self._journal_current] = 0
+
+    @staticmethod
+    def _remove_segment(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning("checkpoint日志段删除失败%s: %s", path, e)
+
+    def _load_journal(self) -> None:
+        """读出上次进程各日志段（含旧版单文件日志journal_path）中未落库的记录，交给后台线程重放"""
+        directory = os.path.dirname(os.path.abspath(self._journal_path))
+        pattern = re.compile(re.escape(os.path.basename(self._journal_path)) + r"\.(\d+)")
+        numbered = sorted((int(m.group(1)), os.path.join(directory, name))
+                          for name in os.listdir(directory) if (m := pattern.fullmatch(name)))
+        # 新段编号接在旧段之后，旧段重放完才删除
+        self._journal_seq = numbered[-1][0] + 1 if numbered else 0
+        paths = [path for _, path in numbered]
+        if os.path.exists(self._journal_path):
+            paths.insert(0, self._journal_path)
+        for path in paths:
+            records = self._read_segment(path)
+            if not records:
+                self._remove_segment(path)
+                continue
+            self._segments[path] = len(records)
+            for op, args in records:
+                thread_id = _thread_of(args)
+                self._replay.append((op, thread_id, args, path))
+                self._pending[thread_id] = self._pending.get(thread_id, 0) + 1
+        if self._replay:
+            logger.info("checkpoint日志待重放%d条（%d个段）", len(self._replay), len(self._segments))
+
+    def _read_segment(self, path: str) -> list:
+        """按帧读出记录；无法反序列化的记录原样转入死信，不影响其余记录"""
+        records = []
+        with open(path, "rb") as f:
+            while header := f.read(6):
+                if len(header) < 6:
+                    break
+                type_len, data_len = struct.unpack(">HI", header)
+                type_bytes, data = f.read(type_len), f.read(data_len)
+                if len(data) < data_len:
+                    # 崩溃时写了一半的尾部记录，调用方未收到确认，丢弃
+                    break
+                try:
+                    op, *args = self._serde.loads_typed((type_bytes.decode(), data))
+                except Exception as e:
+                    logger.error("checkpoint日志记录无法解析，转入死信（%s）：%s: %r",
+                                 self._dead_letter_path or "未配置死信文件，已丢弃", path, e)
+                    if self._dead_letter_path:
+                        self._append_dead_letter(header + type_bytes + data)
+                    continue
+                records.append((op, args))
+        return records
+
+
+# 不存在会话标记最多保留条数
+_MISSING_MAX = 10000
+
+
+class _Flight:
+    """一次进行中的回源查询"""
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: CheckpointTuple | None = None
+        self.error: BaseException | None = None
 
 
 class HybridCheckpointSaver(BaseCheckpointSaver):
     def __init__(self) -> None:
         super().__init__()
         self._cache_saver = get_agent_memory()
+        settings = get_settings()
+        self._db_saver = PooledPyMySQLSaver(snapshot_every=settings.AGENT_CKPT_SNAPSHOT_EVERY,
+                                            zstd_level=settings.AGENT_CKPT_ZSTD_LEVEL)
         # 初始化时执行一次setup，确保表已创建
-        _db_saver = PyMySQLSaver(conn=mysql_manager.engine.pool.connect())
-        _db_saver.setup()
+        self._db_saver.setup()
+        self._write_behind: CheckpointWriteBehind | None = None
+        if settings.AGENT_CKPT_WRITE_MODE == "write_behind":
+            self._write_behind = CheckpointWriteBehind(
+                writer=self._db_saver.write_batch,
+                serde=self.serde,
+                queue_max=settings.AGENT_CKPT_QUEUE_MAX,
+                batch_size=settings.AGENT_CKPT_FLUSH_BATCH,
+                flush_interval_ms=settings.AGENT_CKPT_FLUSH_INTERVAL_MS,
+                journal_path=settings.AGENT_CKPT_JOURNAL_PATH,
+                max_retries=settings.AGENT_CKPT_FLUSH_MAX_RETRIES,
+                dead_letter_path=settings.AGENT_CKPT_DEAD_LETTER_PATH,
+                journal_segment_bytes=settings.AGENT_CKPT_JOURNAL_SEGMENT_MB << 20,
+            )
+        elif settings.AGENT_CKPT_WRITE_MODE != "sync":
+            raise ValueError(f"非法的AGENT_CKPT_WRITE_MODE={settings.AGENT_CKPT_WRITE_MODE}")
+        # 回源合并与不存在会话的短期缓存
+        self._flights: dict[tuple, _Flight] = {}
+        self._flights_lock = threading.Lock()
+        self._missing: OrderedDict[str, float] = OrderedDict()
+        self._missing_ttl = settings.AGENT_CKPT_MISSING_TTL_S
+        self._write_epoch = 0
+        # 异步接口的数据库操作在独立线程池执行，大小与连接池一致，只在单次读写期间占用线程
+        self._io_executor = ThreadPoolExecutor(max_workers=settings.MYSQL_POOL_SIZE + settings.MYSQL_MAX_OVERFLOW,
+                                               thread_name_prefix="Checkpoint-IO")
 
     def get_db_saver(self) -> PyMySQLSaver:
-        # 每次调用都从连接池获取新连接，确保线程安全
-        return PyMySQLSaver(conn=mysql_manager.engine.pool.connect())
+        # 共享实例，连接在每次操作内借还
+        return self._db_saver
 
     def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
         tup = self._cache_saver.get_tuple(config)
-        if tup is None:
+        if tup is not None:
+            return tup
+        return self._load_through(config)
+
+    def _load_through(self, config: RunnableConfig) -> CheckpointTuple | None:
+        """缓存未命中后回源MySQL并回填缓存"""
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        latest = not checkpoint_id
+        if latest and self._is_known_missing(thread_id):
+            return None
+
+        # 同一会话并发回源只查一次库，其余请求等待结果
+        key = (thread_id, checkpoint_ns, checkpoint_id)
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            epoch = self._write_epoch
+            if self._write_behind is not None:
+                # 缓存未命中时，先等该会话排队中的写入落库，避免读到旧数据
+                self._write_behind.wait_thread(thread_id)
             tup = self.get_db_saver().get_tuple(config)
-            if tup is None:
-                return None
-            self._cache_saver.put(tup.config, tup.checkpoint, tup.metadata, {})
-        return tup
+            if tup is not None:
+                # 只有最新checkpoint进缓存，按checkpoint_id查历史版本不污染缓存
+                if latest:
+                    self._fill_cache(tup)
+            elif latest and epoch == self._write_epoch:
+                # 回源期间没有任何写入时才记为不存在
+                self._mark_missing(thread_id)
+            flight.result = tup
+            return tup
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _fill_cache(self, tup: CheckpointTuple) -> None:
+        fill = getattr(self._cache_saver, "fill", None)
+        if fill is not None:
+            fill(tup)
+            return
+        # 缓存层没有fill接口时退化为put，所有通道都视为新版本，才会写入通道值
+        next_config = self._cache_saver.put(tup.config, tup.checkpoint, tup.metadata,
+                                            tup.checkpoint["channel_versions"])
+        writes_by_task: dict[str, list] = {}
+        for task_id, channel, value in tup.pending_writes or []:
+            writes_by_task.setdefault(task_id, []).append((channel, value))
+        for task_id, writes in writes_by_task.items():
+            self._cache_saver.put_writes(next_config, writes, task_id)
+
+    def _is_known_missing(self, thread_id: str) -> bool:
+        with self._flights_lock:
+            expire_at = self._missing.get(thread_id)
+            if expire_at is None:
+                return False
+            if expire_at > time.monotonic():
+                return True
+            del self._missing[thread_id]
+            return False
+
+    def _mark_missing(self, thread_id: str) -> None:
+        with self._flights_lock:
+            self._missing[thread_id] = time.monotonic() + self._missing_ttl
+            self._missing.move_to_end(thread_id)
+            while len(self._missing) > _MISSING_MAX:
+                self._missing.popitem(last=False)
+
+    def _on_write(self, thread_id: str) -> None:
+        """写入前调用：清掉该会话的不存在标记，并让回源中的请求放弃记录不存在"""
+        self._write_epoch += 1
+        if self._missing:
+            with self._flights_lock:
+                self._missing.pop(thread_id, None)
 
     def list(
             self,
@@ -40,7 +615,11 @@ class HybridCheckpointSaver(BaseCheckpointSaver):
             before: RunnableConfig | None = None,
             limit: int | None = None,
     ) -> Iterator[CheckpointTuple]:
-
+        if self._write_behind is not None:
+            if config is not None:
+                self._write_behind.wait_thread(config["configurable"]["thread_id"])
+            else:
+                self._write_behind.wait_all()
         return self.get_db_saver().list(config, filter=filter, before=before, limit=limit)
 
     def put(
@@ -50,6 +629,12 @@ class HybridCheckpointSaver(BaseCheckpointSaver):
             metadata: CheckpointMetadata,
             new_versions: ChannelVersions,
     ) -> RunnableConfig:
+        self._on_write(config["configurable"]["thread_id"])
+        if self._write_behind is not None:
+            next_config = self._cache_saver.put(config, checkpoint, metadata, new_versions)
+            self._write_behind.submit("put", config["configurable"]["thread_id"],
+                                      config, checkpoint, metadata, new_versions)
+            return next_config
         self.get_db_saver().put(config, checkpoint, metadata, new_versions)
         return self._cache_saver.put(config, checkpoint, metadata, new_versions)
 
@@ -60,7 +645,12 @@ class HybridCheckpointSaver(BaseCheckpointSaver):
             task_id: str,
             task_path: str = "",
     ) -> None:
-
+        self._on_write(config["configurable"]["thread_id"])
+        if self._write_behind is not None:
+            self._cache_saver.put_writes(config, writes, task_id, task_path)
+            self._write_behind.submit("put_writes", config["configurable"]["thread_id"],
+                                      config, writes, task_id, task_path)
+            return None
         self.get_db_saver().put_writes(config, writes, task_id, task_path)
         return self._cache_saver.put_writes(config, writes, task_id, task_path)
 
@@ -68,9 +658,62 @@ class HybridCheckpointSaver(BaseCheckpointSaver):
             self,
             thread_id: str,
     ) -> None:
+        if self._write_behind is not None:
+            self._write_behind.wait_thread(thread_id)
         self.get_db_saver().delete_thread(thread_id)
+        self.evict_thread(thread_id)
+
+    def evict_thread(self, thread_id: str) -> None:
+        """库中数据已删除后，清掉该会话的缓存和增量编码记录，并记为不存在"""
+        self._on_write(thread_id)
         self._cache_saver.delete_thread(thread_id)
-        raise NotImplementedError
+        self._db_saver.forget_thread(thread_id)
+        self._mark_missing(thread_id)
+
+    # ---------------- 异步接口 ----------------
+    async def _run_io(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._io_executor, functools.partial(func, *args, **kwargs))
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        # 缓存命中直接返回，未命中再到线程池回源（含并发合并）
+        tup = await self._cache_saver.aget_tuple(config)
+        if tup is not None:
+            return tup
+        return await self._run_io(self._load_through, config)
+
+    async def alist(
+            self,
+            config: RunnableConfig | None,
+            *,
+            filter: dict[str, Any] | None = None,
+            before: RunnableConfig | None = None,
+            limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await self._run_io(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(
+            self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await self._run_io(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+            self,
+            config: RunnableConfig,
+            writes: Sequence[tuple[str, Any]],
+            task_id: str,
+            task_path: str = "",
+    ) -> None:
+        return await self._run_io(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return await self._run_io(self.delete_thread, thread_id)
 
     def get_next_version(self, current: str | None, channel: None) -> str:
         if current is None:
@@ -0,0 +1,124 @@
+"""
+提示词前缀缓存
+
+- 静态前缀（路由提示词、子agent系统提示词和工具定义）只构建一次，并保证字节稳定：
+  子agent按id、工具按名称排序，不随注册/查询顺序变化，多进程之间也一致
+- DashScope对qwen-max/plus/turbo等模型默认开启隐式前缀缓存，前缀一致即可命中；
+  LLM_PROMPT_CACHE_EXPLICIT开启时在系统消息上加cache_control做显式缓存（创建缓存有额外费用）
+- PromptTokenTracker按请求统计提示词token中命中缓存的部分，同时汇总到进程级统计
+"""
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.outputs import LLMResult
+
+from app.infra.llm import usage_of
+from app.infra.log import logger
+from app.infra.settings import get_settings
+
+
+def cacheable_system_message(text: str) -> SystemMessage:
+    """静态系统提示词；开启显式缓存时标记cache_control"""
+    if get_settings().LLM_PROMPT_CACHE_EXPLICIT:
+        return SystemMessage(content=[{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}])
+    return SystemMessage(content=text)
+
+
+@dataclass
+class TokenUsage:
+    calls: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    output_tokens: int = 0
+
+    def add(self, prompt: int, cached: int, output: int) -> None:
+        self.calls += 1
+        self.prompt_tokens += prompt
+        self.cached_tokens += cached
+        self.output_tokens += output
+
+    def to_dict(self) -> dict:
+        d = asdict(self)
+        d["uncached_tokens"] = self.prompt_tokens - self.cached_tokens
+        d["cache_rate"] = round(self.cached_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0
+        return d
+
+
+class PromptCacheStats:
+    """进程级按模型汇总"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_model: Dict[str, TokenUsage] = {}
+
+    def record(self, model: str, prompt: int, cached: int, output: int) -> None:
+        with self._lock:
+            self._by_model.setdefault(model, TokenUsage()).add(prompt, cached, output)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {model: usage.to_dict() for model, usage in self._by_model.items()}
+
+
+prompt_cache_stats = PromptCacheStats()
+
+
+class PromptTokenTracker(BaseCallbackHandler):
+    """
+    单次请求的token统计，放在RunnableConfig的callbacks中，会传递给子图里的所有模型调用
+
+    run_inline：回调在调用方协程/线程中直接执行，不额外占用线程池
+    """
+
+    run_inline = True
+
+    def __init__(self, request_id: str = ""):
+        self.request_id = request_id
+        self._lock = threading.Lock()
+        self._models: Dict[UUID, str] = {}
+        self.by_model: Dict[str, TokenUsage] = {}
+        self._start = time.perf_counter_ns()
+
+    def on_chat_model_start(self, serialized: dict, messages: list[list[BaseMessage]], *, run_id: UUID,
+                            metadata: Optional[dict] = None, **kwargs: Any) -> None:
+        model = (metadata or {}).get("ls_model_name") or (serialized or {}).get("name", "unknown")
+        with self._lock:
+            self._models[run_id] = model
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            model = self._models.pop(run_id, "unknown")
+        for generations in response.generations:
+            for generation in generations:
+                usage = usage_of(generation, response.llm_output)
+                if usage is None:
+                    continue
+                with self._lock:
+                    self.by_model.setdefault(model, TokenUsage()).add(*usage)
+                prompt_cache_stats.record(model, *usage)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._models.pop(run_id, None)
+
+    def summary(self) -> dict:
+        with self._lock:
+            total = TokenUsage()
+            for usage in self.by_model.values():
+                total.calls += usage.calls
+                total.prompt_tokens += usage.prompt_tokens
+                total.cached_tokens += usage.cached_tokens
+                total.output_tokens += usage.output_tokens
+            by_model = {model: usage.to_dict() for model, usage in self.by_model.items()}
+        return {"total": total.to_dict(), "by_model": by_model,
+                "ms": round((time.perf_counter_ns() - self._start) / 1e6, 2)}
+
+    def log(self) -> None:
+        summary = self.summary()
+        if summary["total"]["calls"]:
+            logger.info("请求%s模型token：%s", self.request_id, summary)
@@ -0,0 +1,70 @@
+"""
+路由大模型输出的增量解析
+
+输出格式为 {"route_agent_id": "...", "reason_and_mode": "..."}，id在前。
+流式读取时id一写完就可以分发给子agent，不用等理由写完。
+"""
+import json
+import re
+from typing import Iterable, Optional
+
+from langchain_core.utils.json import parse_json_markdown
+
+ROUTE_AGENT_ID = "route_agent_id"
+REASON_AND_MODE = "reason_and_mode"
+
+# 模型偶尔照着示例输出单引号等不合法的json，按字段名兜底提取；值可能还没写完，取到末尾为止
+_FIELD_PATTERNS = {
+    key: re.compile(r"""['"]?%s['"]?\s*[:：]\s*['"]([^'"]*)""" % key)
+    for key in (ROUTE_AGENT_ID, REASON_AND_MODE)
+}
+
+
+def _parse_fields(text: str) -> dict:
+    try:
+        parsed = parse_json_markdown(text)
+        if isinstance(parsed, dict):
+            return parsed
+    except (json.JSONDecodeError, ValueError):
+        pass
+    fields = {}
+    for key, pattern in _FIELD_PATTERNS.items():
+        m = pattern.search(text)
+        if m:
+            fields[key] = m.group(1)
+    return fields
+
+
+class RouteStreamParser:
+    """
+    逐块喂入模型输出，agent_id确定后即可分发，reason随后续输出增长
+
+    id确定的条件：后面已经出现了理由字段；或者id恰好是已注册的某个子agent，且不是其他id的前缀。
+    """
+
+    def __init__(self, agent_ids: Iterable[str]):
+        self._agent_ids = set(agent_ids)
+        self.text = ""
+        self.agent_id: Optional[str] = None
+        self.reason = ""
+
+    def feed(self, delta: str) -> None:
+        self.text += delta
+        fields = _parse_fields(self.text)
+        reason = fields.get(REASON_AND_MODE)
+        if isinstance(reason, str):
+            self.reason = reason
+        if self.agent_id is None:
+            candidate = fields.get(ROUTE_AGENT_ID)
+            if isinstance(candidate, str) and candidate in self._agent_ids and (
+                    REASON_AND_MODE in fields
+                    or not any(other != candidate and other.startswith(candidate) for other in self._agent_ids)):
+                self.agent_id = candidate
+
+    def finish(self) -> Optional[str]:
+        """输出结束后再判断一次（前缀冲突的id要等到结束才能确定），返回最终的agent_id"""
+        if self.agent_id is None:
+            candidate = _parse_fields(self.text).get(ROUTE_AGENT_ID)
+            if isinstance(candidate, str) and candidate in self._agent_ids:
+                self.agent_id = candidate
+        return self.agent_id
@@ -1,19 +1,34 @@
+import asyncio
+import dataclasses
 import json
-import os
+import logging
+import threading
+import time
+import uuid
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
 from dataclasses import dataclass
-from typing import Optional, Annotated, List
+from typing import Optional, Annotated, List, AsyncIterator, Any, Callable
 
-from langchain_core.messages import AnyMessage, AIMessage, HumanMessage
+from langchain_core.messages import AnyMessage, AIMessage, HumanMessage, ToolMessage
 from langchain_core.runnables import RunnableConfig
-from langchain_openai import ChatOpenAI
+from langgraph.config import get_stream_writer
 from langgraph.constants import START, END
 from langgraph.graph import add_messages
 from langgraph.graph.state import CompiledStateGraph, StateGraph
 from pydantic import BaseModel
 
 from app.conversation.dao.message_dao import MsgChunkType, MessageStreamChunk
+from app.agent.fast_router import FastRouter, RouteDecision
+from app.agent.prompt_cache import PromptTokenTracker, cacheable_system_message
+from app.agent.route_parser import REASON_AND_MODE, RouteStreamParser
+from app.agent.routing_cache import RoutingCache
 from app.agent.mysql_agent_saver import get_hybrid_checkpoint_saver
+from app.infra.embd import embed
+from app.infra.llm import LLM_ROUTER, get_llm
+from app.infra.log import logger
+from app.infra.settings import get_settings
 
 
 @dataclass
@@ -24,6 +39,8 @@ class AgentInfo:
     trigger_conditions: list[str]
     example: str
     agent: CompiledStateGraph
+    # 热更新：依赖的外部数据（如知识库工具集）有变化时返回重建的子agent图，没有变化返回None
+    reload: Optional[Callable[[], Optional[CompiledStateGraph]]] = None
 
 
 class BaseSubAgent(ABC):
@@ -43,6 +60,10 @@ class BaseSubAgent(ABC):
 class RouterRegistry:
     """子agent路由注册器，支持基于继承的自动注册"""
     _routers: dict[str, AgentInfo] = {}
+    # 注册信息版本号，每次注册递增，路由缓存据此失效
+    _version: int = 0
+    # 子agent并行注册
+    _lock = threading.Lock()
 
     @classmethod
     def register(cls,
@@ -51,12 +72,25 @@ class RouterRegistry:
                  description: str,
                  trigger_conditions: list[str],
                  example: str,
-                 agent: CompiledStateGraph):
+                 agent: CompiledStateGraph,
+                 reload: Optional[Callable[[], Optional[CompiledStateGraph]]] = None):
         """注册子 agent"""
-        agent_info = AgentInfo(id, name, description, trigger_conditions, example, agent)
-        cls._routers[agent_info.id] = agent_info
+        agent_info = AgentInfo(id, name, description, trigger_conditions, example, agent, reload)
+        with cls._lock:
+            cls._routers[agent_info.id] = agent_info
+            cls._version += 1
         return agent_info
 
+    @classmethod
+    def replace_agent(cls, id: str, agent: CompiledStateGraph) -> None:
+        """只替换子agent的图（如工具集变化），路由信息不变，版本号不变，路由缓存继续有效"""
+        with cls._lock:
+            cls._routers[id] = dataclasses.replace(cls._routers[id], agent=agent)
+
+    @classmethod
+    def version(cls) -> int:
+        return cls._version
+
     @classmethod
     def get_all_subclasses(cls, base_class):
         """递归获取所有子类（包括子类的子类）"""
@@ -72,7 +106,7 @@ class RouterRegistry:
         工作流程：
         1. 导入 sub_agent 包（包的 __init__.py 会自动导入所有子模块）
         2. 通过 BaseSubAgent.__subclasses__() 获取所有子类
-        3. 调用每个子类的 register_to_router 类方法
+        3. 在线程池中同时调用各子类的 register_to_router 类方法（各自建模型、查库、编译图，互不依赖）
         """
         # 导入 sub_agent 包，包的 __init__.py 会自动导入所有子模块
         import app.agent.sub_agent  # noqa: F401
@@ -80,24 +114,31 @@ class RouterRegistry:
         # 获取所有 BaseSubAgent 的子类（包括递归子类）
         sub_agent_classes = cls.get_all_subclasses(BaseSubAgent)
         
-        # 调用每个子类的注册类方法
-        registered_count = 0
-        for sub_agent_class in sub_agent_classes:
+        if not sub_agent_classes:
+            return 0
+
+        def register(sub_agent_class) -> bool:
+            start = time.perf_counter()
             try:
                 sub_agent_class.register_to_router(cls)
-                registered_count += 1
-                print(f"Registered sub-agent: {sub_agent_class.__name__}")
+                logger.info("注册子agent %s，耗时%.2fs", sub_agent_class.__name__, time.perf_counter() - start)
+                return True
             except Exception as e:
-                print(f"Warning: Failed to register {sub_agent_class.__name__}: {e}")
-        
-        return registered_count
+                logger.exception("注册子agent %s失败: %s", sub_agent_class.__name__, e)
+                return False
+
+        # 调用每个子类的注册类方法
+        with ThreadPoolExecutor(max_workers=min(get_settings().STARTUP_MAX_WORKERS, len(sub_agent_classes)),
+                                thread_name_prefix="sub-agent-register") as pool:
+            return sum(pool.map(register, sub_agent_classes))
 
     @classmethod
     def list(cls) -> tuple[list[CompiledStateGraph], list[str], list[str]]:
         agents: list[CompiledStateGraph] = []
         trigger_condition_prompts: list[str] = []
         example_prompts: list[str] = []
-        for agent_id, agent_info in cls._routers.items():
+        # 按id排序，路由提示词与注册顺序无关，保证字节稳定（前缀缓存）
+        for agent_id, agent_info in sorted(cls._routers.items()):
             agents.append(agent_info.agent)
             condition_prompt = f"""**启动【{agent_info.name}】模式（模式名为【{agent_info.name}】，id为{agent_info.id}），{agent_info.description},如果请求满足以下任一条件：**\n"""
             for condition in agent_info.trigger_conditions:
@@ -119,6 +160,11 @@ class RouterState(BaseModel):
     messages: Annotated[List[AnyMessage], add_messages] = []
     thread_id:str = None
 
+# 当前aexec请求创建的路由理由后台任务（路由消息id），请求提前结束时据此取消；
+# 路由节点在图的子任务中执行，继承aexec所在的上下文，共享同一个集合
+_request_reason_tasks: ContextVar[Optional[set]] = ContextVar("request_reason_tasks", default=None)
+
+
 class RouterService:
     def build_routing_prompt(self, trigger_condition_prompts: list[str], example_prompts: list[str]):
         prompt = """
@@ -148,18 +194,164 @@ class RouterService:
     ROUTE_NODE:str = "route_node"
     ROUTE_AGENT_ID:str = "route_agent_id"
 
+    # 路由消息的additional_kwargs标记：提前分发，理由还在生成
+    REASON_PENDING:str = "reason_pending"
+    # custom流事件：提前分发后补发的完整路由消息
+    ROUTER_REASON:str = "router_reason"
+
+    def __init__(self):
+        self._fast_router: Optional[FastRouter] = None
+        self._routing_cache: Optional[RoutingCache] = None
+        # 后台接收路由理由的任务（按路由消息id），由aexec取走
+        self._reason_tasks: dict[str, asyncio.Task] = {}
+
+    def routing_stats(self) -> dict:
+        """各级路由命中情况：快速通道各级占比、路由缓存命中率"""
+        return {
+            "fast_path": self._fast_router.stats() if self._fast_router is not None else None,
+            "cache": self._routing_cache.stats() if self._routing_cache is not None else None,
+        }
+
+    async def _route(self, state: RouterState, router_model, router_prompt: str) -> RouteDecision:
+        """
+        问题级缓存（仅会话的第一轮） -> 快速通道（embedding分类，不明确时会话粘滞） -> 路由大模型，依次尝试
+
+        已有上一轮子agent的会话不查问题级缓存："继续"、"那明天呢"这类追问的含义取决于本会话的上下文，
+        不能沿用其他会话对同一句话的路由结果，交给会话粘滞/embedding分类决定
+        """
+        agents = RouterRegistry.all()
+        cached_thread_agent = None
+        if self._routing_cache is not None:
+            cached_thread_agent = self._routing_cache.get_thread(state.thread_id)
+
+        # 上一轮的子agent：会话级缓存，没有时用state.route_agent_id（上一轮的路由结果，随checkpoint保存）
+        previous_agent_id = cached_thread_agent if cached_thread_agent in agents else state.route_agent_id
+        if self._routing_cache is not None and previous_agent_id not in agents:
+            agent_id = self._routing_cache.get_question(state.user_question)
+            if agent_id in agents:
+                self._routing_cache.put(state.thread_id, state.user_question, agent_id, by_question=False)
+                return RouteDecision(agent_id, agents[agent_id].name, "cache_question")
+        decision = None
+        if self._fast_router is not None:
+            # embedding分类明确时以分类为准，可以切换子agent；不明确时才沿用上一轮的子agent
+            decision = await self._fast_router.aroute(state.user_question, previous_agent_id)
+        elif cached_thread_agent in agents:
+            # 没有快速通道时，会话级缓存直接作为粘滞结果
+            decision = RouteDecision(cached_thread_agent, agents[cached_thread_agent].name, "cache_thread")
+        if self._routing_cache is not None:
+            self._routing_cache.record_thread_hit(
+                decision is not None and decision.tier in ("sticky", "cache_thread")
+                and decision.agent_id == cached_thread_agent)
+        if decision is None:
+            decision = await self._llm_route(state, router_model, router_prompt, agents)
+
+        if self._routing_cache is not None and decision.tier != "single" and decision.agent_id in agents:
+            self._routing_cache.put(state.thread_id, state.user_question, decision.agent_id,
+                                    by_question=decision.tier in ("embedding", "llm"))
+        return decision
+
+    async def _llm_route(self, state: RouterState, router_model, router_prompt: str,
+                         agents: dict[str, AgentInfo]) -> RouteDecision:
+        """
+        流式调用路由大模型，route_agent_id一解析出来就返回（分发给子agent），
+        理由在后台继续接收，写完后通过custom流推送（见aexec）
+        """
+        parser = RouteStreamParser(agents)
+        messages = [cacheable_system_message(router_prompt), HumanMessage(content=state.user_question)]
+        stream = router_model.astream(messages).__aiter__()
+        message_id = None
+        # 提前分发时流还没读完，理由待补发
+        pending = False
+        async for chunk in stream:
+            message_id = message_id or chunk.id
+            parser.feed(chunk.text)
+            if parser.agent_id is not None:
+                pending = True
+                break
+        agent_id = parser.agent_id if pending else parser.finish()
+
+        tier = "llm"
+        if agent_id is None:
+            # 输出不合法或id未注册：沿用上一轮的子agent，没有则用第一个
+            agent_id = state.route_agent_id if state.route_agent_id in agents else next(iter(agents))
+            tier = "fallback"
+            logger.warning("路由大模型输出无法解析，回退到%s：%s", agent_id, parser.text)
+        decision = RouteDecision(agent_id, agents[agent_id].name, tier)
+
+        content = {self.ROUTE_AGENT_ID: agent_id, REASON_AND_MODE: parser.reason or decision.default_reason}
+        decision.message = AIMessage(content=json.dumps(content, ensure_ascii=False), id=message_id or str(uuid.uuid4()),
+                                     additional_kwargs={self.REASON_PENDING: pending})
+        if pending:
+            self._reason_tasks[decision.message.id] = asyncio.create_task(
+                self._finish_reason(stream, parser, decision, get_stream_writer()))
+            owned = _request_reason_tasks.get()
+            if owned is not None:
+                owned.add(decision.message.id)
+        return decision
+
+    async def _finish_reason(self, stream: AsyncIterator, parser: RouteStreamParser, decision: RouteDecision,
+                             writer: Callable[[Any], None]) -> str:
+        """接收剩余的理由，返回完整的路由消息内容"""
+        try:
+            async for chunk in stream:
+                parser.feed(chunk.text)
+        except Exception as e:
+            logger.warning("路由理由接收失败: %s", e)
+        content = {self.ROUTE_AGENT_ID: decision.agent_id, REASON_AND_MODE: parser.reason or decision.default_reason}
+        content = json.dumps(content, ensure_ascii=False)
+        writer({self.ROUTER_REASON: content, "id": decision.message.id})
+        return content
+
+    async def _pending_reason(self, router_message: AIMessage) -> str:
+        """图已结束但理由还没补发：等后台任务接收完，失败时用分发时已有的部分"""
+        task = self._reason_tasks.pop(router_message.id, None)
+        if task is None:
+            return router_message.content
+        try:
+            return await task
+        except Exception as e:
+            logger.warning("路由理由接收失败: %s", e)
+            return router_message.content
+
     def create_router(self):
 
         agents, trigger_condition_prompts, example_prompts = RouterRegistry.list()
         router_prompt = self.build_routing_prompt(trigger_condition_prompts, example_prompts)
 
-        router_model = ChatOpenAI(openai_api_base="https://dashscope.aliyuncs.com/compatible-mode/v1",
-                                  model="qwen1.5-32b-chat",
-                                  api_key=os.getenv("DASHSCOPE_API_KEY"))
+        settings = get_settings()
+        router_model = get_llm(LLM_ROUTER)
+        if settings.ROUTER_LLM_JSON_MODE:
+            # 约束输出为json对象，需要模型支持response_format
+            router_model = router_model.bind(response_format={"type": "json_object"})
+
+        self._fast_router = FastRouter(RouterRegistry.all(), embed,
+                                       threshold=settings.ROUTER_EMBED_THRESHOLD,
+                                       margin=settings.ROUTER_EMBED_MARGIN) if settings.ROUTER_FAST_PATH else None
+        self._routing_cache = RoutingCache(RouterRegistry.version, max_size=settings.ROUTER_CACHE_MAX_SIZE,
+                                           thread_ttl_s=settings.ROUTER_CACHE_THREAD_TTL_S,
+                                           question_ttl_s=settings.ROUTER_CACHE_QUESTION_TTL_S) \
+            if settings.ROUTER_CACHE_MAX_SIZE > 0 else None
 
-        def route_node(state: RouterState):
-            ai_message:AIMessage = router_model.invoke(input=router_prompt + state.user_question)
-            return {"router_ai_message":ai_message}
+        self._router_model = router_model
+        self._router_prompt = router_prompt
+        router_agent = self.compile_router()
+        if logger.isEnabledFor(logging.DEBUG):
+            # 画图要遍历子图，只在调试时输出
+            logger.debug("路由图：\n%s", router_agent.get_graph(xray=True).draw_ascii())
+        return router_agent
+
+    def warm_up(self) -> None:
+        """启动时预先计算快速通道的样例向量，避免由首个请求承担"""
+        if self._fast_router is not None:
+            self._fast_router.warm_up()
+
+    def compile_router(self) -> CompiledStateGraph:
+        """按当前注册的子agent编译路由图；子agent热更新时只重新编译图，路由模型、快速通道、路由缓存沿用"""
+        router_model, router_prompt = self._router_model, self._router_prompt
+
+        async def route_node(state: RouterState):
+            decision = await self._route(state, router_model, router_prompt)
+            return {"router_ai_message": decision.to_message(), "route_agent_id": decision.agent_id}
 
         router_graph = StateGraph(RouterState)
         router_graph.add_edge(START, self.ROUTE_NODE)
@@ -175,39 +367,96 @@ class RouterService:
             router_graph.add_edge(agent_id, END)
             route_path_map[agent_id] = agent_id
         def route_conditional_edge(state: RouterState):
-            return json.loads(state.router_ai_message.content).get(self.ROUTE_AGENT_ID)
+            return state.route_agent_id
         router_graph.add_conditional_edges(self.ROUTE_NODE, route_conditional_edge, route_path_map)
         # 为router_graph添加checkpointer，确保子agent能够从checkpointer加载历史状态
         # 虽然router_graph本身不需要保存状态，但是有了checkpointer后，LangGraph会为子graph加载历史状态
         # 使用全局单例，与子agent共享同一个checkpointer实例
         router_checkpointer = get_hybrid_checkpoint_saver()
-        router_agent = router_graph.compile(checkpointer=router_checkpointer)
-        router_agent.get_graph(xray=True).print_ascii()
-        return router_agent
+        return router_graph.compile(checkpointer=router_checkpointer)
 
-    def exec(self, question: str, conversation_id: str):
+    async def aexec(self, question: str, conversation_id: str) -> AsyncIterator[MessageStreamChunk]:
+        """
+        异步执行路由图：模型、checkpoint读写都不占用请求线程，SSE流可以大量并发
+
+        子agent的回答按token增量返回，同一条消息的多个增量id相同
+        """
         # 配置对话id，用于记忆对话上下文
-        config = RunnableConfig(configurable={"thread_id": conversation_id})
+        tracker = PromptTokenTracker(conversation_id)
+        config = RunnableConfig(configurable={"thread_id": conversation_id}, callbacks=[tracker])
+        owned_reason_tasks: set[str] = set()
+        _request_reason_tasks.set(owned_reason_tasks)
 
         router_state = RouterState(
             user_question=question,
-            route_agent_id=None,
-            reason_and_mode=None,
             messages=[HumanMessage(content=question)],
             thread_id=conversation_id
         )
-        for event in router_graph_manager.get_router().stream(router_state, config=config):
-            #print(f"=========event:{event}")
-            for graph_node, graph_state in event.items():
-                if graph_node == self.ROUTE_NODE:
-                    message = graph_state['router_ai_message']
-                    type = MsgChunkType.ROUTER
+        # updates：路由节点一结束就推送路由说明；messages：子agent模型逐token推送，工具结果整条推送；
+        # custom：路由提前分发时，理由写完后补发的路由说明
+        router_message: Optional[AIMessage] = None
+        reason: Optional[str] = None
+        # 路由说明补发前，子agent的输出先暂存，保证前端先看到路由说明
+        held: list[MessageStreamChunk] = []
+        try:
+            router_graph = await router_graph_manager.aget_router()
+            async for namespace, mode, data in router_graph.astream(
+                    router_state, config=config, stream_mode=["updates", "messages", "custom"], subgraphs=True):
+                if mode == "updates":
+                    if not namespace and self.ROUTE_NODE in data:
+                        message = data[self.ROUTE_NODE]['router_ai_message']
+                        if message.additional_kwargs.get(self.REASON_PENDING) and reason is None:
+                            router_message = message
+                        else:
+                            content = reason if reason is not None else message.content
+                            yield MessageStreamChunk.from_attrs(MsgChunkType.ROUTER, content, message.id)
+                    continue
+
+                if mode == "custom":
+                    if not namespace and isinstance(data, dict) and self.ROUTER_REASON in data:
+                        if router_message is None:
+                            # 理由先于路由节点的updates到达
+                            reason = data[self.ROUTER_REASON]
+                            self._reason_tasks.pop(data["id"], None)
+                            continue
+                        yield MessageStreamChunk.from_attrs(MsgChunkType.ROUTER, data[self.ROUTER_REASON], data["id"])
+                        self._reason_tasks.pop(data["id"], None)
+                        router_message = None
+                        for chunk in held:
+                            yield chunk
+                        held.clear()
+                    continue
+
+                message, metadata = data
+                # 路由模型的输出是json，不逐token推送；中间件节点（如摘要，名称形如 XxxMiddleware.before_model）的模型调用也不推送
+                if not namespace or "." in metadata.get("langgraph_node", ""):
+                    continue
+                if isinstance(message, ToolMessage):
+                    chunk = MessageStreamChunk.from_attrs(MsgChunkType.TOOL, message.text, message.id)
+                elif isinstance(message, AIMessage) and message.text:
+                    chunk = MessageStreamChunk.from_attrs(MsgChunkType.AI, message.text, message.id)
+                else:
+                    continue
+                if router_message is not None:
+                    held.append(chunk)
                 else:
-                    message = graph_state['messages'][-1]
-                    type = MsgChunkType.AI if isinstance(message, AIMessage) else MsgChunkType.TOOL
+                    yield chunk
+
+            # 子agent先于理由结束，custom事件随图结束被丢弃，直接等后台任务
+            if router_message is not None:
+                content = await self._pending_reason(router_message)
+                yield MessageStreamChunk.from_attrs(MsgChunkType.ROUTER, content, router_message.id)
+                for chunk in held:
+                    yield chunk
+        finally:
+            # 客户端断开等提前结束时，取消本次请求还没取走的后台任务（包括路由节点的updates事件还没推送的），
+            # 不再继续接收路由模型的输出、占用模型并发名额
+            for message_id in owned_reason_tasks:
+                task = self._reason_tasks.pop(message_id, None)
+                if task is not None and not task.done():
+                    task.cancel()
+            tracker.log()
 
-                main_message_chunk = MessageStreamChunk.from_attrs(type, message.content, message.id)
-                yield main_message_chunk
 
 class RouterGraphManager:
     """Router Graph 管理器，支持显式初始化和延迟初始化"""
@@ -215,27 +464,85 @@ class RouterGraphManager:
     def __init__(self):
         self._router_graph: Optional[CompiledStateGraph] = None
         self._initialized = False
+        # 后台预热线程和就绪前到达的请求可能同时触发初始化，只执行一次
+        self._init_lock = threading.Lock()
         self._router_service = RouterService()
+        # 热更新：图版本号、后台重建线程及唤醒事件
+        self._graph_version = 0
+        self._reload_event = threading.Event()
+        self._reload_thread: Optional[threading.Thread] = None
     
     def initialize(self):
         """显式初始化 router_graph，会自动扫描并注册所有子 agent"""
         if self._initialized:
             return
-        
-        # 自动扫描并注册所有 BaseSubAgent 的子类
-        registered_count = RouterRegistry.auto_register_all_sub_agents()
-        
-        if registered_count == 0:
-            raise RuntimeError("No sub-agents registered. Please ensure at least one sub-agent inherits from BaseSubAgent.")
-        
-        self._router_graph = self._router_service.create_router()
-        self._initialized = True
+        with self._init_lock:
+            if self._initialized:
+                return
+            # 自动扫描并注册所有 BaseSubAgent 的子类
+            registered_count = RouterRegistry.auto_register_all_sub_agents()
+
+            if registered_count == 0:
+                raise RuntimeError("No sub-agents registered. Please ensure at least one sub-agent inherits from BaseSubAgent.")
+
+            self._router_graph = self._router_service.create_router()
+            self._graph_version = 1
+            self._reload_thread = threading.Thread(target=self._reload_loop, name="router-reload", daemon=True)
+            self._reload_thread.start()
+            self._initialized = True
+
+    def request_reload(self) -> None:
+        """
+        请求热更新（如知识库空间增删改后），立即返回；由后台线程询问各子agent是否需要重建，
+        有重建时重新编译路由图并原子替换。进行中的对话已持有旧图，继续用旧图跑完，不受影响
+        """
+        self._reload_event.set()
+
+    def _reload_loop(self) -> None:
+        # 多进程部署时变更只通知到处理请求的进程，其他进程靠定时检查同步
+        interval = get_settings().AGENT_RELOAD_INTERVAL_S
+        while True:
+            self._reload_event.wait(timeout=interval if interval > 0 else None)
+            # 先清除再重建：重建期间的新请求会在下一轮处理，多次请求合并成一次
+            self._reload_event.clear()
+            try:
+                self.reload()
+            except Exception as e:
+                logger.exception("子agent热更新失败: %s", e)
+
+    def reload(self) -> bool:
+        """同步执行一次热更新，返回是否替换了路由图"""
+        replaced = []
+        for agent_id, agent_info in RouterRegistry.all().items():
+            if agent_info.reload is None:
+                continue
+            agent = agent_info.reload()
+            if agent is not None:
+                RouterRegistry.replace_agent(agent_id, agent)
+                replaced.append(agent_id)
+        if not replaced:
+            return False
+        # 引用赋值是原子的：新请求拿到新图，旧图在进行中的对话结束后释放
+        self._router_graph = self._router_service.compile_router()
+        self._graph_version += 1
+        logger.info("路由图热更新到版本%d，重建的子agent：%s", self._graph_version, replaced)
+        return True
+
+    @property
+    def graph_version(self) -> int:
+        return self._graph_version
     
     def get_router(self) -> CompiledStateGraph:
         """获取 router_graph，如果未初始化则自动初始化（延迟初始化）"""
         if not self._initialized:
             self.initialize()
         return self._router_graph
+
+    async def aget_router(self) -> CompiledStateGraph:
+        """异步版本：未初始化时（启动预热还没完成）在线程中等待初始化，不阻塞事件循环"""
+        if not self._initialized:
+            await asyncio.to_thread(self.initialize)
+        return self._router_graph
     
     @property
     def router_service(self) -> RouterService:
@@ -0,0 +1,139 @@
+"""
+路由结果缓存
+
+- 问题级：归一化后的问题 -> 子agent，相同问题短时间内再次出现时直接复用；只用于还没有上一轮子agent的会话
+  （追问的含义依赖会话上下文，由会话粘滞/embedding分类决定）
+- 会话级：thread_id -> 上次路由到的子agent，只作为会话粘滞的候选：embedding分类有明确结果时以分类为准，
+  没有明确结果时才沿用，不调用路由大模型（会话可以随时切换到别的子agent）
+- 两级都有TTL和条数上限；子agent注册信息变化（RouterRegistry版本号变化）时整体失效
+"""
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+# 归一化时去掉的空白和标点（含全角）
+_NOISE = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def normalize_question(question: str) -> str:
+    """全角转半角、小写、去空白和标点，'明天天气？' 与 '明天 天气?' 视为同一问题"""
+    return _NOISE.sub("", unicodedata.normalize("NFKC", question or "").lower())
+
+
+class _TtlLru:
+    """带TTL的LRU，非线程安全，由RoutingCache加锁"""
+
+    def __init__(self, max_size: int, ttl_s: float):
+        self._max_size = max_size
+        self._ttl = ttl_s
+        self._data: OrderedDict[str, Tuple[str, float]] = OrderedDict()
+
+    def get(self, key: str, now: float) -> Optional[str]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at <= now:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: str, now: float) -> None:
+        self._data[key] = (value, now + self._ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self._max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class RoutingCache:
+    """
+    路由结果缓存
+
+    version_fn返回子agent注册信息的版本号，每次查询前比对，变化时清空两级缓存。
+    """
+
+    def __init__(self, version_fn: Callable[[], int], max_size: int, thread_ttl_s: float, question_ttl_s: float):
+        self._version_fn = version_fn
+        self._version = version_fn()
+        self._threads = _TtlLru(max_size, thread_ttl_s)
+        self._questions = _TtlLru(max_size, question_ttl_s)
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {"thread_hits": 0, "question_hits": 0, "misses": 0, "invalidations": 0}
+
+    def _check_version(self) -> None:
+        version = self._version_fn()
+        if version != self._version:
+            self._threads.clear()
+            self._questions.clear()
+            self._version = version
+            self._counts["invalidations"] += 1
+
+    def get_question(self, question: str) -> Optional[str]:
+        """问题级缓存，结果只由问题决定，命中即可直接路由"""
+        now = time.monotonic()
+        key = normalize_question(question)
+        with self._lock:
+            self._check_version()
+            agent_id = self._questions.get(key, now) if key else None
+            if agent_id is not None:
+                self._counts["question_hits"] += 1
+            return agent_id
+
+    def get_thread(self, thread_id: str) -> Optional[str]:
+        """会话上次路由到的子agent，作为粘滞候选；是否沿用由调用方在embedding分类之后决定"""
+        now = time.monotonic()
+        with self._lock:
+            self._check_version()
+            return self._threads.get(thread_id, now)
+
+    def record_thread_hit(self, hit: bool) -> None:
+        """问题级未命中后的路由结果：是否由会话级缓存决定（粘滞）"""
+        with self._lock:
+            self._counts["thread_hits" if hit else "misses"] += 1
+
+    def put(self, thread_id: str, question: str, agent_id: str, by_question: bool = True) -> None:
+        """
+        记录路由结果
+
+        by_question：结果是否只由问题本身决定（embedding、路由大模型）；会话粘滞得到的结果依赖上下文，不写问题级缓存
+        """
+        now = time.monotonic()
+        key = normalize_question(question)
+        with self._lock:
+            self._check_version()
+            self._threads.put(thread_id, agent_id, now)
+            if by_question and key:
+                self._questions.put(key, agent_id, now)
+
+    def forget_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._threads.pop(thread_id)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._threads.clear()
+            self._questions.clear()
+            self._counts["invalidations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+            counts["threads"] = len(self._threads)
+            counts["questions"] = len(self._questions)
+        lookups = counts["thread_hits"] + counts["question_hits"] + counts["misses"]
+        hits = counts["thread_hits"] + counts["question_hits"]
+        counts["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        return counts
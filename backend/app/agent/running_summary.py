@@ -0,0 +1,229 @@
+"""
+滚动摘要：历史对话的摘要存在checkpoint（state.running_summary）中，每次只把新变旧的消息合并进去
+
+- 一轮回答结束后（after_agent）判断是否需要合并：未合并的消息超过token上限或条数上限时，
+  保留最近的若干条，更早的消息连同已有摘要交给轻量模型，在后台生成新摘要，不占用本轮的响应时间
+- 新摘要先暂存在进程内，下一轮调用模型前（before_model）写入state，并删除已合并的消息，随本轮checkpoint一起保存；
+  只由图自己写checkpoint，不会和正在进行的对话互相覆盖
+- 调用模型时把摘要作为一条用户消息放在历史消息之前
+- 下一轮到来时后台摘要还没完成，不等待，本轮照常使用旧摘要和未合并的消息；
+  多进程部署时暂存的摘要在别的进程不可见，那个进程会在该轮结束后重新合并
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, List, Optional
+
+from langchain.agents import AgentState
+from langchain.agents.middleware import AgentMiddleware, ModelRequest, ModelResponse
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, RemoveMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langgraph.config import get_config
+from langgraph.runtime import Runtime
+from typing_extensions import NotRequired
+
+from app.infra.llm_limiter import LLMPriority, set_llm_priority
+from app.infra.log import logger
+
+RUNNING_SUMMARY = "running_summary"
+
+# 暂存摘要的会话数上限，超过时丢弃最早的（丢弃后该会话下一轮结束时重新合并）
+_MAX_PENDING = 10000
+# 单条工具结果进摘要提示词时的截断长度
+_TOOL_TEXT_LIMIT = 500
+
+_SUMMARY_PROMPT = """你负责维护一段对话的滚动摘要。下面给出已有摘要和之后新增的对话，请把新增对话合并进摘要：
+保留用户的身份、偏好、提到的事实和约定、未完成的事项和得出的结论，去掉寒暄和重复内容，不超过{max_chars}字。
+只输出新的摘要。
+
+【已有摘要】
+{summary}
+
+【新增对话】
+{dialog}"""
+
+
+class RunningSummaryState(AgentState):
+    running_summary: NotRequired[str]
+
+
+@dataclass
+class _PendingSummary:
+    # 生成时基于的旧摘要，与state中的不一致说明已被别的摘要替换，丢弃
+    base: str
+    summary: str
+    folded_ids: List[str]
+
+
+def _render(messages: List[AnyMessage]) -> str:
+    lines = []
+    for message in messages:
+        if isinstance(message, HumanMessage):
+            lines.append(f"用户：{message.text}")
+        elif isinstance(message, AIMessage):
+            if message.text:
+                lines.append(f"助手：{message.text}")
+            for call in message.tool_calls:
+                lines.append(f"助手调用工具：{call['name']}({call['args']})")
+        elif isinstance(message, ToolMessage):
+            lines.append(f"工具{message.name or ''}返回：{message.text[:_TOOL_TEXT_LIMIT]}")
+    return "\n".join(lines)
+
+
+def _thread_id() -> Optional[str]:
+    try:
+        return get_config().get("configurable", {}).get("thread_id")
+    except RuntimeError:
+        return None
+
+
+class RunningSummaryMiddleware(AgentMiddleware):
+    """
+    :param model: 生成摘要的模型（轻量模型）
+    :param max_tokens: 未合并消息的token数超过时合并，合并后保留的消息不超过其一半
+    :param max_messages: 未合并消息条数超过时合并（checkpoint中保存的消息条数因此有上限）
+    :param keep_messages: 合并后保留的最近消息条数，须明显小于max_messages：
+        合并一次后要再新增若干轮才会再次触发，而不是每轮都合并最早的一轮
+    """
+
+    state_schema = RunningSummaryState
+
+    def __init__(self, model: BaseChatModel, max_tokens: int, max_messages: int, keep_messages: int,
+                 max_chars: int = 800):
+        super().__init__()
+        if not 0 < keep_messages < max_messages:
+            raise ValueError(f"keep_messages({keep_messages})必须大于0且小于max_messages({max_messages})")
+        self.model = model
+        self.max_tokens = max_tokens
+        self.max_messages = max_messages
+        self.keep_messages = keep_messages
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self._pending: OrderedDict[str, _PendingSummary] = OrderedDict()
+        self._running: set[str] = set()
+        # 持有后台任务的引用，避免执行中被回收
+        self._tasks: set[asyncio.Task] = set()
+        self._done = 0
+        self._failed = 0
+        self._ms_total = 0.0
+
+    # ---------------------------------------------------------------- 调用模型前：写入后台生成的摘要
+    def _apply_pending(self, state: RunningSummaryState) -> Optional[dict[str, Any]]:
+        thread_id = _thread_id()
+        if thread_id is None:
+            return None
+        with self._lock:
+            pending = self._pending.pop(thread_id, None)
+        if pending is None or pending.base != state.get(RUNNING_SUMMARY, ""):
+            return None
+        present = {message.id for message in state["messages"]}
+        removals = [RemoveMessage(id=message_id) for message_id in pending.folded_ids if message_id in present]
+        return {RUNNING_SUMMARY: pending.summary, "messages": removals}
+
+    def before_model(self, state: RunningSummaryState, runtime: Runtime) -> Optional[dict[str, Any]]:
+        return self._apply_pending(state)
+
+    async def abefore_model(self, state: RunningSummaryState, runtime: Runtime) -> Optional[dict[str, Any]]:
+        return self._apply_pending(state)
+
+    # ---------------------------------------------------------------- 调用模型：摘要放在历史消息之前
+    @staticmethod
+    def _prepare(request: ModelRequest) -> ModelRequest:
+        summary = request.state.get(RUNNING_SUMMARY)
+        if not summary:
+            return request
+        return request.override(messages=[HumanMessage(content=f"以下是到目前为止的对话摘要：\n\n{summary}",
+                                                       id=RUNNING_SUMMARY),
+                                          *request.messages])
+
+    def wrap_model_call(self, request: ModelRequest,
+                        handler: Callable[[ModelRequest], ModelResponse]) -> ModelResponse:
+        return handler(self._prepare(request))
+
+    async def awrap_model_call(self, request: ModelRequest,
+                               handler: Callable[[ModelRequest], Awaitable[ModelResponse]]) -> ModelResponse:
+        return await handler(self._prepare(request))
+
+    # ---------------------------------------------------------------- 一轮结束后：后台合并
+    def _to_fold(self, messages: List[AnyMessage]) -> List[AnyMessage]:
+        """
+        需要合并进摘要的消息；保留最近keep_messages条、且不超过max_tokens的一半，
+        切点落在用户消息上，不拆开工具调用和工具结果
+        """
+        tokens = [count_tokens_approximately([message]) for message in messages]
+        if len(messages) <= self.max_messages and sum(tokens) <= self.max_tokens:
+            return []
+        cut = max(len(messages) - self.keep_messages, 0)
+        kept_tokens = sum(tokens[cut:])
+        while cut < len(messages) - 1 and kept_tokens > self.max_tokens // 2:
+            kept_tokens -= tokens[cut]
+            cut += 1
+        while cut > 0 and not isinstance(messages[cut], HumanMessage):
+            cut -= 1
+        return messages[:cut] if cut > 0 else []
+
+    def _schedule(self, state: RunningSummaryState) -> None:
+        thread_id = _thread_id()
+        if thread_id is None:
+            return
+        folded = self._to_fold(state["messages"])
+        if not folded:
+            return
+        with self._lock:
+            if thread_id in self._running:
+                return
+            self._running.add(thread_id)
+        coro = self._summarize(thread_id, state.get(RUNNING_SUMMARY, ""), folded)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            threading.Thread(target=asyncio.run, args=(coro,), daemon=True).start()
+            return
+        # 新的空上下文：不继承本轮的回调（否则摘要的token会混进回答的消息流）
+        task = loop.create_task(coro, context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def after_agent(self, state: RunningSummaryState, runtime: Runtime) -> None:
+        self._schedule(state)
+
+    async def aafter_agent(self, state: RunningSummaryState, runtime: Runtime) -> None:
+        self._schedule(state)
+
+    async def _summarize(self, thread_id: str, base: str, folded: List[AnyMessage]) -> None:
+        set_llm_priority(LLMPriority.BACKGROUND)
+        start = time.perf_counter_ns()
+        try:
+            prompt = _SUMMARY_PROMPT.format(max_chars=self.max_chars, summary=base or "（无）", dialog=_render(folded))
+            response = await self.model.ainvoke(prompt)
+            summary = response.text.strip()
+            if not summary:
+                return
+            with self._lock:
+                self._pending[thread_id] = _PendingSummary(base, summary, [message.id for message in folded])
+                self._pending.move_to_end(thread_id)
+                while len(self._pending) > _MAX_PENDING:
+                    self._pending.popitem(last=False)
+                self._done += 1
+                self._ms_total += (time.perf_counter_ns() - start) / 1e6
+        except Exception as e:
+            with self._lock:
+                self._failed += 1
+            logger.warning("会话%s的滚动摘要生成失败: %s", thread_id, e)
+        finally:
+            with self._lock:
+                self._running.discard(thread_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "done": self._done,
+                "failed": self._failed,
+                "running": len(self._running),
+                "pending": len(self._pending),
+                "ms_avg": round(self._ms_total / self._done, 2) if self._done else 0.0,
+            }
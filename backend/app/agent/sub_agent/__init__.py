@@ -9,6 +9,7 @@ for _importer, _modname, _ispkg in pkgutil.iter_modules(_sub_agent_package.__pat
         try:
             importlib.import_module(f'{__name__}.{_modname}')
         except Exception as e:
-            # 静默失败，避免影响其他模块
-            pass
+            # 不影响其他模块，但要留下记录，否则该子agent没有注册也无从查起
+            from app.infra.log import logger
+            logger.warning("导入子agent模块%s失败: %s", _modname, e)
 
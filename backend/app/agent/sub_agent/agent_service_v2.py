@@ -7,13 +7,13 @@
 """
 from typing import Literal
 
-from langchain_community.chat_models import ChatTongyi
 from langchain_core.messages import BaseMessage, HumanMessage
 from langgraph.constants import START, END
 from langgraph.graph import StateGraph
 from pydantic import BaseModel
 
 from app.conversation.schemas import MsgCreate
+from app.infra.llm import LLM_MAIN, get_llm
 
 
 # 注册在路由中的执行函数
@@ -28,25 +28,27 @@ class State(BaseModel):
     eval_count: int
 
 # 分析师
-# 分析师model
-analyze_model = ChatTongyi(model="qwen-max")
+# 分析师model（调用时才从模型注册表借用，导入本模块不创建客户端）
+def analyze_model():
+    return get_llm(LLM_MAIN)
 # 分析师节点
 def analyst(state:State) -> State:
     prompt = "你是一个商业分析师，你将与公司的设计师合作，你的任务是根据用户的提问给出《市场报告》"
     messages = state.messages
-    ai_message = analyze_model.invoke(input=messages, prompt = prompt)
+    ai_message = analyze_model().invoke(input=messages, prompt = prompt)
     print(ai_message)
     messages.append(ai_message)
     return state
 
 # 设计师
 # 设计师model
-design_model = ChatTongyi(model="qwen-max")
+def design_model():
+    return get_llm(LLM_MAIN)
 # 设计师节点
 def designer(state:State) -> State:
     prompt = "你是一个产品设计师，你将与公司的商业分析师合作，你的核心产出是产品需求文档（PRD）、用户流程图、功能规格说明书。这些文档要求极高的逻辑性、结构清晰、格式规范、无歧义"
     messages = state.messages
-    ai_message = analyze_model.invoke(input=state.messages, prompt = prompt)
+    ai_message = analyze_model().invoke(input=state.messages, prompt = prompt)
     print(ai_message)
     messages.append(ai_message)
     return state
@@ -82,9 +84,9 @@ graph.add_edge("designer", END)
 
 
 agent = graph.compile()
-agent.get_graph(xray=True).print_ascii()
 
 if (__name__ == "__main__"):
+    agent.get_graph(xray=True).print_ascii()
     query = "为一个面向00后的新社交App生成一份包含市场分析和产品原型的创意提案"
     state = State(
         analysis_res = "",
@@ -1,25 +1,31 @@
-from langchain.agents.middleware import SummarizationMiddleware
-from langchain_community.chat_models import ChatTongyi
+from typing import Optional
+
 from langchain_core.language_models import BaseChatModel
 from langchain_core.tools import BaseTool
 from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.graph.state import CompiledStateGraph
 from langchain.agents import create_agent
 import langsmith as ls
 
-from app.agent.knowledge_tool import KnowledgeTool
-from app.agent.middlewares import trim_messages
+from app.agent.middlewares import PromptCacheMiddleware, TokenBudgetMiddleware
 from app.agent.mysql_agent_saver import get_hybrid_checkpoint_saver
+from app.agent.running_summary import RunningSummaryMiddleware
+from app.agent.tool_registry import knowledge_tool_registry
+from app.infra.llm import LLM_MAIN, LLM_SMALL, get_llm
 from app.infra.settings import get_settings
-from app.agent.router_agent import RouterRegistry, BaseSubAgent
+from app.agent.router_agent import RouterRegistry, BaseSubAgent, router_graph_manager
 from app.rag.service.knowledge_service import knowledge_service
 
 
 class DailyAgentService:
 
+    def __init__(self):
+        # 中间件有进程内状态（如待写入的滚动摘要），热更新重建agent时沿用
+        self._middlewares: Optional[list] = None
+
     def init_small_model(self) -> BaseChatModel:
-        model_name = "qwen2.5-3b-instruct"
-        # 创建千问model对象，要确保已设置api_key到系统变量DASHSCOPE_API_KEY
-        return ChatTongyi(model=model_name)
+        # 从模型注册表借用，进程内共用一个客户端（连接池、并发上限、重试）
+        return get_llm(LLM_SMALL)
 
     def small_model_service(self, question: str) -> str:
         model = self.init_small_model()
@@ -28,15 +34,18 @@ class DailyAgentService:
             ai_msg = model.invoke(question)
             return ai_msg.content
 
+    async def asmall_model_service(self, question: str) -> str:
+        """轻量模型服务的异步版本"""
+        model = self.init_small_model()
+        with ls.tracing_context(enabled=True, project_name="small-model"):
+            ai_msg = await model.ainvoke(question)
+            return ai_msg.content
+
     def init_main_model(self) -> BaseChatModel:
-        # 用OpenAPI的方式调用通义千问， 目前langchain-community的Tongyi类在存在多个tool时会触发bug：
+        # 默认用OpenAI兼容的方式调用通义千问（LLM_DASHSCOPE_PROTOCOL），可复用连接池；
+        # 另外langchain-community的Tongyi类在存在多个tool时会触发bug：
         # https://github.com/langchain-ai/langchain-community/issues/475
-        model_name = "qwen-max"
-        # 创建千问model对象，要确保已设置api_key到系统变量DASHSCOPE_API_KEY
-        return ChatTongyi(model=model_name)  # 模型也要设置streaming=True，不然agent.stream()不生效
-        #     return ChatOpenAI(model=model_name,
-        #                       base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        #                       api_key=os.getenv("DASHSCOPE_API_KEY"))
+        return get_llm(LLM_MAIN)
 
     def init_sys_prompt(self) -> str:
         # todo 赋予性格和职责说明
@@ -44,24 +53,27 @@ class DailyAgentService:
 
     def build_tools(self) -> list:
         tools: list[BaseTool] = []
-        # rag tools
-        kb_spaces = knowledge_service.space_list_all()
-        for kb_space in kb_spaces:
-            kb_tool = KnowledgeTool(name=kb_space.name, description=kb_space.desc,
-                                    vector_collection=kb_space.collection)
-            tools.append(kb_tool)
+        # rag tools：与当前的知识库空间增量同步，按名称排序（前缀缓存）
+        knowledge_tool_registry.sync(knowledge_service.space_list_all())
+        tools.extend(knowledge_tool_registry.tools())
         return tools
 
     def init_memory_pattern_middlewares(self) -> list:
-        """先汇总，再滑动窗口"""
+        """先滚动摘要（后台合并，不占响应时间），再按token预算裁剪"""
         settings = get_settings()
-        summarization_middleware = SummarizationMiddleware(
+        summary_middleware = RunningSummaryMiddleware(
             model=self.init_small_model(),
-            max_tokens_before_summary=settings.AGENT_MSG_SUMMARY_MAX_BEFORE,
-            messages_to_keep=settings.AGENT_MSG_SUMMARY_TO_KEEP,
+            max_tokens=settings.AGENT_MSG_SUMMARY_MAX_BEFORE,
+            max_messages=settings.AGENT_MSG_SUMMARY_TRIGGER,
+            keep_messages=settings.AGENT_MSG_SUMMARY_TO_KEEP,
+        )
+
+        token_budget_middleware = TokenBudgetMiddleware(
+            max_tokens=settings.AGENT_CONTEXT_MAX_TOKENS,
+            tool_max_tokens=settings.AGENT_TOOL_MSG_MAX_TOKENS,
         )
 
-        return [summarization_middleware, trim_messages]
+        return [summary_middleware, token_budget_middleware, PromptCacheMiddleware()]
 
     def initialize_agent(self,
                          model: BaseChatModel = None,
@@ -77,7 +89,9 @@ class DailyAgentService:
         if tools is None:
             tools = self.build_tools()
         if middlewares is None:
-            middlewares = self.init_memory_pattern_middlewares()
+            if self._middlewares is None:
+                self._middlewares = self.init_memory_pattern_middlewares()
+            middlewares = self._middlewares
         if checkpointer is None:
             checkpointer = get_hybrid_checkpoint_saver()
         # LangChain 1.0 中构建智能体的标准方式
@@ -92,6 +106,14 @@ class DailyAgentService:
 
         return _agent_instance
 
+    def reload_agent(self) -> Optional[CompiledStateGraph]:
+        """知识库空间有变化时用新的工具集重建agent，没有变化返回None"""
+        tools_version = knowledge_tool_registry.version
+        tools = self.build_tools()
+        if knowledge_tool_registry.version == tools_version:
+            return None
+        return self.initialize_agent(tools=tools)
+
 
 class DailySubAgent(BaseSubAgent):
     """日常管家子 Agent，继承 BaseSubAgent 实现自动注册"""
@@ -101,6 +123,8 @@ class DailySubAgent(BaseSubAgent):
         """实现基类的注册类方法"""
         service = DailyAgentService()
         agent = service.initialize_agent()
+        # 知识库空间增删改后热更新工具集
+        knowledge_service.add_space_listener(router_graph_manager.request_reload)
         registry.register(
             id="daily_assistant",
             name="日常管家",
@@ -112,7 +136,8 @@ class DailySubAgent(BaseSubAgent):
                 "- 闲聊与情感陪伴"
             ],
             example="用户：'明天上海天气怎么样？', 你：{'route_agent_id': 'daily_assistant', 'reason_and_mode': '这是一个简单的天气信息查询，属于日常事务范畴。我将转发给日常管家来处理......'}",
-            agent=agent
+            agent=agent,
+            reload=service.reload_agent
         )
 
 
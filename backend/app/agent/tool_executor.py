@@ -0,0 +1,50 @@
+"""
+同步工具的并行执行
+
+模型一轮发出多个工具调用时，create_agent把每个调用作为图中同一步的独立任务并发执行，结果按调用顺序写回；
+同步工具的ainvoke默认放到事件循环的默认线程池，与数据库读写等共用且没有超时。
+PooledTool改为放到工具专用的有界线程池，单次调用有超时：
+
+- 超时后返回提示文本交给模型，不让整轮失败；还没开始执行的调用直接取消，已在执行的线程跑完后结果丢弃
+- 请求被取消（如客户端断开）时同样取消排队中的调用
+"""
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from langchain_core.tools import BaseTool
+
+from app.infra.log import logger
+from app.infra.settings import get_settings
+
+_tool_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_tool_executor() -> ThreadPoolExecutor:
+    global _tool_executor
+    if _tool_executor is None:
+        with _executor_lock:
+            if _tool_executor is None:
+                _tool_executor = ThreadPoolExecutor(max_workers=get_settings().AGENT_TOOL_MAX_WORKERS,
+                                                    thread_name_prefix="agent-tool")
+    return _tool_executor
+
+
+class PooledTool(BaseTool):
+    """子类只需实现同步的_run；timeout_s为空时用AGENT_TOOL_TIMEOUT_S"""
+
+    timeout_s: Optional[float] = None
+
+    async def _arun(self, *args: Any, **kwargs: Any) -> Any:
+        timeout_s = self.timeout_s or get_settings().AGENT_TOOL_TIMEOUT_S
+        # 带上当前上下文（回调、模型调用优先级等）
+        context = contextvars.copy_context()
+        future = get_tool_executor().submit(context.run, self._run, *args, **kwargs)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout_s)
+        except TimeoutError:
+            logger.warning("工具%s执行超过%s秒，已放弃: %s", self.name, timeout_s, args or kwargs)
+            return f"工具{self.name}执行超时（{timeout_s}秒），没有拿到结果，请不依赖该工具回答或稍后再试"
@@ -0,0 +1,56 @@
+"""
+知识库工具注册表：每个知识库空间一个KnowledgeTool，按空间id增量维护
+
+sync时与最新的空间列表比对，只新建/替换/删除有变化的工具，没变化的工具实例沿用；
+有变化时版本号递增，使用方据此决定是否重建子agent
+"""
+import threading
+from typing import Dict, List, Tuple
+
+from app.agent.knowledge_tool import KnowledgeTool
+from app.infra.log import logger
+from app.rag.schemas import KbSpaceOut
+
+
+class KnowledgeToolRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # space_id -> ((名称, 描述, collection), 工具)
+        self._tools: Dict[int, Tuple[tuple, KnowledgeTool]] = {}
+        self._version = 0
+
+    def sync(self, spaces: List[KbSpaceOut]) -> bool:
+        """与空间列表比对并增量更新，返回是否有变化"""
+        latest = {space.id: space for space in spaces}
+        added, updated, removed = [], [], []
+        with self._lock:
+            for space_id in list(self._tools):
+                if space_id not in latest:
+                    del self._tools[space_id]
+                    removed.append(space_id)
+            for space_id, space in latest.items():
+                key = (space.name, space.desc, space.collection)
+                current = self._tools.get(space_id)
+                if current is not None and current[0] == key:
+                    continue
+                tool = KnowledgeTool(name=space.name, description=space.desc, vector_collection=space.collection)
+                self._tools[space_id] = (key, tool)
+                (updated if current is not None else added).append(space_id)
+            changed = bool(added or updated or removed)
+            if changed:
+                self._version += 1
+                logger.info("知识库工具集更新到版本%d：新增%s，修改%s，删除%s", self._version, added, updated, removed)
+        return changed
+
+    def tools(self) -> List[KnowledgeTool]:
+        """按名称排序，工具定义每轮字节一致（前缀缓存）"""
+        with self._lock:
+            return sorted((tool for _, tool in self._tools.values()), key=lambda tool: tool.name)
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+
+knowledge_tool_registry = KnowledgeToolRegistry()
@@ -0,0 +1,24 @@
+from fastapi import APIRouter
+from starlette.responses import JSONResponse
+
+from app.common.api.api_response import R, Code
+from app.infra.startup import startup_profile
+
+router = APIRouter(tags=["health"], prefix="/health")
+
+
+@router.get("/live", summary="存活探针")
+def live():
+    """进程在运行即存活；启动失败时返回503，由编排系统重启"""
+    if startup_profile.error is not None:
+        return JSONResponse(status_code=503, content=R.fail(Code.SERVER_ERR.value, startup_profile.error).model_dump())
+    return R.ok()
+
+
+@router.get("/ready", summary="就绪探针")
+def ready():
+    """后台初始化（路由图、模型等）完成后才就绪，之前返回503；data为各启动步骤的耗时"""
+    report = startup_profile.report()
+    if not report["ready"]:
+        return JSONResponse(status_code=503, content=R.fail(Code.SERVER_ERR.value, "服务启动中", report).model_dump())
+    return R.ok(report)
@@ -2,6 +2,8 @@ from fastapi import APIRouter, Request, HTTPException
 from sse_starlette import EventSourceResponse
 
 from app.common.api import R
+from app.infra.llm import get_llm_registry
+from app.infra.llm_limiter import LLMBusyError, LLMPriority
 from app.infra.settings import get_settings
 from app.conversation.service import conv_service
 from app.conversation.schemas import ConvIn, MsgCreate
@@ -10,14 +12,21 @@ import random
 router = APIRouter(prefix="/conversation", tags=["conversation"])
 
 @router.post("/{conv_id}/message")
-def message_post(request: Request, body: MsgCreate):
+async def message_post(request: Request, body: MsgCreate):
     #简单控制访客的请求量
     settings = get_settings()
+    priority = LLMPriority.CHAT
     if request.state.user_id == settings.GUEST_USER_ID:
         if random.random() > settings.GUEST_CHAT_ALLOW_PROBABILITY:
             raise HTTPException(status_code=401, detail="您的聊天次数超限，请登录或稍后再试")
-    def generate():
-        for delta in conv_service.message_create(body):
+        priority = LLMPriority.GUEST
+    # 模型排队已经很长时直接拒绝，不让请求进入排队
+    try:
+        get_llm_registry().admit(priority)
+    except LLMBusyError:
+        raise HTTPException(status_code=429, detail="当前使用人数较多，请稍后再试")
+    async def generate():
+        async for delta in conv_service.message_create(body, priority):
             # print(delta, end="", flush=True)
             yield f"{delta}" # uvicorn已自动加data:前缀和\r\n结尾
         yield "[DONE]"
@@ -58,7 +67,7 @@ def conversation_delete(conv_ids:str):
     return R.ok("success")
 
 @router.post("/{conv_id}/title", summary="生成对话标题")
-def conversation_generate_title(conv_id: str):
-    title = conv_service.conversation_generate_title(conv_id)
+async def conversation_generate_title(conv_id: str):
+    title = await conv_service.conversation_generate_title(conv_id)
     return R.ok(title if title else "未知标题")
 
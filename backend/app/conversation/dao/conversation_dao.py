@@ -26,17 +26,16 @@ class ConvDAO:
         return cid
 
     async def async_update(self, conv_id: str, user_id:int, title:str):
-        with self._mysql_manager.DbSession() as db:
+        async with self._mysql_manager.AsyncDbSession() as db:
             stmt = (
                 update(Conversation)
                 .where(Conversation.conv_id == conv_id)
                 .values(conv_id=conv_id, user_id=user_id, title=title)
                 .execution_options(synchronize_session="fetch")  # 防止缓存不一致
             )
-            result_proxy = db.execute(stmt)
+            result_proxy = await db.execute(stmt)
             updated_rows = result_proxy.rowcount
-            db.commit()
-            db.close()
+            await db.commit()
         return updated_rows
 
     def list_by_user(self, user_id: int, offset: int, limit : int):
@@ -47,6 +47,12 @@ class MsgDAO:
         db.flush()
         return mid
 
+    async def async_add(self, conv_id: str, role: MsgRole, content: str, db) -> str:
+        mid = str(ulid.ULID())
+        db.add(Message(msg_id=mid, conv_id=conv_id, role=role.value, content=content))
+        await db.flush()
+        return mid
+
     def list_by_conv_id(self, conv_id: str):
         with self._mysql_manager.DbSession() as db:
             stmt = select(Message).where(
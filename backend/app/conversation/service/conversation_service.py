@@ -1,10 +1,11 @@
 import asyncio
 import json
-from typing import List
+from typing import AsyncIterator, List
 
 from app.agent.sub_agent.daily_agent import daily_angent_service
 from app.infra import logger
 from app.infra import is_empty_string
+from app.infra.llm_limiter import LLMPriority, set_llm_priority
 from app.common.schemas import Page
 
 from pydantic import TypeAdapter
@@ -20,19 +21,32 @@ class ConversationService:
         self.conv_dao = conv_dao
         self.msg_dao = msg_dao
 
-    def message_create(self, msg_create: MsgCreate):
+    async def message_create(self, msg_create: MsgCreate,
+                             priority: LLMPriority = LLMPriority.CHAT) -> AsyncIterator[str]:
+        # 本次请求中所有模型调用的排队优先级（子图、工具内的调用通过上下文继承）
+        set_llm_priority(priority)
         # 回答积攒
         messages_store = []
         # 吐节点工作信息
-        for message_chunk in agent_router_service.exec(msg_create.content, msg_create.conv_id):
-            messages_store.append(message_chunk)
+        async for message_chunk in agent_router_service.aexec(msg_create.content, msg_create.conv_id):
+            self._merge_chunk(messages_store, message_chunk)
             message_4_web = self._convert_agent_msg(message_chunk)
             yield message_4_web
         # 入库
-        with self.conv_dao._mysql_manager.DbSession() as db:
-            self.msg_dao.add(conv_id=msg_create.conv_id, role= MsgRole.USER, content= msg_create.content, db = db)
-            self.msg_dao.add(conv_id=msg_create.conv_id, role= MsgRole.AI, content= json.dumps([obj.dict() for obj in messages_store], ensure_ascii=False), db = db)
-            db.commit()
+        async with self.conv_dao._mysql_manager.AsyncDbSession() as db:
+            await self.msg_dao.async_add(conv_id=msg_create.conv_id, role= MsgRole.USER, content= msg_create.content, db = db)
+            await self.msg_dao.async_add(conv_id=msg_create.conv_id, role= MsgRole.AI, content= json.dumps([obj.dict() for obj in messages_store], ensure_ascii=False), db = db)
+            await db.commit()
+
+    @staticmethod
+    def _merge_chunk(messages_store: List[MessageStreamChunk], message_chunk: MessageStreamChunk) -> None:
+        """token增量按消息id合并后入库，历史记录仍是每条消息一项"""
+        last = messages_store[-1] if messages_store else None
+        if last is not None and last.id == message_chunk.id and last.type == message_chunk.type \
+                and message_chunk.type == MsgChunkType.AI.value:
+            last.content = (last.content or "") + (message_chunk.content or "")
+        else:
+            messages_store.append(message_chunk.model_copy())
 
     def _convert_agent_msg(self, message_chunk:MessageStreamChunk) -> str:
         """转换成吐给前端的格式"""
@@ -70,11 +84,11 @@ class ConversationService:
     def conversation_delete(self, conv_ids:List[str]):
         self.conv_dao.delete(conv_ids)
 
-    def conversation_generate_title(self, conv_id: str) -> str:
-        conv = self.conv_dao.get_by_id(conv_id)
+    async def conversation_generate_title(self, conv_id: str) -> str:
+        conv = await asyncio.to_thread(self.conv_dao.get_by_id, conv_id)
         if not is_empty_string(conv.title):
             return conv.title
-        items = self.msg_dao.list_by_conv_id(conv_id)
+        items = await asyncio.to_thread(self.msg_dao.list_by_conv_id, conv_id)
         latest_user_msg = max(
             (item for item in items if item.role == 'user'),
             key=lambda x: x.created_at,
@@ -84,8 +98,10 @@ class ConversationService:
             logger.error("未找到对话{%s}的消息", conv_id)
             return "无标题会话"
         question = "请根据以下提问内容生成一个不超过十个字的提问标题：" + latest_user_msg.content
-        title = daily_angent_service.small_model_service(question)
-        asyncio.run(self.conversation_async_update(conv_id, conv.user_id, title))
+        # 标题生成是后台任务，排在聊天请求之后
+        set_llm_priority(LLMPriority.BACKGROUND)
+        title = await daily_angent_service.asmall_model_service(question)
+        await self.conversation_async_update(conv_id, conv.user_id, title)
         return title
 
 # 创建全局实例
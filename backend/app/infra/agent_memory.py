@@ -1,12 +1,8 @@
-import threading
-import time
-
 from langgraph.checkpoint.base import BaseCheckpointSaver
-from langgraph.checkpoint.memory import InMemorySaver
-from langgraph.checkpoint.redis import RedisSaver
 
-from app.infra.log import logger
-from app.infra.redis import get_redis_client
+from app.infra.memory_saver import BoundedMemorySaver
+from app.infra.redis import get_redis_checkpoint_client
+from app.infra.redis_saver import RedisCheckpointCache
 from app.infra.settings import get_settings
 
 _agent_memory = None
@@ -17,16 +13,10 @@ def get_agent_memory() -> BaseCheckpointSaver:
     if _agent_memory is None:
         settings = get_settings()
         if settings.AGENT_MEM_MODE == "memory":
-            _agent_memory = InMemorySaver()
-
-            # 定期清理内存
-            def cleaner():
-                while True:
-                    time.sleep(60 * 60)
-                    logger.info('本地记忆清理')
-                    _agent_memory.storage.clear()
-
-            threading.Thread(target=cleaner, daemon=True).start()
+            # 按会话LRU + 空闲超时淘汰，只保留每个会话最新的checkpoint
+            _agent_memory = BoundedMemorySaver(max_bytes=settings.AGENT_MEM_MAX_MB * 1024 * 1024,
+                                               max_threads=settings.AGENT_MEM_MAX_THREADS,
+                                               idle_ttl=settings.AGENT_MEM_IDLE_TTL_S)
         elif settings.AGENT_MEM_MODE == "redis":
             # 轻量模式下不允许使用 Redis
             if settings.MODE == "lite":
@@ -34,9 +24,8 @@ def get_agent_memory() -> BaseCheckpointSaver:
                     f"轻量模式（MODE=lite）下不允许使用 Redis 记忆模式（AGENT_MEM_MODE=redis），"
                     f"请使用内存模式（AGENT_MEM_MODE=memory）或切换到标准模式（MODE=std）"
                 )
-            _agent_memory = RedisSaver(redis_client=get_redis_client(),
-                                       ttl={"default_ttl": 120, "refresh_on_read": True})
-            _agent_memory.setup()  # 首次运行建表
+            _agent_memory = RedisCheckpointCache(client=get_redis_checkpoint_client(),
+                                                 ttl_s=settings.AGENT_MEM_REDIS_TTL_S)
         else:
             raise ValueError(f"非法的AGENT_MEM_MODE={settings.AGENT_MEM_MODE}")
     return _agent_memory
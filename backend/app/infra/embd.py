@@ -1,3 +1,6 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
 from typing import Any, List, Literal, Optional, Sequence, cast, ClassVar
 
 import numpy as np
@@ -6,8 +9,9 @@ from pydantic import BaseModel, ConfigDict
 from app.infra.settings import get_settings
 
 MIN_VERSION = "0.2.0"
+# 模型加载锁
+_model_lock = threading.Lock()
 
-import fastembed
 from langchain_core.embeddings import Embeddings
 
 """自己写FastEmbedEmbeddings，指定模型存储路径"""
@@ -90,14 +94,18 @@ class FastEmbedBgeSmallEnV15(BaseModel, Embeddings):
     def model(self):
         """懒加载模型实例，确保线程安全"""
         if self._model is None:
-            # 懒加载模型
-            self._model = fastembed.TextEmbedding(
-                model_name=self.model_name,
-                max_length=self.max_length,
-                threads=self.threads or 4,
-                providers=self.providers,
-                specific_model_path=get_settings().MODEL_BGE_SMALL_EN_V15_STORE_PATH
-            )
+            # 启动预热和首个请求可能同时触发，只加载一次
+            with _model_lock:
+                if self._model is None:
+                    # 此处import，启动时不加载onnxruntime，由后台预热或首次使用时加载
+                    import fastembed
+                    self._model = fastembed.TextEmbedding(
+                        model_name=self.model_name,
+                        max_length=self.max_length,
+                        threads=self.threads or 4,
+                        providers=self.providers,
+                        specific_model_path=get_settings().MODEL_BGE_SMALL_EN_V15_STORE_PATH
+                    )
         return self._model
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
@@ -149,3 +157,81 @@ def _init_embed() -> Embeddings:
 
 # 创建全局单实例
 embed = _init_embed()
+
+
+class EmbedTokenCounter:
+    """embedding模型自带tokenizer的计数器，分块按token计长，和模型的max_length口径一致
+
+    - 懒加载tokenizer.json，不加载onnx模型
+    - LRU缓存单段文本的token数，分块器对同一片段会反复计长
+    - count_batch走encode_batch批量编码，先把缓存预热
+    """
+
+    def __init__(self, max_length: int = 512, cache_size: int = 100_000):
+        self.max_length = max_length
+        self._cache_size = cache_size
+        self._cache: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+        self._tokenizer = None
+        self._special_tokens = 0
+
+    @property
+    def tokenizer(self):
+        """懒加载tokenizer，关闭截断和padding，才能量出真实长度"""
+        if self._tokenizer is None:
+            with self._lock:
+                if self._tokenizer is None:
+                    from tokenizers import Tokenizer
+                    model_dir = Path(get_settings().MODEL_BGE_SMALL_EN_V15_STORE_PATH)
+                    tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+                    tokenizer.no_truncation()
+                    tokenizer.no_padding()
+                    # [CLS]/[SEP]也占模型容量
+                    self._special_tokens = len(tokenizer.encode("").ids)
+                    self._tokenizer = tokenizer
+        return self._tokenizer
+
+    @property
+    def capacity(self) -> int:
+        """单个分块可用的正文token数（扣除特殊token）"""
+        _ = self.tokenizer
+        return self.max_length - self._special_tokens
+
+    def _cache_get(self, text: str) -> Optional[int]:
+        with self._lock:
+            n = self._cache.get(text)
+            if n is not None:
+                self._cache.move_to_end(text)
+            return n
+
+    def _cache_put(self, texts: List[str], counts: List[int]) -> None:
+        with self._lock:
+            for text, n in zip(texts, counts):
+                self._cache[text] = n
+                self._cache.move_to_end(text)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def count(self, text: str) -> int:
+        """正文token数，不含特殊token，作为分块器的length_function"""
+        n = self._cache_get(text)
+        if n is None:
+            n = len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+            self._cache_put([text], [n])
+        return n
+
+    def count_batch(self, texts: List[str]) -> List[int]:
+        """批量计数，只对未命中缓存的文本做一次encode_batch"""
+        counts: List[Optional[int]] = [self._cache_get(text) for text in texts]
+        misses = list({text for text, n in zip(texts, counts) if n is None})
+        if misses:
+            encodings = self.tokenizer.encode_batch(misses, add_special_tokens=False)
+            miss_counts = [len(e.ids) for e in encodings]
+            self._cache_put(misses, miss_counts)
+            miss_map = dict(zip(misses, miss_counts))
+            counts = [miss_map[text] if n is None else n for text, n in zip(texts, counts)]
+        return cast(List[int], counts)
+
+
+# 与embed共用同一模型目录和max_length
+token_counter = EmbedTokenCounter(max_length=embed.max_length)
@@ -0,0 +1,529 @@
+"""
+大模型客户端注册表
+
+- 按用途（router/main/small）借用客户端，不在各处自行构造；同一用途进程内只有一个实例
+- OpenAI兼容协议的客户端共用一个httpx连接池，长连接复用；dashscope原生sdk（ChatTongyi）每次请求新建会话，无法复用
+- 每个用途独立的并发上限、排队超时、调用超时、带抖动的指数退避重试
+- 按模型、按优先级（登录用户/访客/后台任务）的令牌桶限流和优先级排队，见llm_limiter
+- 调用次数、失败/重试次数、耗时、首token耗时、token用量统计
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+import httpx
+from langchain_community.chat_models import ChatTongyi
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI
+from pydantic import PrivateAttr
+
+from app.infra.llm_limiter import LLMBusyError, LLMPriority, PriorityRateLimiter, TokenBucket, Waiter
+from app.infra.log import logger
+from app.infra.settings import get_settings
+
+LLM_ROUTER = "router"
+LLM_MAIN = "main"
+LLM_SMALL = "small"
+
+# 可重试的HTTP状态码：限流、服务端错误
+_RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+_BACKOFF_BASE_S = 0.5
+_BACKOFF_MAX_S = 8.0
+
+
+def usage_of(generation: Any, llm_output: Optional[dict] = None) -> Optional[tuple]:
+    """
+    从一次模型调用结果（generation或chunk）中取(提示词token, 命中缓存token, 输出token)
+
+    兼容两种来源：langchain标准的usage_metadata（ChatOpenAI）；
+    DashScope原生接口的token_usage（ChatTongyi，放在generation_info/llm_output中）
+    """
+    message = getattr(generation, "message", None)
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        cached = (usage.get("input_token_details") or {}).get("cache_read", 0)
+        return usage.get("input_tokens", 0), cached or 0, usage.get("output_tokens", 0)
+    raw = (getattr(generation, "generation_info", None) or {}).get("token_usage") \
+        or (llm_output or {}).get("token_usage")
+    if not raw:
+        return None
+    prompt = raw.get("input_tokens", raw.get("prompt_tokens", 0))
+    output = raw.get("output_tokens", raw.get("completion_tokens", 0))
+    cached = (raw.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+    return prompt or 0, cached or 0, output or 0
+
+
+def _status_of(e: BaseException) -> Optional[int]:
+    status = getattr(e, "status_code", None)
+    if status is None:
+        # dashscope sdk的HTTPError：response为原始响应dict
+        response = getattr(e, "response", None)
+        status = response.get("status_code") if isinstance(response, dict) else getattr(response, "status_code", None)
+    return status
+
+
+def _retry_after(e: BaseException) -> Optional[float]:
+    """服务端建议的等待秒数（Retry-After响应头）"""
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    try:
+        return float(headers.get("retry-after")) if headers and headers.get("retry-after") else None
+    except ValueError:
+        return None
+
+
+def _is_retryable(e: BaseException) -> bool:
+    if isinstance(e, (TimeoutError, httpx.TimeoutException, httpx.TransportError)):
+        return True
+    status = _status_of(e)
+    if status is not None:
+        return status in _RETRY_STATUS
+    # openai sdk的连接错误/超时没有状态码
+    return type(e).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+@dataclass(frozen=True)
+class LLMProfile:
+    name: str
+    model: str
+    max_concurrency: int
+    # 每秒请求数上限，<=0不限速
+    rps: float
+    # openai：DashScope OpenAI兼容接口（共用httpx连接池）；native：dashscope sdk（ChatTongyi）
+    protocol: str = "openai"
+
+
+class _Gate:
+    """
+    并发名额：同步调用（如线程池中的调用）和异步调用共用一个计数，总数不超过limit
+
+    名额用完时按先来后到排队；释放时直接转交给队首并唤醒（见llm_limiter.Waiter），不会被后来的调用插队。
+    流式调用在整个生成期间占用名额
+    """
+
+    def __init__(self, limit: int, wait_s: float):
+        self.limit = limit
+        self._wait_s = wait_s
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._waiters: deque[Waiter] = deque()
+
+    def _try_enter(self, waiter: Waiter) -> bool:
+        """有空闲名额（且没有人在排队）时直接占用，否则排队"""
+        with self._lock:
+            if self._in_use < self.limit and not self._waiters:
+                self._in_use += 1
+                return True
+            self._waiters.append(waiter)
+            return False
+
+    def _release(self) -> None:
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.wake()
+                return
+            self._in_use -= 1
+
+    def _withdraw(self, waiter: Waiter) -> bool:
+        """等待超时：还在队列中就移除并返回False；名额恰好已经转交过来则留用，返回True"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def _abandon(self, waiter: Waiter) -> None:
+        """等待被取消：名额已经转交过来了就还回去"""
+        if self._withdraw(waiter):
+            self._release()
+
+    def _busy(self) -> LLMBusyError:
+        return LLMBusyError(f"等待模型并发名额超过{self._wait_s}秒（上限{self.limit}）")
+
+    async def __aenter__(self):
+        waiter = Waiter.for_loop()
+        if self._try_enter(waiter):
+            return
+        try:
+            acquired = await waiter.await_(self._wait_s)
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        if not acquired and not self._withdraw(waiter):
+            raise self._busy()
+
+    async def __aexit__(self, *exc):
+        self._release()
+
+    def __enter__(self):
+        waiter = Waiter.for_thread()
+        if self._try_enter(waiter):
+            return
+        if not waiter.wait(self._wait_s) and not self._withdraw(waiter):
+            raise self._busy()
+
+    def __exit__(self, *exc):
+        self._release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_use": self._in_use, "queued": len(self._waiters)}
+
+
+class _Metrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.in_flight = 0
+        self.latency_ms_total = 0.0
+        self.latency_ms_max = 0.0
+        self.streams = 0
+        self.first_token_ms_total = 0.0
+        self.input_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+
+    def begin(self) -> None:
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+
+    def end(self, start_ns: int, ok: bool) -> None:
+        ms = (time.perf_counter_ns() - start_ns) / 1e6
+        with self._lock:
+            self.in_flight -= 1
+            self.latency_ms_total += ms
+            self.latency_ms_max = max(self.latency_ms_max, ms)
+            if not ok:
+                self.errors += 1
+
+    def retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def first_token(self, start_ns: int) -> None:
+        with self._lock:
+            self.streams += 1
+            self.first_token_ms_total += (time.perf_counter_ns() - start_ns) / 1e6
+
+    def usage(self, usage: Optional[tuple]) -> None:
+        if usage is None:
+            return
+        with self._lock:
+            self.input_tokens += usage[0]
+            self.cached_tokens += usage[1]
+            self.output_tokens += usage[2]
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self.calls - self.in_flight
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "retries": self.retries,
+                "in_flight": self.in_flight,
+                "latency_ms_avg": round(self.latency_ms_total / done, 2) if done else 0.0,
+                "latency_ms_max": round(self.latency_ms_max, 2),
+                "first_token_ms_avg": round(self.first_token_ms_total / self.streams, 2) if self.streams else 0.0,
+                "input_tokens": self.input_tokens,
+                "cached_tokens": self.cached_tokens,
+                "output_tokens": self.output_tokens,
+            }
+
+
+class _Policy:
+    """一个用途的调用策略：限流排队、并发、超时、重试、统计"""
+
+    def __init__(self, profile: LLMProfile, limiter: PriorityRateLimiter, timeout_s: float, max_retries: int,
+                 wait_s: float):
+        self.profile = profile
+        self.limiter = limiter
+        self.timeout_s = timeout_s
+        self.max_retries = max_retries
+        self.gate = _Gate(profile.max_concurrency, wait_s)
+        self.metrics = _Metrics()
+
+    def _backoff(self, attempt: int, e: BaseException) -> float:
+        # full jitter：避免大量请求在同一时刻重试
+        delay = random.uniform(0, min(_BACKOFF_MAX_S, _BACKOFF_BASE_S * 2 ** attempt))
+        if _status_of(e) == 429:
+            # 服务端限流：整个模型暂停发放令牌，其他请求一起排队，重试时重新排队拿令牌
+            delay = max(delay, _retry_after(e) or 0.0)
+            self.limiter.throttle(delay)
+        self.metrics.retry()
+        logger.warning("模型%s调用失败，%.2fs后第%d次重试: %s", self.profile.model, delay, attempt + 1, e)
+        return delay
+
+    def call(self, fn: Callable[[], ChatResult]) -> ChatResult:
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire_sync()
+            with self.gate:
+                start = time.perf_counter_ns()
+                self.metrics.begin()
+                try:
+                    result = fn()
+                except Exception as e:
+                    self.metrics.end(start, ok=False)
+                    if attempt >= self.max_retries or not _is_retryable(e):
+                        raise
+                    delay = self._backoff(attempt, e)
+                else:
+                    self.metrics.end(start, ok=True)
+                    if result.generations:
+                        self.metrics.usage(usage_of(result.generations[0], result.llm_output))
+                    return result
+            time.sleep(delay)
+
+    async def acall(self, fn: Callable[[], Any]) -> ChatResult:
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            async with self.gate:
+                start = time.perf_counter_ns()
+                self.metrics.begin()
+                try:
+                    async with asyncio.timeout(self.timeout_s):
+                        result = await fn()
+                except Exception as e:
+                    self.metrics.end(start, ok=False)
+                    if attempt >= self.max_retries or not _is_retryable(e):
+                        raise
+                    delay = self._backoff(attempt, e)
+                else:
+                    self.metrics.end(start, ok=True)
+                    if result.generations:
+                        self.metrics.usage(usage_of(result.generations[0], result.llm_output))
+                    return result
+            await asyncio.sleep(delay)
+
+    def stream(self, fn: Callable[[], Iterator[ChatGenerationChunk]]) -> Iterator[ChatGenerationChunk]:
+        """已经输出过内容后出错不再重试，避免重复输出"""
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire_sync()
+            with self.gate:
+                start = time.perf_counter_ns()
+                self.metrics.begin()
+                started = ok = False
+                try:
+                    for chunk in fn():
+                        if not started:
+                            started = True
+                            self.metrics.first_token(start)
+                        self.metrics.usage(usage_of(chunk))
+                        yield chunk
+                    ok = True
+                    return
+                except Exception as e:
+                    if started or attempt >= self.max_retries or not _is_retryable(e):
+                        raise
+                    delay = self._backoff(attempt, e)
+                finally:
+                    self.metrics.end(start, ok=ok)
+            time.sleep(delay)
+
+    async def astream(self, fn: Callable[[], AsyncIterator[ChatGenerationChunk]]) -> AsyncIterator[ChatGenerationChunk]:
+        """超时只约束首个chunk，之后由客户端的读超时兜底"""
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            async with self.gate:
+                start = time.perf_counter_ns()
+                self.metrics.begin()
+                started = ok = False
+                try:
+                    iterator = fn().__aiter__()
+                    try:
+                        async with asyncio.timeout(self.timeout_s):
+                            chunk = await anext(iterator)
+                    except StopAsyncIteration:
+                        ok = True
+                        return
+                    started = True
+                    self.metrics.first_token(start)
+                    while True:
+                        self.metrics.usage(usage_of(chunk))
+                        yield chunk
+                        try:
+                            chunk = await anext(iterator)
+                        except StopAsyncIteration:
+                            break
+                    ok = True
+                    return
+                except Exception as e:
+                    if started or attempt >= self.max_retries or not _is_retryable(e):
+                        raise
+                    delay = self._backoff(attempt, e)
+                finally:
+                    self.metrics.end(start, ok=ok)
+            await asyncio.sleep(delay)
+
+
+class _ManagedChatModel:
+    """
+    给具体的聊天模型类加上调用策略，仍然是原来的模型类（bind_tools、with_structured_output、流式都照常可用）
+    """
+    _llm_policy: _Policy
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        inner = super()._generate
+        return self._llm_policy.call(lambda: inner(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                         **kwargs: Any) -> ChatResult:
+        inner = super()._agenerate
+        return await self._llm_policy.acall(lambda: inner(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        inner = super()._stream
+        yield from self._llm_policy.stream(lambda: inner(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        inner = super()._astream
+        async for chunk in self._llm_policy.astream(
+                lambda: inner(messages, stop=stop, run_manager=run_manager, **kwargs)):
+            yield chunk
+
+
+class ManagedChatOpenAI(_ManagedChatModel, ChatOpenAI):
+    _llm_policy: _Policy = PrivateAttr()
+
+
+class ManagedChatTongyi(_ManagedChatModel, ChatTongyi):
+    _llm_policy: _Policy = PrivateAttr()
+
+
+class LLMRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[str, BaseChatModel] = {}
+        self._policies: Dict[str, _Policy] = {}
+        self._http_client: Optional[httpx.Client] = None
+        self._http_async_client: Optional[httpx.AsyncClient] = None
+        settings = get_settings()
+        # 各优先级自己的令牌桶，所有模型共用：限制访客、后台任务整体占用的速率；登录用户聊天只受模型的速率限制
+        self._priority_buckets = {
+            LLMPriority.GUEST: TokenBucket(settings.LLM_GUEST_RPS, settings.LLM_GUEST_RPS * settings.LLM_RATE_BURST_S),
+            LLMPriority.BACKGROUND: TokenBucket(settings.LLM_BACKGROUND_RPS,
+                                                settings.LLM_BACKGROUND_RPS * settings.LLM_RATE_BURST_S),
+        }
+        self._max_wait_s = {
+            LLMPriority.CHAT: settings.LLM_CHAT_MAX_WAIT_S,
+            LLMPriority.GUEST: settings.LLM_GUEST_MAX_WAIT_S,
+            LLMPriority.BACKGROUND: settings.LLM_BACKGROUND_MAX_WAIT_S,
+        }
+
+    @staticmethod
+    def profiles() -> Dict[str, LLMProfile]:
+        settings = get_settings()
+        protocol = settings.LLM_DASHSCOPE_PROTOCOL
+        return {
+            # 路由一直走OpenAI兼容接口（流式解析、json_object约束输出）
+            LLM_ROUTER: LLMProfile(LLM_ROUTER, settings.LLM_ROUTER_MODEL, settings.LLM_ROUTER_CONCURRENCY,
+                                   settings.LLM_ROUTER_RPS),
+            LLM_MAIN: LLMProfile(LLM_MAIN, settings.LLM_MAIN_MODEL, settings.LLM_MAIN_CONCURRENCY,
+                                 settings.LLM_MAIN_RPS, protocol),
+            LLM_SMALL: LLMProfile(LLM_SMALL, settings.LLM_SMALL_MODEL, settings.LLM_SMALL_CONCURRENCY,
+                                  settings.LLM_SMALL_RPS, protocol),
+        }
+
+    def _http_clients(self) -> tuple[httpx.Client, httpx.AsyncClient]:
+        if self._http_client is None:
+            settings = get_settings()
+            limits = httpx.Limits(max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+                                  max_keepalive_connections=settings.LLM_HTTP_MAX_CONNECTIONS)
+            timeout = httpx.Timeout(settings.LLM_TIMEOUT_S, connect=10.0)
+            self._http_client = httpx.Client(limits=limits, timeout=timeout)
+            self._http_async_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        return self._http_client, self._http_async_client
+
+    def _build(self, profile: LLMProfile) -> BaseChatModel:
+        settings = get_settings()
+        limiter = PriorityRateLimiter(profile.model, profile.rps, profile.rps * settings.LLM_RATE_BURST_S,
+                                      self._priority_buckets, self._max_wait_s)
+        policy = _Policy(profile, limiter, timeout_s=settings.LLM_TIMEOUT_S, max_retries=settings.LLM_MAX_RETRIES,
+                         wait_s=settings.LLM_QUEUE_TIMEOUT_S)
+        if profile.protocol == "native":
+            # 重试由注册表统一做，sdk的tenacity重试只执行一次
+            model = ManagedChatTongyi(model=profile.model, max_retries=1)
+        else:
+            http_client, http_async_client = self._http_clients()
+            model = ManagedChatOpenAI(model=profile.model,
+                                      base_url=settings.DASHSCOPE_COMPATIBLE_BASE_URL,
+                                      api_key=os.getenv("DASHSCOPE_API_KEY"),
+                                      timeout=settings.LLM_TIMEOUT_S,
+                                      max_retries=0,
+                                      # 流式输出时也返回token用量（含命中缓存的token数）
+                                      stream_usage=True,
+                                      http_client=http_client,
+                                      http_async_client=http_async_client)
+        model._llm_policy = policy
+        self._policies[profile.name] = policy
+        logger.info("初始化模型客户端%s：%s（%s，并发上限%d，每秒%s次）", profile.name, profile.model, profile.protocol,
+                    profile.max_concurrency, profile.rps)
+        return model
+
+    def get(self, name: str) -> BaseChatModel:
+        client = self._clients.get(name)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(name)
+            if client is None:
+                profiles = self.profiles()
+                if name not in profiles:
+                    raise ValueError(f"未知的模型用途：{name}")
+                client = self._clients[name] = self._build(profiles[name])
+        return client
+
+    def admit(self, priority: LLMPriority) -> None:
+        """
+        请求入口的准入检查：预计排队时间已超过该优先级的等待上限时直接拒绝，不进入排队
+
+        :raise LLMBusyError
+        """
+        with self._lock:
+            policies = list(self._policies.values())
+        max_wait = self._max_wait_s[priority]
+        for policy in policies:
+            wait = policy.limiter.estimated_wait_s(priority)
+            if wait > max_wait:
+                raise LLMBusyError(f"模型{policy.profile.model}预计排队{wait:.1f}秒，超过{max_wait}秒（{priority.name}）")
+
+    def stats(self) -> Dict[str, dict]:
+        with self._lock:
+            policies = dict(self._policies)
+        return {name: {"model": p.profile.model, "max_concurrency": p.profile.max_concurrency, **p.metrics.stats(),
+                       "concurrency": p.gate.stats(),
+                       "rate_limit": p.limiter.stats()}
+                for name, p in policies.items()}
+
+
+_llm_registry: Optional[LLMRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_llm_registry() -> LLMRegistry:
+    global _llm_registry
+    if _llm_registry is None:
+        with _registry_lock:
+            if _llm_registry is None:
+                _llm_registry = LLMRegistry()
+    return _llm_registry
+
+
+def get_llm(name: str) -> BaseChatModel:
+    """按用途借用模型客户端：LLM_ROUTER/LLM_MAIN/LLM_SMALL"""
+    return get_llm_registry().get(name)
@@ -0,0 +1,292 @@
+"""
+大模型调用限流与排队
+
+- 令牌桶：每个模型一个（控制打到DashScope的请求速率），每个优先级一个（控制某类用户整体能占用的速率）
+- 优先级排队：模型令牌不够时，登录用户聊天 > 访客聊天 > 后台任务（标题生成等），高优先级先拿
+- 等待有上限（按优先级配置），超时抛LLMBusyError
+- 服务端限流（429）时整个模型暂停发放令牌一段时间，所有请求一起排队等待，而不是各自重试继续撞限流
+- 等待中的请求不轮询：每个模型一个分发线程，在有令牌时按优先级唤醒队首的请求（线程用Event、协程用Future）
+
+调用方所属的优先级通过上下文变量传递：请求入口处set_llm_priority，之后同一请求里的模型调用（含子图、工具内）自动带上
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Deque, Dict, Optional
+
+
+class LLMBusyError(RuntimeError):
+    """排队等待超时（并发名额或速率令牌）"""
+
+
+class LLMPriority(IntEnum):
+    """数值越小优先级越高"""
+    CHAT = 0
+    GUEST = 1
+    BACKGROUND = 2
+
+
+_llm_priority: contextvars.ContextVar[LLMPriority] = contextvars.ContextVar("llm_priority", default=LLMPriority.CHAT)
+
+# 优先级的令牌桶在各模型的限流器之间共用，所有限流器共用一把锁
+_lock = threading.Lock()
+
+
+def set_llm_priority(priority: LLMPriority) -> None:
+    """设置当前请求（上下文）中模型调用的优先级"""
+    _llm_priority.set(priority)
+
+
+def get_llm_priority() -> LLMPriority:
+    return _llm_priority.get()
+
+
+class Waiter:
+    """
+    排队等待的一次调用：线程用Event等待，协程用所在事件循环的Future等待
+
+    granted在锁内置位，表示已经拿到（令牌、并发名额等）；等待超时与被唤醒同时发生时据此判断
+    """
+    __slots__ = ("granted", "event", "loop", "future")
+
+    def __init__(self, event: Optional[threading.Event] = None, loop: Optional[asyncio.AbstractEventLoop] = None,
+                 future: Optional[asyncio.Future] = None):
+        self.granted = False
+        self.event = event
+        self.loop = loop
+        self.future = future
+
+    @classmethod
+    def for_thread(cls) -> "Waiter":
+        return cls(event=threading.Event())
+
+    @classmethod
+    def for_loop(cls) -> "Waiter":
+        loop = asyncio.get_running_loop()
+        return cls(loop=loop, future=loop.create_future())
+
+    def wake(self) -> None:
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+    def wait(self, timeout: float) -> bool:
+        return self.event.wait(timeout)
+
+    async def await_(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self.future, timeout)
+            return True
+        except TimeoutError:
+            return False
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class TokenBucket:
+    """rate：每秒补充的令牌数，<=0不限速；burst：桶容量"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self._tokens = self.burst
+        self._ts = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now > self._ts:
+            start = max(self._ts, self._paused_until)
+            if now > start:
+                self._tokens = min(self.burst, self._tokens + (now - start) * self.rate)
+            self._ts = now
+
+    def wait_time(self, now: float) -> float:
+        """还要等多少秒才有令牌，0表示现在就有"""
+        if self.rate <= 0:
+            return 0.0
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill(now)
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        if self.rate > 0:
+            self._refill(now)
+            self._tokens -= 1
+
+    def pause(self, now: float, seconds: float) -> None:
+        """暂停发放令牌，并清空已有令牌，恢复后平滑放量"""
+        if self.rate <= 0:
+            return
+        self._refill(now)
+        self._tokens = min(self._tokens, 0.0)
+        self._paused_until = max(self._paused_until, now + seconds)
+
+
+class _Stats:
+
+    def __init__(self):
+        self.granted = 0
+        self.rejected = 0
+        self.waiting = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "granted": self.granted,
+            "rejected": self.rejected,
+            "waiting": self.waiting,
+            "wait_ms_avg": round(self.wait_ms_total / self.granted, 2) if self.granted else 0.0,
+            "wait_ms_max": round(self.wait_ms_max, 2),
+        }
+
+
+class PriorityRateLimiter:
+    """
+    一个模型的限流器
+
+    等待中的请求按优先级分队列、队列内先来后到；模型令牌按优先级发给各队列的队首，
+    队首被自己优先级的令牌桶卡住时跳过该队列，不挡其他优先级的请求。
+    令牌够时调用方在入队时直接拿到，不够时由分发线程在令牌恢复后唤醒，等待中的请求不占用CPU和锁
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, priority_buckets: Dict[LLMPriority, TokenBucket],
+                 max_wait_s: Dict[LLMPriority, float]):
+        self.name = name
+        self._bucket = TokenBucket(rate, burst)
+        self._priority_buckets = priority_buckets
+        self._max_wait_s = max_wait_s
+        self._queues: Dict[LLMPriority, Deque[Waiter]] = {p: deque() for p in LLMPriority}
+        self._cond = threading.Condition(_lock)
+        self._dispatcher: Optional[threading.Thread] = None
+        self._throttled = 0
+        self._stats: Dict[LLMPriority, _Stats] = {p: _Stats() for p in LLMPriority}
+
+    def _dispatch(self, now: float) -> Optional[float]:
+        """在锁内调用：把现有令牌发给各队首，返回多久后再发一次，没有请求排队时返回None"""
+        while True:
+            waiting = False
+            blocked_wait = None
+            for priority in LLMPriority:
+                queue = self._queues[priority]
+                if not queue:
+                    continue
+                waiting = True
+                own_bucket = self._priority_buckets.get(priority)
+                own_wait = own_bucket.wait_time(now) if own_bucket else 0.0
+                if own_wait > 0:
+                    blocked_wait = own_wait if blocked_wait is None else min(blocked_wait, own_wait)
+                    continue
+                wait = self._bucket.wait_time(now)
+                if wait > 0:
+                    return wait if blocked_wait is None else min(wait, blocked_wait)
+                self._bucket.take(now)
+                if own_bucket:
+                    own_bucket.take(now)
+                waiter = queue.popleft()
+                waiter.granted = True
+                waiter.wake()
+                break
+            else:
+                # 一轮下来没有发出令牌：没有请求，或者各队首都被自己优先级的桶卡住
+                return blocked_wait if waiting else None
+
+    def _run_dispatcher(self) -> None:
+        with self._cond:
+            while True:
+                # 没有请求排队时一直睡到有新请求入队（notify）
+                self._cond.wait(self._dispatch(time.monotonic()))
+
+    def _enter(self, priority: LLMPriority, waiter: Waiter) -> None:
+        with _lock:
+            self._queues[priority].append(waiter)
+            self._stats[priority].waiting += 1
+            # 令牌够时直接拿到；拿不到再交给分发线程
+            self._dispatch(time.monotonic())
+            if not waiter.granted:
+                if self._dispatcher is None:
+                    self._dispatcher = threading.Thread(target=self._run_dispatcher, name=f"llm-limiter-{self.name}",
+                                                        daemon=True)
+                    self._dispatcher.start()
+                self._cond.notify()
+
+    def _leave(self, priority: LLMPriority, waiter: Waiter, start: float) -> bool:
+        """等待结束（拿到令牌、超时或被取消），返回是否拿到了令牌"""
+        with _lock:
+            stats = self._stats[priority]
+            stats.waiting -= 1
+            if waiter.granted:
+                ms = (time.monotonic() - start) * 1000
+                stats.granted += 1
+                stats.wait_ms_total += ms
+                stats.wait_ms_max = max(stats.wait_ms_max, ms)
+                return True
+            stats.rejected += 1
+            self._queues[priority].remove(waiter)
+            return False
+
+    def _busy(self, priority: LLMPriority) -> LLMBusyError:
+        return LLMBusyError(f"模型{self.name}排队超过{self._max_wait_s.get(priority)}秒（{priority.name}）")
+
+    async def acquire(self, priority: Optional[LLMPriority] = None) -> None:
+        priority = get_llm_priority() if priority is None else priority
+        waiter = Waiter.for_loop()
+        start = time.monotonic()
+        self._enter(priority, waiter)
+        try:
+            if not waiter.granted:
+                await waiter.await_(self._max_wait_s.get(priority, 0))
+        finally:
+            granted = self._leave(priority, waiter, start)
+        if not granted:
+            raise self._busy(priority)
+
+    def acquire_sync(self, priority: Optional[LLMPriority] = None) -> None:
+        priority = get_llm_priority() if priority is None else priority
+        waiter = Waiter.for_thread()
+        start = time.monotonic()
+        self._enter(priority, waiter)
+        if not waiter.granted:
+            waiter.wait(self._max_wait_s.get(priority, 0))
+        if not self._leave(priority, waiter, start):
+            raise self._busy(priority)
+
+    def throttle(self, seconds: float) -> None:
+        """服务端限流：所有请求一起暂停"""
+        with _lock:
+            self._throttled += 1
+            self._bucket.pause(time.monotonic(), seconds)
+            self._cond.notify()
+
+    def estimated_wait_s(self, priority: LLMPriority) -> float:
+        """
+        粗略估计新请求要排多久，取以下两者的较大值：
+        - 模型令牌：恢复的时间 + 排在前面的请求数/模型速率
+        - 自己优先级的令牌（访客、后台任务）：恢复的时间 + 同优先级排队数/该优先级速率（该桶各模型共用，这里只算本模型的排队）
+        """
+        now = time.monotonic()
+        with _lock:
+            ahead = sum(len(self._queues[p]) for p in LLMPriority if p <= priority)
+            rate = self._bucket.rate
+            wait = self._bucket.wait_time(now) + (ahead / rate if rate > 0 else 0.0)
+            own_bucket = self._priority_buckets.get(priority)
+            if own_bucket is not None and own_bucket.rate > 0:
+                own_wait = own_bucket.wait_time(now) + len(self._queues[priority]) / own_bucket.rate
+                wait = max(wait, own_wait)
+        return wait
+
+    def stats(self) -> dict:
+        with _lock:
+            return {
+                "rate": self._bucket.rate,
+                "throttled": self._throttled,
+                "by_priority": {p.name.lower(): s.to_dict() for p, s in self._stats.items()},
+            }
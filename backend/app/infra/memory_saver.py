@@ -0,0 +1,327 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata, \
+    CheckpointTuple, WRITES_IDX_MAP, get_checkpoint_id, get_checkpoint_metadata
+
+from app.infra.log import logger
+
+# 每个缓存条目的固定开销估算（字典、元组等）
+_ENTRY_OVERHEAD = 512
+
+
+@dataclass
+class _Slot:
+    """一个(thread_id, checkpoint_ns)下最新的checkpoint，均为序列化后的字节"""
+    checkpoint_id: str
+    checkpoint: Tuple[str, bytes]
+    metadata: Tuple[str, bytes]
+    parent_id: Optional[str]
+    # channel -> (version, typed value)
+    blobs: Dict[str, Tuple[Any, Tuple[str, bytes]]]
+    # (task_id, idx) -> (task_id, channel, typed value, task_path)
+    writes: Dict[Tuple[str, int], Tuple[str, str, Tuple[str, bytes], str]] = field(default_factory=dict)
+    size: int = 0
+
+    def measure(self) -> int:
+        size = _ENTRY_OVERHEAD + len(self.checkpoint[1]) + len(self.metadata[1])
+        size += sum(len(typed[1] or b"") for _, typed in self.blobs.values())
+        size += sum(len(w[2][1] or b"") for w in self.writes.values())
+        self.size = size
+        return size
+
+
+@dataclass
+class _ThreadEntry:
+    slots: Dict[str, _Slot] = field(default_factory=dict)
+    touched: float = 0.0
+
+    @property
+    def size(self) -> int:
+        return sum(slot.size for slot in self.slots.values())
+
+
+class BoundedMemorySaver(BaseCheckpointSaver):
+    """
+    有界内存checkpoint缓存
+
+    - 每个会话只保留最新的checkpoint（历史版本由MySQL提供），未变化的通道复用上次的序列化结果
+    - 按会话LRU淘汰：总字节数超过max_bytes或会话数超过max_threads时淘汰最久未访问的会话
+    - 空闲超过idle_ttl秒的会话由后台线程逐步清理，不会出现整点全部失效
+    - 查不到时返回None，由上层回源MySQL
+    """
+
+    def __init__(self, max_bytes: int, max_threads: int, idle_ttl: float) -> None:
+        super().__init__()
+        self._max_bytes = max_bytes
+        self._max_threads = max_threads
+        self._idle_ttl = idle_ttl
+        self._threads: OrderedDict[str, _ThreadEntry] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted_size = 0
+        self.evicted_ttl = 0
+        threading.Thread(target=self._sweep_loop, name="AgentMemory-Sweeper", daemon=True).start()
+
+    # ---------------- 读 ----------------
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        with self._lock:
+            entry = self._threads.get(thread_id)
+            slot = entry.slots.get(checkpoint_ns) if entry is not None else None
+            if slot is None or (checkpoint_id and slot.checkpoint_id != checkpoint_id):
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry.touched = time.monotonic()
+            self._threads.move_to_end(thread_id)
+            writes = list(slot.writes.values())
+        return self._to_tuple(thread_id, checkpoint_ns, slot, writes)
+
+    def list(
+            self,
+            config: RunnableConfig | None,
+            *,
+            filter: dict[str, Any] | None = None,
+            before: RunnableConfig | None = None,
+            limit: int | None = None,
+    ) -> Iterator[CheckpointTuple]:
+        """只能列出各会话最新的checkpoint"""
+        config_ns = config["configurable"].get("checkpoint_ns") if config else None
+        config_id = get_checkpoint_id(config) if config else None
+        before_id = get_checkpoint_id(before) if before else None
+        with self._lock:
+            if config:
+                entry = self._threads.get(config["configurable"]["thread_id"])
+                entries = [(config["configurable"]["thread_id"], entry)] if entry else []
+            else:
+                entries = list(self._threads.items())
+            candidates = [(tid, ns, slot, list(slot.writes.values()))
+                          for tid, entry in entries for ns, slot in entry.slots.items()]
+        for thread_id, ns, slot, writes in candidates:
+            if limit is not None and limit <= 0:
+                break
+            if config_ns is not None and ns != config_ns:
+                continue
+            if config_id and slot.checkpoint_id != config_id:
+                continue
+            if before_id and slot.checkpoint_id >= before_id:
+                continue
+            tup = self._to_tuple(thread_id, ns, slot, writes)
+            if filter and not all(tup.metadata.get(k) == v for k, v in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield tup
+
+    def _to_tuple(self, thread_id: str, checkpoint_ns: str, slot: _Slot, writes: list) -> CheckpointTuple:
+        checkpoint: Checkpoint = self.serde.loads_typed(slot.checkpoint)
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": slot.checkpoint_id}},
+            checkpoint={
+                **checkpoint,
+                "channel_values": {k: self.serde.loads_typed(typed) for k, (_, typed) in slot.blobs.items()
+                                   if typed[0] != "empty"},
+            },
+            metadata=self.serde.loads_typed(slot.metadata),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                  "checkpoint_id": slot.parent_id}}
+                if slot.parent_id else None
+            ),
+            pending_writes=[(task_id, channel, self.serde.loads_typed(typed)) for task_id, channel, typed, _ in writes],
+        )
+
+    # ---------------- 写 ----------------
+    def put(
+            self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        with self._lock:
+            entry = self._threads.get(thread_id)
+            old = entry.slots.get(checkpoint_ns) if entry is not None else None
+            old_blobs = old.blobs if old is not None else {}
+        slot = self._make_slot(checkpoint, get_checkpoint_metadata(config, metadata),
+                               config["configurable"].get("checkpoint_id"), old_blobs, new_versions)
+        with self._lock:
+            self._store(thread_id, checkpoint_ns, slot)
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                 "checkpoint_id": checkpoint["id"]}}
+
+    def fill(self, tup: CheckpointTuple) -> bool:
+        """
+        回源读到的checkpoint直接写入缓存（含pending writes），不走put
+
+        缓存中已有同一个或更新的checkpoint时不覆盖（回源期间可能有新的写入），返回是否写入
+        """
+        configurable = tup.config["configurable"]
+        thread_id, checkpoint_ns = configurable["thread_id"], configurable.get("checkpoint_ns", "")
+        parent_id = tup.parent_config["configurable"]["checkpoint_id"] if tup.parent_config else None
+        slot = self._make_slot(tup.checkpoint, tup.metadata, parent_id, {}, {})
+        for idx, (task_id, channel, value) in enumerate(tup.pending_writes or []):
+            slot.writes[(task_id, WRITES_IDX_MAP.get(channel, idx))] = \
+                (task_id, channel, self.serde.dumps_typed(value), "")
+        slot.measure()
+        with self._lock:
+            entry = self._threads.get(thread_id)
+            current = entry.slots.get(checkpoint_ns) if entry is not None else None
+            if current is not None and current.checkpoint_id >= slot.checkpoint_id:
+                return False
+            self._store(thread_id, checkpoint_ns, slot)
+        return True
+
+    def _make_slot(self, checkpoint: Checkpoint, metadata: CheckpointMetadata, parent_id: Optional[str],
+                   old_blobs: dict, new_versions: ChannelVersions) -> _Slot:
+        c = checkpoint.copy()
+        values: dict[str, Any] = c.pop("channel_values")
+        # 版本未变的通道直接复用上次的序列化结果，只序列化变化的通道
+        blobs = {}
+        for k, version in checkpoint["channel_versions"].items():
+            prev = old_blobs.get(k)
+            if prev is not None and prev[0] == version and k not in new_versions:
+                blobs[k] = prev
+            elif k in values:
+                blobs[k] = (version, self.serde.dumps_typed(values[k]))
+        slot = _Slot(
+            checkpoint_id=checkpoint["id"],
+            checkpoint=self.serde.dumps_typed(c),
+            metadata=self.serde.dumps_typed(metadata),
+            parent_id=parent_id,
+            blobs=blobs,
+        )
+        slot.measure()
+        return slot
+
+    def _store(self, thread_id: str, checkpoint_ns: str, slot: _Slot) -> None:
+        """调用方持有锁"""
+        entry = self._threads.get(thread_id)
+        if entry is None:
+            entry = self._threads[thread_id] = _ThreadEntry()
+        old = entry.slots.get(checkpoint_ns)
+        self._bytes += slot.size - (old.size if old is not None else 0)
+        entry.slots[checkpoint_ns] = slot
+        entry.touched = time.monotonic()
+        self._threads.move_to_end(thread_id)
+        self._evict_over_limit()
+
+    def put_writes(
+            self,
+            config: RunnableConfig,
+            writes: Sequence[tuple[str, Any]],
+            task_id: str,
+            task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        serialized = [(WRITES_IDX_MAP.get(channel, idx), channel, self.serde.dumps_typed(value))
+                      for idx, (channel, value) in enumerate(writes)]
+        with self._lock:
+            entry = self._threads.get(thread_id)
+            slot = entry.slots.get(checkpoint_ns) if entry is not None else None
+            if slot is None:
+                return
+            if slot.checkpoint_id != checkpoint_id:
+                # 写入针对的不是缓存中的checkpoint，缓存不再可信，丢弃后回源
+                self._bytes -= slot.size
+                del entry.slots[checkpoint_ns]
+                if not entry.slots:
+                    del self._threads[thread_id]
+                return
+            for idx, channel, typed in serialized:
+                key = (task_id, idx)
+                if idx >= 0 and key in slot.writes:
+                    continue
+                slot.writes[key] = (task_id, channel, typed, task_path)
+            old_size = slot.size
+            self._bytes += slot.measure() - old_size
+            self._evict_over_limit()
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            entry = self._threads.pop(thread_id, None)
+            if entry is not None:
+                self._bytes -= entry.size
+
+    # ---------------- 异步（纯内存操作，直接调用同步实现） ----------------
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return self.get_tuple(config)
+
+    async def alist(
+            self,
+            config: RunnableConfig | None,
+            *,
+            filter: dict[str, Any] | None = None,
+            before: RunnableConfig | None = None,
+            limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        for item in self.list(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        return self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return self.delete_thread(thread_id)
+
+    # ---------------- 淘汰 ----------------
+    def _evict_over_limit(self) -> None:
+        """调用方持有锁"""
+        while self._threads and (self._bytes > self._max_bytes or len(self._threads) > self._max_threads):
+            _, entry = self._threads.popitem(last=False)
+            self._bytes -= entry.size
+            self.evicted_size += 1
+
+    def evict_idle(self) -> int:
+        """清理空闲超时的会话，LRU顺序即最近访问顺序，从头部扫到第一个未超时的即可"""
+        deadline = time.monotonic() - self._idle_ttl
+        evicted = 0
+        with self._lock:
+            while self._threads:
+                thread_id, entry = next(iter(self._threads.items()))
+                if entry.touched > deadline:
+                    break
+                del self._threads[thread_id]
+                self._bytes -= entry.size
+                evicted += 1
+            self.evicted_ttl += evicted
+        return evicted
+
+    def _sweep_loop(self) -> None:
+        interval = max(1.0, min(self._idle_ttl / 4, 60.0))
+        while True:
+            time.sleep(interval)
+            if evicted := self.evict_idle():
+                logger.info("本地记忆清理空闲会话%d个，当前%s", evicted, self.stats())
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "threads": len(self._threads),
+                "size_mb": round(self._bytes / 1024 / 1024, 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evicted_size": self.evicted_size,
+                "evicted_ttl": self.evicted_ttl,
+            }
@@ -1,7 +1,17 @@
-from sqlalchemy import create_engine
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from sqlalchemy import create_engine, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from app.infra.log import logger
 from app.infra.settings import get_settings
 
+# 借连接等待超过该值时打warning
+_SLOW_CHECKOUT_MS = 100
+
 
 class MySQLManager:
     """MySQL数据库管理器，支持延迟初始化"""
@@ -11,18 +21,33 @@ class MySQLManager:
         self._session_factory = None
         self._base = None
         self._initialized = False
+        self._init_lock = threading.Lock()
+        self._async_engine = None
+        self._async_session_factory = None
+        self._async_lock = threading.Lock()
+        # 原生连接借还：线程内复用 + 等待耗时统计
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._checkout_wait_ms_total = 0.0
+        self._checkout_wait_ms_max = 0.0
 
     def initialize(self):
         """延迟初始化数据库连接"""
         if self._initialized:
             return
-
-        mysql_url = get_settings().MYSQL_URL
-        self._engine = create_engine(mysql_url, pool_recycle=300)
-        self._session_factory = sessionmaker(bind=self._engine, autoflush=True, expire_on_commit=True)
-        self._base = declarative_base()
-        self._base.metadata.create_all(bind=self._engine)
-        self._initialized = True
+        # 启动时后台预热线程和主线程（导入模型类）可能同时触发
+        with self._init_lock:
+            if self._initialized:
+                return
+            settings = get_settings()
+            self._engine = create_engine(settings.MYSQL_URL, pool_recycle=300,
+                                         pool_size=settings.MYSQL_POOL_SIZE,
+                                         max_overflow=settings.MYSQL_MAX_OVERFLOW)
+            self._session_factory = sessionmaker(bind=self._engine, autoflush=True, expire_on_commit=True)
+            self._base = declarative_base()
+            self._base.metadata.create_all(bind=self._engine)
+            self._initialized = True
 
     @property
     def engine(self):
@@ -45,6 +70,87 @@ class MySQLManager:
             self.initialize()
         return self._base
 
+    @property
+    def AsyncDbSession(self):
+        """获取异步数据库会话（aiomysql驱动，独立连接池），用于async接口，不占用线程"""
+        if self._async_session_factory is None:
+            with self._async_lock:
+                if self._async_session_factory is None:
+                    settings = get_settings()
+                    url = make_url(settings.MYSQL_URL).set(drivername="mysql+aiomysql")
+                    self._async_engine = create_async_engine(url, pool_recycle=300,
+                                                             pool_size=settings.MYSQL_POOL_SIZE,
+                                                             max_overflow=settings.MYSQL_MAX_OVERFLOW)
+                    self._async_session_factory = async_sessionmaker(bind=self._async_engine,
+                                                                     expire_on_commit=False)
+        return self._async_session_factory
+
+    @contextmanager
+    def raw_connection(self) -> Iterator:
+        """
+        从连接池借一个DBAPI连接，退出时归还（归还时连接池会rollback，结束读快照）。
+        同一线程内嵌套借用复用同一个连接，不会重复占用连接池。
+        """
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if conn is not None:
+            local.depth += 1
+            try:
+                yield conn
+            finally:
+                local.depth -= 1
+            return
+
+        start = time.perf_counter_ns()
+        conn = self.engine.pool.connect()
+        self._record_checkout((time.perf_counter_ns() - start) / 1e6)
+        local.conn, local.depth, local.in_tx = conn, 1, False
+        try:
+            yield conn
+        finally:
+            local.conn = None
+            conn.close()
+
+    @contextmanager
+    def raw_transaction(self) -> Iterator:
+        """在一个事务中执行多次写入；已在事务中时直接复用外层事务"""
+        with self.raw_connection() as conn:
+            if self._local.in_tx:
+                yield conn
+                return
+            self._local.in_tx = True
+            conn.begin()
+            try:
+                yield conn
+                conn.commit()
+            except:
+                conn.rollback()
+                raise
+            finally:
+                self._local.in_tx = False
+
+    def in_transaction(self) -> bool:
+        return getattr(self._local, "conn", None) is not None and self._local.in_tx
+
+    def _record_checkout(self, wait_ms: float) -> None:
+        with self._stats_lock:
+            self._checkouts += 1
+            self._checkout_wait_ms_total += wait_ms
+            self._checkout_wait_ms_max = max(self._checkout_wait_ms_max, wait_ms)
+        if wait_ms > _SLOW_CHECKOUT_MS:
+            logger.warning("mysql借连接等待%.2fms，连接池状态：%s", wait_ms, self.engine.pool.status())
+
+    def pool_stats(self) -> dict:
+        """连接池借用统计"""
+        with self._stats_lock:
+            checkouts = self._checkouts
+            return {
+                "checkouts": checkouts,
+                "wait_ms_avg": round(self._checkout_wait_ms_total / checkouts, 3) if checkouts else 0.0,
+                "wait_ms_max": round(self._checkout_wait_ms_max, 3),
+                "pool": self.engine.pool.status(),
+            }
+
 
 # 全局MySQL管理器实例
-mysql_manager = MySQLManager()
\ No newline at end of file
+mysql_manager = MySQLManager()
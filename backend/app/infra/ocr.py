@@ -1,41 +1,186 @@
+import threading
 import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from importlib import metadata
+from typing import Dict, List, Optional
 
 import requests
-import json
+from requests.adapters import HTTPAdapter
 
 from app.infra.log import logger
+from app.infra.ocr_cache import get_ocr_cache, OcrCache
+from app.infra.proc_pool import get_process_pool
 from app.infra.settings import get_settings
 
-def ocr_parse(image_path:str):
-    settings = get_settings()
-    if settings.OCR_MODE == "buyan":
-        return buyan_ocr_parse(image_path)
-    else:
-        raise ValueError(f"非法的OCR_MODE={settings.OCR_MODE}")
-
-def buyan_ocr_parse(image_path:str):
-    start = time.perf_counter_ns()  # 纳秒级起点
-    url = "https://qaqbuyan.com:88/api/ocr/"
-    with open(image_path, "rb") as img:
-        try:
+
+class OcrEngine(ABC):
+    """OCR引擎接口，按OCR_MODE切换实现"""
+    name: str = ""
+
+    @property
+    def version(self) -> str:
+        """引擎版本，识别结果缓存以name+version区分"""
+        return ""
+
+    @abstractmethod
+    def recognize_batch(self, image_paths: List[str]) -> List[List[str]]:
+        """批量识别，返回与image_paths一一对应的文本行列表"""
+        raise NotImplementedError
+
+    def recognize(self, image_path: str) -> List[str]:
+        return self.recognize_batch([image_path])[0]
+
+
+class BuyanOcrEngine(OcrEngine):
+    """远程OCR：复用HTTP连接池，多张图片并发请求"""
+    name = "buyan"
+    _url = "https://qaqbuyan.com:88/api/ocr/"
+    _headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                      "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+    }
+
+    def __init__(self, concurrency: int, timeout: int):
+        self._timeout = timeout
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="OCR-Remote")
+
+    @property
+    def version(self) -> str:
+        return "v1"
+
+    def recognize_batch(self, image_paths: List[str]) -> List[List[str]]:
+        return list(self._executor.map(self._recognize_one, image_paths))
+
+    def _recognize_one(self, image_path: str) -> List[str]:
+        start = time.perf_counter_ns()  # 纳秒级起点
+        with open(image_path, "rb") as img:
             files = {"image": (image_path, img, "application/octet-stream")}
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-                              "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            }
-
-            resp = requests.post(url, files=files, headers=headers, timeout=30).json()
-            if resp['code_code'] != 200:
-                raise Exception(f"响应{resp.code}")
-            texts = [e['text'] for e in resp['results']]
-
-            logger.debug("识别结果：")
-            logger.debug(texts)
-
-            elapsed_ms = (time.perf_counter_ns() - start) / 1e6
-            logger.debug(f"buyan ocr耗时 {elapsed_ms:.2f} ms")
-            return texts
-        except requests.exceptions.RequestException as e:
-            logger.debug("请求失败：", e)
-        except json.JSONDecodeError:
-            logger.debug("返回不是合法 JSON，原文：", resp.text)
\ No newline at end of file
+            resp = self._session.post(self._url, files=files, headers=self._headers, timeout=self._timeout)
+        try:
+            body = resp.json()
+        except ValueError:
+            raise Exception(f"buyan ocr返回不是合法JSON，原文：{resp.text[:200]}")
+        if body.get('code_code') != 200:
+            raise Exception(f"buyan ocr响应{body.get('code_code')}")
+        texts = [e['text'] for e in body['results']]
+
+        logger.debug("识别结果：%s", texts)
+        elapsed_ms = (time.perf_counter_ns() - start) / 1e6
+        logger.debug(f"buyan ocr耗时 {elapsed_ms:.2f} ms")
+        return texts
+
+
+# 子进程内的easyocr模型，每个进程只加载一次
+_easyocr_reader = None
+
+
+def _easyocr_recognize_batch(image_paths: List[str], langs: List[str], model_path: Optional[str],
+                             batch_size: int) -> List[List[str]]:
+    """在进程池子进程中执行，模型目录给定时不联网下载"""
+    global _easyocr_reader
+    if _easyocr_reader is None:
+        import easyocr
+        _easyocr_reader = easyocr.Reader(langs, gpu=False,
+                                         model_storage_directory=model_path,
+                                         download_enabled=model_path is None)
+    # batch_size：同一张图的文本行按批送入识别模型
+    return [_easyocr_reader.readtext(path, detail=0, batch_size=batch_size) for path in image_paths]
+
+
+class EasyOcrEngine(OcrEngine):
+    """本地OCR：图片按批次分发到进程池并行识别，无需网络"""
+    name = "easyocr"
+
+    def __init__(self, langs: List[str], model_path: Optional[str], batch_size: int):
+        self._langs = langs
+        self._model_path = model_path
+        self._batch_size = batch_size
+
+    @property
+    def version(self) -> str:
+        try:
+            return metadata.version("easyocr")
+        except metadata.PackageNotFoundError:
+            raise ValueError("OCR_MODE=easyocr 需要安装 easyocr（pip install jp-ai[ocr]）")
+
+    def recognize_batch(self, image_paths: List[str]) -> List[List[str]]:
+        start = time.perf_counter_ns()
+        pool = get_process_pool()
+        size = self._batch_size
+        futures = [pool.submit(_easyocr_recognize_batch, image_paths[i:i + size], self._langs,
+                               self._model_path, size)
+                   for i in range(0, len(image_paths), size)]
+        results: List[List[str]] = []
+        for future in futures:
+            results.extend(future.result())
+        elapsed_ms = (time.perf_counter_ns() - start) / 1e6
+        logger.debug(f"easyocr识别{len(image_paths)}张耗时 {elapsed_ms:.2f} ms")
+        return results
+
+
+_ocr_engine: Optional[OcrEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_ocr_engine() -> OcrEngine:
+    global _ocr_engine
+    if _ocr_engine is not None:
+        return _ocr_engine
+
+    with _engine_lock:
+        if _ocr_engine is None:
+            settings = get_settings()
+            if settings.OCR_MODE == "buyan":
+                _ocr_engine = BuyanOcrEngine(concurrency=settings.OCR_REMOTE_CONCURRENCY,
+                                             timeout=settings.OCR_REMOTE_TIMEOUT)
+            elif settings.OCR_MODE == "easyocr":
+                _ocr_engine = EasyOcrEngine(langs=settings.OCR_EASYOCR_LANGS.split(","),
+                                            model_path=settings.OCR_EASYOCR_MODEL_PATH,
+                                            batch_size=settings.OCR_BATCH_SIZE)
+            else:
+                raise ValueError(f"非法的OCR_MODE={settings.OCR_MODE}")
+    return _ocr_engine
+
+
+def ocr_parse(image_path: str) -> List[str]:
+    return ocr_parse_batch([image_path])[0]
+
+
+def ocr_parse_batch(image_paths: List[str], stats: Optional[Dict] = None) -> List[List[str]]:
+    """
+    批量识别（扫描件多页），结果顺序与入参一致
+
+    先查OCR缓存，只有未命中的图片才送去识别。
+    stats不为空时写入本次调用的命中数/识别数及缓存整体状态。
+    """
+    if not image_paths:
+        return []
+    engine = get_ocr_engine()
+    cache: Optional[OcrCache] = get_ocr_cache()
+    if cache is None:
+        results = engine.recognize_batch(image_paths)
+        if stats is not None:
+            stats.update({"images": len(image_paths), "cache_hits": 0, "recognized": len(image_paths)})
+        return results
+
+    keys = [OcrCache.make_key(path, engine.name, engine.version) for path in image_paths]
+    cached = cache.get_many(keys)
+    # 同一批次内重复的图片只识别一次
+    todo: Dict[str, str] = {}
+    for key, path in zip(keys, image_paths):
+        if key not in cached and key not in todo:
+            todo[key] = path
+    if todo:
+        recognized = dict(zip(todo.keys(), engine.recognize_batch(list(todo.values()))))
+        cache.put_many(recognized)
+        cached.update(recognized)
+
+    if stats is not None:
+        stats.update({"images": len(image_paths), "cache_hits": len(image_paths) - len(todo),
+                      "recognized": len(todo), "cache": cache.stats()})
+    return [cached[key] for key in keys]
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.infra.log import logger
+from app.infra.settings import get_settings
+
+
+class OcrCache:
+    """
+    OCR识别结果的磁盘缓存（sqlite单文件）
+
+    - key：图片内容sha256 + 引擎名 + 引擎版本，换引擎或升级版本自然失效
+    - 总大小超过上限时按最近访问时间淘汰
+    """
+
+    def __init__(self, db_path: str, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_cache ("
+            "  cache_key TEXT PRIMARY KEY,"
+            "  texts TEXT NOT NULL,"
+            "  size INTEGER NOT NULL,"
+            "  accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed_at ON ocr_cache(accessed_at)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+        # 进程内累计命中统计
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(image_path: str, engine: str, version: str) -> str:
+        with open(image_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        return f"{digest}:{engine}:{version}"
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[str]]:
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT cache_key, texts FROM ocr_cache WHERE cache_key IN ({placeholders})", keys
+            ).fetchall()
+            if rows:
+                now = time.time()
+                self._conn.executemany("UPDATE ocr_cache SET accessed_at = ? WHERE cache_key = ?",
+                                       [(now, k) for k, _ in rows])
+                self._conn.commit()
+            found = {k: json.loads(v) for k, v in rows}
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, List[str]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for key, texts in items.items():
+            value = json.dumps(texts, ensure_ascii=False)
+            rows.append((key, value, len(value.encode("utf-8")), now))
+        with self._lock:
+            old = self._conn.execute(
+                f"SELECT COALESCE(SUM(size), 0) FROM ocr_cache WHERE cache_key IN ({','.join('?' * len(rows))})",
+                [r[0] for r in rows]
+            ).fetchone()[0]
+            self._conn.executemany("INSERT OR REPLACE INTO ocr_cache VALUES (?, ?, ?, ?)", rows)
+            self._total_bytes += sum(r[2] for r in rows) - old
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """超出上限时淘汰最久未访问的条目，直到回到上限的90%"""
+        if self._total_bytes <= self._max_bytes:
+            return
+        target = self._max_bytes * 0.9
+        cursor = self._conn.execute("SELECT cache_key, size FROM ocr_cache ORDER BY accessed_at")
+        victims = []
+        for key, size in cursor:
+            if self._total_bytes <= target:
+                break
+            victims.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM ocr_cache WHERE cache_key = ?", victims)
+        self.evictions += len(victims)
+        logger.info("ocr缓存淘汰%d条，当前%.2fMB", len(victims), self._total_bytes / 1024 / 1024)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM ocr_cache").fetchone()[0]
+            return {
+                "entries": entries,
+                "size_mb": round(self._total_bytes / 1024 / 1024, 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_ocr_cache: Optional[OcrCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_ocr_cache() -> Optional[OcrCache]:
+    """OCR_CACHE_MAX_MB<=0 时不启用缓存，返回None"""
+    global _ocr_cache
+    settings = get_settings()
+    if settings.OCR_CACHE_MAX_MB <= 0:
+        return None
+    if _ocr_cache is not None:
+        return _ocr_cache
+
+    with _cache_lock:
+        if _ocr_cache is None:
+            db_path = settings.OCR_CACHE_PATH or str(Path(settings.FILE_STORE_PATH) / "ocr_cache.db")
+            _ocr_cache = OcrCache(db_path, settings.OCR_CACHE_MAX_MB * 1024 * 1024)
+            logger.info("init ocr cache %s", db_path)
+    return _ocr_cache
@@ -0,0 +1,19 @@
+"""pdf扫描页检测与栅格化，rasterize_pdf_page在进程池子进程中执行"""
+from typing import List
+
+from pypdf import PdfReader
+
+
+def pdf_image_pages(file_url: str, page_indexes: List[int]) -> List[int]:
+    """从候选页（文字过少）中筛出含图片的页，即需要OCR的扫描页；空白页不OCR"""
+    reader = PdfReader(file_url)
+    return [i for i in page_indexes if len(reader.pages[i].images) > 0]
+
+
+def rasterize_pdf_page(file_url: str, page_index: int, dpi: int, out_dir: str) -> str:
+    """把单页渲染成png（依赖poppler），返回图片路径"""
+    from pdf2image import convert_from_path
+    paths = convert_from_path(file_url, dpi=dpi, first_page=page_index + 1, last_page=page_index + 1,
+                              output_folder=out_dir, fmt="png", single_file=True,
+                              output_file=f"page_{page_index}", paths_only=True)
+    return paths[0]
@@ -0,0 +1,32 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from app.infra.log import logger
+from app.infra.settings import get_settings
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    获取CPU密集任务（文档解析、OCR）共用的进程池，懒加载。
+
+    使用spawn方式启动子进程：主进程里有线程池和数据库连接，fork会把锁状态一起复制过去。
+    提交给进程池的函数必须是模块级函数，且所在模块导入时不能有连库等副作用。
+    """
+    global _process_pool
+    if _process_pool is not None:
+        return _process_pool
+
+    with _pool_lock:
+        if _process_pool is None:
+            workers = get_settings().RAG_PARSE_WORKERS
+            _process_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            logger.info("init process pool, workers=%d", workers)
+    return _process_pool
@@ -1,8 +1,62 @@
 from typing import Optional
 import redis
+from redis.cache import CacheConfig
 from app.infra.log import logger
 from app.infra.settings import get_settings
 import threading
+import time
+
+# 借连接等待超过该值时打warning
+_SLOW_CHECKOUT_MS = 50
+
+
+class MeteredConnectionPool(redis.BlockingConnectionPool):
+    """连接池用尽时阻塞等待（最多timeout秒），并统计借连接的等待耗时"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+
+    def get_connection(self, *args, **kwargs):
+        start = time.perf_counter_ns()
+        connection = super().get_connection(*args, **kwargs)
+        wait_ms = (time.perf_counter_ns() - start) / 1e6
+        with self._stats_lock:
+            self.checkouts += 1
+            self.wait_ms_total += wait_ms
+            self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+        if wait_ms > _SLOW_CHECKOUT_MS:
+            logger.warning("redis借连接等待%.2fms，连接池上限%d", wait_ms, self.max_connections)
+        return connection
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = {
+                "max_connections": self.max_connections,
+                "created": len(self._connections),
+                "checkouts": self.checkouts,
+                "wait_ms_avg": round(self.wait_ms_total / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_ms_max": round(self.wait_ms_max, 3),
+            }
+        if self.cache is not None:
+            stats["client_cache_entries"] = self.cache.size
+        return stats
+
+
+def _check_mode() -> str:
+    settings = get_settings()
+    # 轻量模式下不允许使用 Redis
+    if settings.MODE == "lite":
+        raise ValueError("轻量模式（MODE=lite）下不支持 Redis，请使用标准模式（MODE=std）")
+
+    # 标准模式下必须提供 REDIS_URL
+    if not settings.REDIS_URL:
+        raise ValueError("标准模式（MODE=std）下必须提供 REDIS_URL 环境变量")
+    return settings.REDIS_URL
+
 
 _redis_client: Optional[redis.Redis] = None
 _client_lock = threading.Lock()
@@ -10,40 +64,68 @@ _client_lock = threading.Lock()
 def get_redis_client() -> Optional[redis.Redis]:
     """
     获取 Redis 客户端。
-    
+
     在轻量模式下返回 None，在标准模式下返回 Redis 客户端实例。
-    
+
     Returns:
         Optional[redis.Redis]: Redis 客户端实例，轻量模式下为 None
-        
+
     Raises:
         ValueError: 轻量模式下尝试获取 Redis 客户端
         ValueError: 标准模式下 REDIS_URL 未配置
     """
     global _redis_client
-    
-    settings = get_settings()
-    # 轻量模式下不允许使用 Redis
-    if settings.MODE == "lite":
-        raise ValueError("轻量模式（MODE=lite）下不支持 Redis，请使用标准模式（MODE=std）")
-    
-    # 标准模式下必须提供 REDIS_URL
-    if not settings.REDIS_URL:
-        raise ValueError("标准模式（MODE=std）下必须提供 REDIS_URL 环境变量")
-    
+
+    redis_url = _check_mode()
     if _redis_client is not None:
         return _redis_client
 
     with _client_lock:
         if _redis_client is None:
-            redis_url = settings.REDIS_URL
-            tmp = redis.from_url(
+            settings = get_settings()
+            pool = MeteredConnectionPool.from_url(
                 redis_url,
                 encoding="utf-8",
                 decode_responses=True,
-                max_connections=20,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                timeout=settings.REDIS_POOL_TIMEOUT_S,
             )
+            tmp = redis.Redis(connection_pool=pool)
             # 关键：在锁内赋值，保证对其他线程可见
             _redis_client = tmp
     logger.debug("init redis client %s", _redis_client)
-    return _redis_client
\ No newline at end of file
+    return _redis_client
+
+
+_redis_ckpt_client: Optional[redis.Redis] = None
+_ckpt_client_lock = threading.Lock()
+
+
+def get_redis_checkpoint_client() -> redis.Redis:
+    """
+    checkpoint缓存专用客户端：二进制读写（不解码），独立连接池。
+
+    REDIS_CLIENT_CACHE_SIZE>0 时使用RESP3客户端缓存（需要Redis 6+），
+    热点会话的读取直接命中本地，key被修改时由服务端推送失效。
+    """
+    global _redis_ckpt_client
+
+    redis_url = _check_mode()
+    if _redis_ckpt_client is not None:
+        return _redis_ckpt_client
+
+    with _ckpt_client_lock:
+        if _redis_ckpt_client is None:
+            settings = get_settings()
+            kwargs = {}
+            if settings.REDIS_CLIENT_CACHE_SIZE > 0:
+                kwargs = {"protocol": 3, "cache_config": CacheConfig(max_size=settings.REDIS_CLIENT_CACHE_SIZE)}
+            pool = MeteredConnectionPool.from_url(
+                redis_url,
+                max_connections=settings.REDIS_MAX_CONNECTIONS,
+                timeout=settings.REDIS_POOL_TIMEOUT_S,
+                **kwargs,
+            )
+            _redis_ckpt_client = redis.Redis(connection_pool=pool)
+            logger.debug("init redis checkpoint client %s", _redis_ckpt_client)
+    return _redis_ckpt_client
@@ -0,0 +1,263 @@
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence, Tuple
+
+import redis
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata, \
+    CheckpointTuple, WRITES_IDX_MAP, get_checkpoint_id, get_checkpoint_metadata
+
+from app.infra.redis import MeteredConnectionPool
+
+_KEY_PREFIX = "jpai:ckpt:"
+_NS_SET_PREFIX = "jpai:ckpt_ns:"
+# hash字段：id=checkpoint_id，m=checkpoint(不含通道值)/metadata/parent，c:<channel>=通道值，w:<checkpoint_id>:...=pending write
+_F_ID = b"id"
+_F_META = b"m"
+_F_CHANNEL = b"c:"
+_F_WRITE = b"w:"
+
+
+class RedisCheckpointCache(BaseCheckpointSaver):
+    """
+    Redis checkpoint缓存，每个(thread_id, checkpoint_ns)一个hash，只保存最新的checkpoint
+
+    - 读：一次HGETALL；开启RESP3客户端缓存时热点会话直接命中本地，不走网络
+    - 写：DEL+HSET+EXPIRE在一个pipeline（MULTI）中一次往返完成
+    - 只使用hash/set基础命令，不依赖RedisJSON/RediSearch模块
+    - 过期时间在写入时刷新；读不刷新，避免破坏客户端缓存
+    """
+
+    def __init__(self, client: redis.Redis, ttl_s: int) -> None:
+        super().__init__()
+        self._client = client
+        self._ttl = ttl_s
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(thread_id: str, checkpoint_ns: str) -> str:
+        return f"{_KEY_PREFIX}{thread_id}:{checkpoint_ns}"
+
+    @staticmethod
+    def _ns_key(thread_id: str) -> str:
+        return f"{_NS_SET_PREFIX}{thread_id}"
+
+    def _pack(self, obj: Any) -> bytes:
+        type_, data = self.serde.dumps_typed(obj)
+        return type_.encode() + b"\0" + (data or b"")
+
+    def _unpack(self, raw: bytes) -> Any:
+        type_, _, data = raw.partition(b"\0")
+        return self.serde.loads_typed((type_.decode(), data))
+
+    # ---------------- 读 ----------------
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        fields = self._client.hgetall(self._key(thread_id, checkpoint_ns))
+        tup = self._to_tuple(thread_id, checkpoint_ns, fields)
+        if tup is not None and (checkpoint_id := get_checkpoint_id(config)) \
+                and tup.config["configurable"]["checkpoint_id"] != checkpoint_id:
+            tup = None
+        with self._stats_lock:
+            if tup is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return tup
+
+    def list(
+            self,
+            config: RunnableConfig | None,
+            *,
+            filter: dict[str, Any] | None = None,
+            before: RunnableConfig | None = None,
+            limit: int | None = None,
+    ) -> Iterator[CheckpointTuple]:
+        """只能按thread_id列出各namespace最新的checkpoint"""
+        if not config:
+            return
+        thread_id = config["configurable"]["thread_id"]
+        config_ns = config["configurable"].get("checkpoint_ns")
+        config_id = get_checkpoint_id(config)
+        before_id = get_checkpoint_id(before) if before else None
+        namespaces = [config_ns] if config_ns is not None else \
+            [ns.decode() for ns in self._client.smembers(self._ns_key(thread_id))]
+        pipe = self._client.pipeline(transaction=False)
+        for ns in namespaces:
+            pipe.hgetall(self._key(thread_id, ns))
+        for ns, fields in zip(namespaces, pipe.execute()):
+            if limit is not None and limit <= 0:
+                break
+            tup = self._to_tuple(thread_id, ns, fields)
+            if tup is None:
+                continue
+            checkpoint_id = tup.config["configurable"]["checkpoint_id"]
+            if (config_id and checkpoint_id != config_id) or (before_id and checkpoint_id >= before_id):
+                continue
+            if filter and not all(tup.metadata.get(k) == v for k, v in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield tup
+
+    def _to_tuple(self, thread_id: str, checkpoint_ns: str, fields: Dict[bytes, bytes]) -> CheckpointTuple | None:
+        if not fields or _F_META not in fields:
+            return None
+        checkpoint_id = fields[_F_ID].decode()
+        checkpoint, metadata, parent_id = self._unpack(fields[_F_META])
+        channel_values = {}
+        writes = []
+        write_prefix = _F_WRITE + fields[_F_ID] + b":"
+        for name, raw in fields.items():
+            if name.startswith(_F_CHANNEL):
+                channel_values[name[len(_F_CHANNEL):].decode()] = self._unpack(raw)
+            elif name.startswith(write_prefix):
+                # 字段名 w:<checkpoint_id>:<task_id>:<idx>，旧checkpoint的write在下一次put时随DEL清掉
+                task_id, _, idx = name[len(write_prefix):].decode().rpartition(":")
+                writes.append(((task_id, int(idx)), raw))
+        writes.sort(key=lambda w: w[0])
+        pending_writes = []
+        for (task_id, _), raw in writes:
+            channel, value = self._unpack(raw)
+            pending_writes.append((task_id, channel, value))
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": checkpoint_id}},
+            checkpoint={**checkpoint, "channel_values": channel_values},
+            metadata=metadata,
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                  "checkpoint_id": parent_id}}
+                if parent_id else None
+            ),
+            pending_writes=pending_writes,
+        )
+
+    # ---------------- 写 ----------------
+    def _mapping(self, checkpoint: Checkpoint, metadata: CheckpointMetadata, parent_id: Optional[str]) -> dict:
+        c = checkpoint.copy()
+        values: dict[str, Any] = c.pop("channel_values")
+        mapping = {_F_ID: checkpoint["id"].encode(), _F_META: self._pack([c, metadata, parent_id])}
+        for channel, value in values.items():
+            mapping[_F_CHANNEL + channel.encode()] = self._pack(value)
+        return mapping
+
+    def _write_pipeline(self, pipe, thread_id: str, checkpoint_ns: str, mapping: dict) -> None:
+        key, ns_key = self._key(thread_id, checkpoint_ns), self._ns_key(thread_id)
+        pipe.delete(key)
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, self._ttl)
+        pipe.sadd(ns_key, checkpoint_ns)
+        pipe.expire(ns_key, self._ttl)
+
+    def put(
+            self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        mapping = self._mapping(checkpoint, get_checkpoint_metadata(config, metadata),
+                                config["configurable"].get("checkpoint_id"))
+        pipe = self._client.pipeline(transaction=True)
+        self._write_pipeline(pipe, thread_id, checkpoint_ns, mapping)
+        pipe.execute()
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                 "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(
+            self,
+            config: RunnableConfig,
+            writes: Sequence[tuple[str, Any]],
+            task_id: str,
+            task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        prefix = f"w:{config['configurable']['checkpoint_id']}:{task_id}:".encode()
+        key = self._key(thread_id, checkpoint_ns)
+        pipe = self._client.pipeline(transaction=False)
+        for idx, (channel, value) in enumerate(writes):
+            write_idx = WRITES_IDX_MAP.get(channel, idx)
+            field, raw = prefix + str(write_idx).encode(), self._pack([channel, value])
+            # 与InMemorySaver一致：普通write不覆盖，特殊write（idx<0）覆盖
+            if write_idx >= 0:
+                pipe.hsetnx(key, field, raw)
+            else:
+                pipe.hset(key, field, raw)
+        pipe.expire(key, self._ttl)
+        pipe.execute()
+
+    def fill(self, tup: CheckpointTuple) -> bool:
+        """回源读到的checkpoint写入缓存；缓存中已有同一个或更新的checkpoint时不覆盖"""
+        configurable = tup.config["configurable"]
+        thread_id, checkpoint_ns = configurable["thread_id"], configurable.get("checkpoint_ns", "")
+        checkpoint_id = configurable["checkpoint_id"]
+        parent_id = tup.parent_config["configurable"]["checkpoint_id"] if tup.parent_config else None
+        mapping = self._mapping(tup.checkpoint, tup.metadata, parent_id)
+        for idx, (task_id, channel, value) in enumerate(tup.pending_writes or []):
+            field = f"w:{checkpoint_id}:{task_id}:{WRITES_IDX_MAP.get(channel, idx)}".encode()
+            mapping[field] = self._pack([channel, value])
+        key = self._key(thread_id, checkpoint_ns)
+
+        def txn(pipe) -> bool:
+            current = pipe.hget(key, _F_ID)
+            if current is not None and current.decode() >= checkpoint_id:
+                pipe.unwatch()
+                return False
+            pipe.multi()
+            self._write_pipeline(pipe, thread_id, checkpoint_ns, mapping)
+            return True
+
+        return self._client.transaction(txn, key, value_from_callable=True)
+
+    def delete_thread(self, thread_id: str) -> None:
+        ns_key = self._ns_key(thread_id)
+        namespaces = self._client.smembers(ns_key)
+        keys = [self._key(thread_id, ns.decode()) for ns in namespaces]
+        self._client.delete(ns_key, self._key(thread_id, ""), *keys)
+
+    # ---------------- 异步：放到线程池执行，不阻塞事件循环 ----------------
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+            self,
+            config: RunnableConfig | None,
+            *,
+            filter: dict[str, Any] | None = None,
+            before: RunnableConfig | None = None,
+            limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+        pool = self._client.connection_pool
+        if isinstance(pool, MeteredConnectionPool):
+            stats["pool"] = pool.stats()
+        return stats
@@ -15,6 +15,9 @@ class _Settings(BaseSettings):
     LOG_LEVEL: str = "INFO"
     # mysql url
     MYSQL_URL: str
+    # mysql连接池常驻连接数、溢出连接数
+    MYSQL_POOL_SIZE: int = 10
+    MYSQL_MAX_OVERFLOW: int = 20
     # 本地文件存储
     FILE_STORE_PATH: str
     # 三方sdk所需环境变量，通过env设置到环境变量
@@ -22,12 +25,26 @@ class _Settings(BaseSettings):
     DASHSCOPE_API_KEY: str
 
     ##############################################AGENT配置
-    # 上下文汇总token数上限
+    # 上下文汇总token数上限：未合并进滚动摘要的消息超过时，一轮结束后在后台合并
     AGENT_MSG_SUMMARY_MAX_BEFORE: int = 4000
-    # 汇总保留消息数
+    # 未合并进滚动摘要的消息条数上限，超过时一轮结束后在后台合并
+    AGENT_MSG_SUMMARY_TRIGGER: int = 40
+    # 汇总保留消息数：合并后保留的最近消息条数，须明显小于AGENT_MSG_SUMMARY_TRIGGER，否则每轮都会触发合并
     AGENT_MSG_SUMMARY_TO_KEEP:int = 15
-    # 修剪保留消息数
+    # 修剪保留消息数（已不再使用：上下文改为按AGENT_CONTEXT_MAX_TOKENS裁剪，保留该项兼容已有配置）
     AGENT_MSG_TRIM_TO_KEEP:int = 15
+    # 发给模型的上下文token预算（系统提示词+摘要+历史消息），超出时从最早的消息开始丢弃
+    AGENT_CONTEXT_MAX_TOKENS: int = 8000
+    # 单条工具结果的token上限，超出截断
+    AGENT_TOOL_MSG_MAX_TOKENS: int = 2000
+    # 工具专用线程池大小（一轮中的多个工具调用并行执行）
+    AGENT_TOOL_MAX_WORKERS: int = 8
+    # 单次工具调用超时秒数，超时后把超时提示交给模型
+    AGENT_TOOL_TIMEOUT_S: float = 20
+    # 子agent热更新定时检查间隔秒数（多进程部署时同步其他进程的知识库空间变更），<=0只在本进程变更时更新
+    AGENT_RELOAD_INTERVAL_S: float = 60
+    # 启动时并行初始化（路由图、embedding模型、分词器等组件，及各子agent注册）的线程数
+    STARTUP_MAX_WORKERS: int = 4
 
     ############################################## 登录鉴权相关
     JWT_SECRET: str
@@ -38,8 +55,97 @@ class _Settings(BaseSettings):
 
     # agent checkpoint缓存选项
     AGENT_MEM_MODE:str="memory" # memory/redis
+    # memory模式缓存上限（MB）、最多缓存会话数、会话空闲多少秒后淘汰
+    AGENT_MEM_MAX_MB: int = 256
+    AGENT_MEM_MAX_THREADS: int = 5000
+    AGENT_MEM_IDLE_TTL_S: int = 1800
+    # redis模式checkpoint缓存过期时间（秒），写入时刷新
+    AGENT_MEM_REDIS_TTL_S: int = 7200
+    # checkpoint落库方式：sync（同步写MySQL）/write_behind（先写缓存，后台批量落库）
+    AGENT_CKPT_WRITE_MODE: str = "sync"
+    # write_behind队列上限，写满后调用方阻塞等待
+    AGENT_CKPT_QUEUE_MAX: int = 2000
+    # write_behind单个事务最多写入条数
+    AGENT_CKPT_FLUSH_BATCH: int = 200
+    # write_behind攒批等待时间（毫秒）
+    AGENT_CKPT_FLUSH_INTERVAL_MS: int = 50
+    # write_behind本地日志路径，配置后写入先fsync到日志，崩溃重启后重放；不配置则崩溃可能丢失未落库写入
+    AGENT_CKPT_JOURNAL_PATH: Optional[str] = None
+    # write_behind本地日志分段大小（MB），超过后切到新段（文件名为日志路径加.N），旧段的记录全部落库后删除
+    AGENT_CKPT_JOURNAL_SEGMENT_MB: int = 64
+    # write_behind落库遇到非暂时性错误（序列化、超长、约束冲突等）时整批重试次数，之后逐条写入，仍失败的转入死信
+    AGENT_CKPT_FLUSH_MAX_RETRIES: int = 3
+    # 死信文件路径（格式同日志），默认为日志路径加.dead，两者都未配置时只打error日志
+    AGENT_CKPT_DEAD_LETTER_PATH: Optional[str] = None
+    # 库中不存在的会话记住多少秒，期间不再回源查询
+    AGENT_CKPT_MISSING_TTL_S: int = 30
+    # messages等列表通道增量存储，每隔多少个版本存一次全量快照，<=1时每次都存全量
+    AGENT_CKPT_SNAPSHOT_EVERY: int = 20
+    # checkpoint blob的zstd压缩级别，0不压缩
+    AGENT_CKPT_ZSTD_LEVEL: int = 3
+    # checkpoint清理：每个会话保留最近多少个checkpoint，<=0时不启动清理任务
+    AGENT_CKPT_RETENTION_KEEP: int = 20
+    # checkpoint清理间隔（秒）
+    AGENT_CKPT_RETENTION_INTERVAL_S: int = 3600
+    # checkpoint清理每批删除行数、每批之间休眠毫秒数
+    AGENT_CKPT_RETENTION_BATCH: int = 500
+    AGENT_CKPT_RETENTION_SLEEP_MS: int = 200
+    # DashScope OpenAI兼容接口地址
+    DASHSCOPE_COMPATIBLE_BASE_URL: str = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+    # 系统提示词显式前缀缓存（cache_control），不开启时依赖DashScope隐式缓存；显式缓存创建时有额外费用
+    LLM_PROMPT_CACHE_EXPLICIT: bool = False
+    # 各用途使用的模型：路由、子agent主模型、轻量模型（标题生成、历史摘要）
+    LLM_ROUTER_MODEL: str = "qwen1.5-32b-chat"
+    LLM_MAIN_MODEL: str = "qwen-max"
+    LLM_SMALL_MODEL: str = "qwen2.5-3b-instruct"
+    # 主模型、轻量模型的调用协议：openai（OpenAI兼容接口，复用httpx连接池）、native（dashscope sdk，每次请求新建连接）
+    LLM_DASHSCOPE_PROTOCOL: str = "openai"
+    # 各用途的并发调用上限（每个进程，同步和异步调用合计）；流式调用在整个生成期间占用名额，
+    # 主模型的上限即每个进程能同时进行的回答数，按此设置，请求速率另由LLM_*_RPS限制
+    LLM_ROUTER_CONCURRENCY: int = 32
+    LLM_MAIN_CONCURRENCY: int = 64
+    LLM_SMALL_CONCURRENCY: int = 16
+    # 等待并发名额的最长秒数，超过直接失败
+    LLM_QUEUE_TIMEOUT_S: float = 30
+    # 单次调用超时秒数（流式调用为首个chunk的超时）
+    LLM_TIMEOUT_S: float = 60
+    # 限流、服务端错误、超时、连接错误的最大重试次数（带抖动的指数退避）
+    LLM_MAX_RETRIES: int = 3
+    # OpenAI兼容接口的httpx连接池大小（所有用途共用）
+    LLM_HTTP_MAX_CONNECTIONS: int = 128
+    # 各模型每秒请求数上限（令牌桶），<=0不限速
+    LLM_ROUTER_RPS: float = 20
+    LLM_MAIN_RPS: float = 10
+    LLM_SMALL_RPS: float = 10
+    # 访客聊天、后台任务（标题生成等）整体的每秒请求数上限，所有模型共用，<=0不限速
+    LLM_GUEST_RPS: float = 2
+    LLM_BACKGROUND_RPS: float = 1
+    # 令牌桶容量（可突发的秒数）：容量 = 每秒请求数 * 该值
+    LLM_RATE_BURST_S: float = 1
+    # 各优先级排队等待速率令牌的最长秒数，超过则失败；请求入口预计排队时间超过时直接拒绝
+    LLM_CHAT_MAX_WAIT_S: float = 30
+    LLM_GUEST_MAX_WAIT_S: float = 10
+    LLM_BACKGROUND_MAX_WAIT_S: float = 60
+    # 路由快速通道：单子agent、embedding高置信度、会话粘滞时不调用路由大模型
+    ROUTER_FAST_PATH: bool = True
+    # embedding路由：最高相似度阈值、与次高相似度的最小差值，不满足时走路由大模型
+    ROUTER_EMBED_THRESHOLD: float = 0.75
+    ROUTER_EMBED_MARGIN: float = 0.05
+    # 路由大模型使用json_object约束输出（需要模型支持response_format）
+    ROUTER_LLM_JSON_MODE: bool = False
+    # 路由缓存条数上限（会话级、问题级各自），<=0不启用
+    ROUTER_CACHE_MAX_SIZE: int = 10000
+    # 会话级路由缓存秒数：期间embedding分类不明确时同一会话沿用上次的子agent，不调用路由大模型
+    ROUTER_CACHE_THREAD_TTL_S: int = 600
+    # 问题级路由缓存秒数：归一化后相同的问题复用路由结果
+    ROUTER_CACHE_QUESTION_TTL_S: int = 3600
     # Redis URL，在轻量模式下可选
     REDIS_URL: Optional[str] = None
+    # Redis连接池上限、连接池用尽时最多等待秒数
+    REDIS_MAX_CONNECTIONS: int = 20
+    REDIS_POOL_TIMEOUT_S: int = 5
+    # checkpoint缓存RESP3客户端缓存条数（需要Redis 6+），0关闭
+    REDIS_CLIENT_CACHE_SIZE: int = 10000
     # 向量数据库选项
     VECTOR_STORE_MODE:str="faiss" # faiss/chroma
     FAISS_STORE_PATH: str
@@ -50,9 +156,39 @@ class _Settings(BaseSettings):
     chroma_http_max_keepalive_connections: int = 5
     # ocr选项
     OCR_MODE:str="buyan" # buyan/easyocr
+    # 远程ocr并发请求数（同时也是http连接池大小）
+    OCR_REMOTE_CONCURRENCY: int = 4
+    # 远程ocr单次请求超时（秒）
+    OCR_REMOTE_TIMEOUT: int = 30
+    # 本地ocr识别语言，逗号分隔
+    OCR_EASYOCR_LANGS: str = "ch_sim,en"
+    # 本地ocr模型目录，配置后不联网下载模型
+    OCR_EASYOCR_MODEL_PATH: Optional[str] = None
+    # 本地ocr每个子进程任务的图片数，同时作为识别模型的batch_size
+    OCR_BATCH_SIZE: int = 8
+    # ocr结果磁盘缓存上限（MB），<=0不启用
+    OCR_CACHE_MAX_MB: int = 256
+    # ocr缓存文件路径，默认FILE_STORE_PATH/ocr_cache.db
+    OCR_CACHE_PATH: Optional[str] = None
     # embedding选项
     MODEL_BGE_SMALL_EN_V15_STORE_PATH: str
 
+    ############################################## RAG流水线配置
+    # 分块大小（token数，按embedding模型tokenizer计，需小于模型max_length）
+    RAG_CHUNK_SIZE: int = 450
+    # 分块重叠（token数）
+    RAG_CHUNK_OVERLAP: int = 50
+    # 文档解析进程池大小（excel按sheet、docx按文件并行）
+    RAG_PARSE_WORKERS: int = 2
+    # excel每个文档合并的行数
+    RAG_EXCEL_ROWS_PER_DOC: int = 20
+    # pdf页文字数低于该值且含图片时视为扫描页，走OCR
+    RAG_PDF_MIN_PAGE_CHARS: int = 20
+    # pdf扫描页栅格化dpi
+    RAG_PDF_OCR_DPI: int = 200
+    # faiss索引内存缓存数（按知识库空间），索引文件更新后自动重新加载，<=0每次查询都从磁盘加载
+    RAG_FAISS_CACHE_SIZE: int = 8
+
     ############################################## std模式组件及配置
     # （向量存储）chromadb/milvus，TODO
     # （embedding）BGE-M3配置，TODO
@@ -76,3 +212,6 @@ def init_settings():
     # 配置验证：轻量模式下不允许使用 Redis 模式
     if settings.MODE == "lite" and settings.AGENT_MEM_MODE == "redis":
         raise ValueError("轻量模式（MODE=lite）下不允许使用 Redis 记忆模式（AGENT_MEM_MODE=redis）")
+    # 配置验证：滚动摘要合并后保留的消息数必须小于触发合并的条数
+    if settings.AGENT_MSG_SUMMARY_TO_KEEP >= settings.AGENT_MSG_SUMMARY_TRIGGER:
+        raise ValueError("AGENT_MSG_SUMMARY_TO_KEEP必须小于AGENT_MSG_SUMMARY_TRIGGER")
@@ -0,0 +1,132 @@
+"""
+启动过程：分步计时、并行初始化、就绪状态
+
+- 每个初始化步骤用step计时，启动结束后log_report按耗时从高到低输出，方便找出拖慢冷启动的组件
+- 互不依赖的组件（路由图、embedding模型、分词器、模型客户端等）用parallel放到线程池同时初始化
+- 较重的初始化放在后台线程里做，服务先开始监听：就绪前/health/ready返回503，负载均衡先不转发流量；
+  就绪前已经到达的请求会等待对应组件初始化完（或自己触发延迟初始化），不会出错
+- 必需步骤失败时标记启动失败，/health/live也返回503，由编排系统重启（和原来启动时报错退出的效果一样）
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.infra.log import logger
+
+
+@dataclass
+class _Step:
+    name: str
+    # 相对计时起点的开始时间、耗时（秒）
+    start_s: float
+    cost_s: float
+    ok: bool
+    thread: str
+
+
+class StartupProfile:
+
+    def __init__(self):
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._steps: List[_Step] = []
+        self._ready = threading.Event()
+        self._ready_s: Optional[float] = None
+        self._error: Optional[str] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @contextmanager
+    def step(self, name: str, required: bool = True) -> Iterator[None]:
+        """记录一个步骤的耗时；非必需步骤失败时只打warning，不影响启动"""
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        except Exception as e:
+            if required:
+                raise
+            logger.warning("启动步骤%s失败，跳过（首次使用时再初始化）: %s", name, e)
+        finally:
+            with self._lock:
+                self._steps.append(_Step(name, start - self._t0, time.perf_counter() - start, ok,
+                                         threading.current_thread().name))
+
+    def run(self, name: str, fn: Callable[[], Any], required: bool = True) -> Any:
+        with self.step(name, required):
+            return fn()
+
+    def parallel(self, steps: Dict[str, Callable[[], Any]], max_workers: int,
+                 optional: tuple = ()) -> None:
+        """
+        在线程池中同时执行互不依赖的步骤，全部结束后返回
+
+        :param optional: 非必需步骤的名称
+        :raise 必需步骤中第一个失败的异常
+        """
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(steps))),
+                                thread_name_prefix="startup") as pool:
+            futures = {name: pool.submit(self.run, name, fn, name not in optional) for name, fn in steps.items()}
+        for future in futures.values():
+            if future.exception() is not None:
+                raise future.exception()
+
+    def start_background(self, fn: Callable[[], None]) -> None:
+        """在后台线程执行启动流程，成功后标记就绪，失败时标记启动失败"""
+
+        def target():
+            try:
+                fn()
+                self.mark_ready()
+            except Exception as e:
+                self.mark_failed(e)
+            finally:
+                self.log_report()
+
+        self._thread = threading.Thread(target=target, name="startup", daemon=True)
+        self._thread.start()
+
+    def mark_ready(self) -> None:
+        self._ready_s = time.perf_counter() - self._t0
+        self._ready.set()
+
+    def mark_failed(self, e: BaseException) -> None:
+        self._error = f"{type(e).__name__}: {e}"
+        logger.exception("启动失败: %s", e)
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    @property
+    def error(self) -> Optional[str]:
+        return self._error
+
+    def report(self) -> dict:
+        with self._lock:
+            steps = sorted(self._steps, key=lambda s: s.start_s)
+        return {
+            "ready": self.is_ready,
+            "ready_s": round(self._ready_s, 3) if self._ready_s is not None else None,
+            "error": self._error,
+            "steps": [{"name": s.name, "start_s": round(s.start_s, 3), "cost_s": round(s.cost_s, 3), "ok": s.ok,
+                       "thread": s.thread} for s in steps],
+        }
+
+    def log_report(self) -> None:
+        report = self.report()
+        lines = [f"{s['name']:<24}{s['cost_s']:>8.3f}s  开始于{s['start_s']:.3f}s  {s['thread']}"
+                 f"{'' if s['ok'] else '  失败'}"
+                 for s in sorted(report["steps"], key=lambda s: s["cost_s"], reverse=True)]
+        status = f"{report['ready_s']}秒后就绪" if report["ready"] else f"启动失败（{report['error']}）"
+        logger.info("启动耗时（%s，按耗时排序）：\n%s", status, "\n".join(lines))
+
+
+# 进程级单例，导入时开始计时
+startup_profile = StartupProfile()
@@ -0,0 +1,60 @@
+"""
+本地token计数：dashscope sdk自带的通义千问分词器（词表随sdk发布，离线可用），进程内只加载一次
+
+- count_tokens、truncate_tokens按文本缓存结果，历史消息每轮都会重复计数，命中缓存后不再分词
+- 分词器加载失败时按字符数估算（中文约1字1token，英文约4字符1token）
+"""
+import threading
+from functools import lru_cache
+from typing import Any, Optional
+
+from app.infra.log import logger
+
+_tokenizer: Any = None
+_tokenizer_failed = False
+_tokenizer_lock = threading.Lock()
+
+
+def _get_tokenizer() -> Optional[Any]:
+    global _tokenizer, _tokenizer_failed
+    if _tokenizer is None and not _tokenizer_failed:
+        with _tokenizer_lock:
+            if _tokenizer is None and not _tokenizer_failed:
+                try:
+                    from dashscope import get_tokenizer
+                    _tokenizer = get_tokenizer("qwen-max")
+                except Exception as e:
+                    _tokenizer_failed = True
+                    logger.warning("通义千问分词器加载失败，按字符数估算token: %s", e)
+    return _tokenizer
+
+
+def warm_up() -> bool:
+    """启动时预加载分词器，返回是否可用（不可用时按字符数估算）"""
+    return _get_tokenizer() is not None
+
+
+def _estimate(text: str) -> int:
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    tokenizer = _get_tokenizer()
+    if tokenizer is None:
+        return _estimate(text)
+    return len(tokenizer.encode(text))
+
+
+@lru_cache(maxsize=1024)
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """保留前max_tokens个token；同一条工具结果每轮都会被截断，结果同样缓存"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    tokenizer = _get_tokenizer()
+    if tokenizer is None:
+        return text[:max_tokens]
+    return tokenizer.decode(tokenizer.encode(text)[:max_tokens])
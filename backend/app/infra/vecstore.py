@@ -1,8 +1,7 @@
 import uuid
-from typing import Any, Iterable, List, Optional, Callable, Dict, Union
+from typing import TYPE_CHECKING, Any, Iterable, List, Optional, Callable, Dict, Union
 
 import numpy as np
-from langchain_chroma import Chroma
 from langchain_community.docstore import InMemoryDocstore
 from langchain_community.docstore.base import AddableMixin, Docstore
 from langchain_community.vectorstores import FAISS
@@ -12,6 +11,9 @@ from langchain_core.embeddings import Embeddings
 
 from app.infra.settings import get_settings
 
+if TYPE_CHECKING:
+    from langchain_chroma import Chroma
+
 
 class _CUSTOM_FAISS(FAISS):
     """自己写FAISS类，继承社区版类，支持saveDocs"""
@@ -106,9 +108,10 @@ def get_faiss(embedding_function: Embeddings, collection_name: str) -> FAISS:
     raise ValueError(f"非法的VECTOR_STORE_MODE={settings.VECTOR_STORE_MODE}")
 
 
-def get_chroma(embedding_function: Embeddings, collection_name: str) -> Chroma:
+def get_chroma(embedding_function: Embeddings, collection_name: str) -> "Chroma":
     settings = get_settings()
     if settings.VECTOR_STORE_MODE == "chroma":
+        from langchain_chroma import Chroma  # 此处import 防止faiss模式启动时还要加载chromadb（约0.8秒）
         return Chroma(collection_name=collection_name, embedding_function=embedding_function, host=settings.CHROMA_HOST,
                       port=settings.CHROMA_PORT)
     raise ValueError(f"非法的VECTOR_STORE_MODE={settings.VECTOR_STORE_MODE}")
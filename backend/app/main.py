@@ -1,34 +1,70 @@
+"""显式控制所有初始化顺序；较重的组件在后台并行初始化，完成前/health/ready返回503"""
 
-"""显式控制所有初始化顺序"""
+# 0.启动计时，各步骤耗时在启动结束后输出到日志，也可通过/health/ready查看
+from app.infra.startup import startup_profile
 
 # 1.初始化所有配置和环境变量
-from app.infra import init_settings
-init_settings()
+with startup_profile.step("settings"):
+    from app.infra import init_settings
+    init_settings()
 
 # 2.初始化日志
-from app.infra import init_logger
-init_logger()
+with startup_profile.step("logger"):
+    from app.infra import init_logger
+    init_logger()
 
-# 3.基础组件
-from app.infra import mysql_manager
-mysql_manager.initialize()
+# 3.基础组件（只建连接池，不连库）
+with startup_profile.step("mysql"):
+    from app.infra import mysql_manager
+    mysql_manager.initialize()
 
-# 4.初始化 router_graph（会自动扫描并注册所有 BaseSubAgent 的子类）
-from app.agent.router_agent import router_graph_manager
-router_graph_manager.initialize()  # 这里会自动发现并注册所有子 agent
+# 4.导入业务模块（子agent模块在这里导入，只定义类，不建模型、不编译图）
+with startup_profile.step("import_modules"):
+    from fastapi import FastAPI
+    from app.common.api.health_api import router as health_router
+    from app.user.service import AuthMiddleware
+    from app.user.api import router as user_router
+    from app.conversation.api import router as conversation_router
+    from app.rag.api import router as rag_router
+    from app.agent.router_agent import router_graph_manager
+    from app.agent.checkpoint_retention import start_checkpoint_retention
+    from app.infra import tokenizer
+    from app.infra.embd import embed
+    from app.infra.llm import get_llm, get_llm_registry
+    from app.infra.settings import get_settings
+
+
+def _warm_up():
+    """
+    后台初始化：互不依赖的组件并行
+    - router_graph：自动扫描并注册所有 BaseSubAgent 的子类（各子agent并行：建模型、查询知识库空间、编译图），再编译路由图
+    - llm_clients：各用途的模型客户端
+    - embedding_model：加载embedding模型（快速路由、知识库检索用）
+    - tokenizer：加载上下文token计数用的分词器
+    路由图就绪后计算快速路由的样例向量，再启动checkpoint表的后台清理
+    """
+    startup_profile.parallel({
+        "router_graph": router_graph_manager.initialize,
+        "llm_clients": lambda: [get_llm(name) for name in get_llm_registry().profiles()],
+        "embedding_model": lambda: embed.model,
+        "tokenizer": tokenizer.warm_up,
+    }, max_workers=get_settings().STARTUP_MAX_WORKERS, optional=("embedding_model", "tokenizer"))
+    startup_profile.run("fast_router_index", router_graph_manager.router_service.warm_up, required=False)
+    # checkpoint表后台清理
+    startup_profile.run("checkpoint_retention", start_checkpoint_retention)
+
+
+startup_profile.start_background(_warm_up)
 
-from fastapi import FastAPI
 app = FastAPI()
 
-# 4.基础功能
+# 5.基础功能
+# 健康检查（GET请求在鉴权白名单内）
+app.include_router(health_router)
 # api鉴权
-from app.user.service import AuthMiddleware
 app.add_middleware(AuthMiddleware)
 
-# 5.业务router
-from app.user.api import router as user_router
-from app.conversation.api import router as conversation_router
-from app.rag.api import router as rag_router
+# 6.业务router
 app.include_router(user_router)
 app.include_router(conversation_router)
 app.include_router(rag_router)
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Callable, List, Optional
 from pathlib import Path
 
 from fastapi import UploadFile
@@ -19,9 +19,22 @@ class KnowledgeService:
         self._kb_space_dao = kb_space_dao
         self._kb_file_dao = kb_file_dao
         self._user_dao = user_dao
+        # 空间增删改后的回调（如刷新agent的知识库工具集），回调自己负责不阻塞
+        self._space_listeners: List[Callable[[], None]] = []
+
+    def add_space_listener(self, listener: Callable[[], None]) -> None:
+        self._space_listeners.append(listener)
+
+    def _notify_space_changed(self) -> None:
+        for listener in self._space_listeners:
+            try:
+                listener()
+            except Exception as e:
+                logger.warning("知识库空间变更回调失败: %s", e)
 
     def space_create(self, name:str, desc:str, vector_db_collection:str):
         id = self._kb_space_dao.create(name=name, description=desc, vector_db_collection=vector_db_collection)
+        self._notify_space_changed()
         return id
 
     def space_list_all(self) -> List[KbSpaceOut]:
@@ -60,7 +73,9 @@ class KnowledgeService:
         # 删除空间下所有文件
         self.file_delete_by_space_id(space_id)   
         # 删除空间（DAO层会处理关联文件的级联删除）
-        return self._kb_space_dao.delete(space_id)
+        deleted = self._kb_space_dao.delete(space_id)
+        self._notify_space_changed()
+        return deleted
 
     def space_update(self, id: int, kb_space_in: KbSpaceIn) -> bool:
         """更新知识库空间信息，接受KbSpaceIn对象"""
@@ -70,7 +85,9 @@ class KnowledgeService:
             'description': kb_space_in.desc,
             'vector_db_collection': kb_space_in.collection
         }
-        return self._kb_space_dao.update(id, **update_data)
+        updated = self._kb_space_dao.update(id, **update_data)
+        self._notify_space_changed()
+        return updated
 
     def file_upload(self, space_id: int, file_datas:List[UploadFile], user_id: int, description: str = ""):
         # 验证知识库空间是否存在
@@ -1,6 +1,9 @@
 from __future__ import annotations
 
+import json
 import os
+import tempfile
+import time
 import traceback
 from abc import ABC, abstractmethod
 from concurrent.futures import ThreadPoolExecutor
@@ -9,18 +12,20 @@ from typing import Optional, Final
 
 import langchain_text_splitters
 from langchain_core.documents import Document
-from langchain_excel_loader import StructuredExcelLoader
 
 from app.rag.dao.rag_pipeline_record import rag_pipeline_record_dao, RagPipelineRecordDAO
 from app.infra import embd
 from app.infra import logger
-from app.infra.ocr import ocr_parse
+from app.infra.ocr import ocr_parse_batch
+from app.infra.office import excel_sheet_names, parse_excel_sheet, parse_docx
+from app.infra.pdf import pdf_image_pages, rasterize_pdf_page
+from app.infra.proc_pool import get_process_pool
 from app.infra.vecstore import get_faiss, get_chroma
 from app.infra.settings import get_settings
 from pathlib import Path
 from typing import List
 
-from langchain_community.document_loaders import ( Docx2txtLoader, TextLoader, PyPDFLoader)
+from langchain_community.document_loaders import (TextLoader, PyPDFLoader)
 
 
 # 上下文对象（在整个链里传递）
@@ -36,6 +41,7 @@ class Context:
     chunks: List[Document] = None # 分块产物 #todo用完销毁，节省内存
     success: bool = True
     message: str = None
+    report: dict = None # 各环节统计信息，成功时写入流水线记录msg
 
 # 抽象处理者
 class Handler(ABC):
@@ -65,6 +71,8 @@ class Handler(ABC):
         else:
             # 更新状态记录
             status = 2 if ctx.success else 3
+            if ctx.success and ctx.report:
+                ctx.message = json.dumps(ctx.report, ensure_ascii=False)
             self._rag_pipeline_record_dao.update(record_id=ctx.record_id, status=status, msg=ctx.message)
 
     @abstractmethod
@@ -95,31 +103,128 @@ class FileParseHandler(Handler):
         if ctx.ext in self._support_exts["text"]["exts"]:
             ctx.pages = TextLoader(ctx.file_url).load()
         elif ctx.ext in self._support_exts["excel"]["exts"]:
-            ctx.pages = StructuredExcelLoader(ctx.file_url).load()
+            ctx.pages = self._parse_excel(ctx)
         elif ctx.ext in self._support_exts["word"]["exts"]:
             # ctx.docs = UnstructuredWordDocumentLoader(ctx.file_url).load()
-            ctx.pages = Docx2txtLoader(ctx.file_url).load()
+            ctx.pages = self._parse_word(ctx)
         elif ctx.ext in self._support_exts["pdf"]["exts"]:
-            # 文字部分
-            ctx.pages = PyPDFLoader(ctx.file_url).load()
+            ctx.pages = self._parse_pdf(ctx)
         # 3. 纯图片格式
         elif ctx.ext in self._support_exts["img"]["exts"]:
-            texts = ocr_parse(ctx.file_url)
+            ocr_stats = {}
+            texts = ocr_parse_batch([ctx.file_url], stats=ocr_stats)[0]
             ctx.pages = [Document(page_content=text) for text in texts]
+            ctx.report = ctx.report or {}
+            ctx.report["ocr"] = ocr_stats
         # 4. 其他 → 抛异常 or 按需扩展
         else:
             raise ValueError(f"unsupported ext: {ctx.ext}")
 
+    def _parse_excel(self, ctx: Context) -> List[Document]:
+        """按sheet提交到进程池并行解析，按sheet原顺序合并结果"""
+        pool = get_process_pool()
+        rows_per_doc = get_settings().RAG_EXCEL_ROWS_PER_DOC
+        futures = [pool.submit(parse_excel_sheet, ctx.file_url, sheet_name, rows_per_doc)
+                   for sheet_name in excel_sheet_names(ctx.file_url)]
+        pages, metrics = [], []
+        for future in futures:
+            docs, metric = future.result()
+            pages.extend(docs)
+            metrics.append(metric)
+            logger.info("[%s] %s sheet=%s rows=%d docs=%d 耗时%.2fms", self.__class__.__name__,
+                        ctx.file_name, metric["sheet"], metric["rows"], metric["docs"], metric["ms"])
+        ctx.report = ctx.report or {}
+        ctx.report["parse"] = {"sheets": metrics}
+        return pages
+
+    def _parse_pdf(self, ctx: Context) -> List[Document]:
+        """文字页直接提取；文字过少且含图片的扫描页才栅格化后OCR"""
+        start = time.perf_counter_ns()
+        settings = get_settings()
+        # 文字部分
+        pages = PyPDFLoader(ctx.file_url).load()
+        sparse = [i for i, page in enumerate(pages)
+                  if len(page.page_content.strip()) < settings.RAG_PDF_MIN_PAGE_CHARS]
+        scanned = pdf_image_pages(ctx.file_url, sparse) if sparse else []
+        ocr_stats = {}
+        if scanned:
+            pool = get_process_pool()
+            with tempfile.TemporaryDirectory(prefix="rag_pdf_") as out_dir:
+                futures = [pool.submit(rasterize_pdf_page, ctx.file_url, i, settings.RAG_PDF_OCR_DPI, out_dir)
+                           for i in scanned]
+                image_paths = [future.result() for future in futures]
+                results = ocr_parse_batch(image_paths, stats=ocr_stats)
+            for i, texts in zip(scanned, results):
+                pages[i].page_content = "\n".join(texts)
+                pages[i].metadata["ocr"] = True
+        elapsed_ms = (time.perf_counter_ns() - start) / 1e6
+        logger.info("[%s] %s pages=%d ocr_pages=%d 耗时%.2fms", self.__class__.__name__,
+                    ctx.file_name, len(pages), len(scanned), elapsed_ms)
+        ctx.report = ctx.report or {}
+        ctx.report["parse"] = {"pages": len(pages), "ocr_pages": len(scanned), "ms": round(elapsed_ms, 2)}
+        if scanned:
+            ctx.report["ocr"] = ocr_stats
+        return pages
+
+    def _parse_word(self, ctx: Context) -> List[Document]:
+        """docx在进程池中解析，不占用流水线线程的GIL"""
+        pages, metric = get_process_pool().submit(parse_docx, ctx.file_url).result()
+        logger.info("[%s] %s sections=%d 耗时%.2fms", self.__class__.__name__,
+                    ctx.file_name, metric["sections"], metric["ms"])
+        ctx.report = ctx.report or {}
+        ctx.report["parse"] = metric
+        return pages
+
 class ChunkHandler(Handler):
-    """ todo 语意分块 """
-    _text_splitter = langchain_text_splitters.RecursiveCharacterTextSplitter(
-        separators=["\n\n", "\n", ".", " ", ""],
-        chunk_size=800,
-        chunk_overlap=100,
-        length_function=len
-    )
+    """ todo 语意分块
+        按embedding模型的tokenizer计长，避免中文按字符计长时分块超出模型max_length被静默截断
+    """
+    _separators = ["\n\n", "\n", ".", " ", ""]
+
+    def __init__(self):
+        super().__init__()
+        settings = get_settings()
+        self._text_splitter = langchain_text_splitters.RecursiveCharacterTextSplitter(
+            separators=self._separators,
+            chunk_size=settings.RAG_CHUNK_SIZE,
+            chunk_overlap=settings.RAG_CHUNK_OVERLAP,
+            length_function=embd.token_counter.count,
+        )
+
     def process(self, ctx: Context) -> None:
-        ctx.chunks = ChunkHandler._text_splitter.split_documents(ctx.pages)
+        self._warm_token_cache(ctx.pages)
+        ctx.chunks = self._text_splitter.split_documents(ctx.pages)
+        self._report_truncation(ctx)
+
+    def _warm_token_cache(self, pages: List[Document]) -> None:
+        """按分块器的第一级分隔符切片（与分块器一致，分隔符留在后一片的开头），批量编码预热token计数缓存"""
+        pieces = []
+        for page in pages:
+            text = page.page_content
+            for sep in self._separators[:-1]:
+                if sep in text:
+                    first, *rest = text.split(sep)
+                    pieces.extend(p for p in (first, *(sep + r for r in rest)) if p)
+                    break
+            else:
+                pieces.append(text)
+        embd.token_counter.count_batch(pieces)
+
+    def _report_truncation(self, ctx: Context) -> None:
+        """统计超出模型容量（会被embedding截断）的分块数"""
+        counts = embd.token_counter.count_batch([chunk.page_content for chunk in ctx.chunks])
+        capacity = embd.token_counter.capacity
+        truncated = sum(1 for n in counts if n > capacity)
+        if truncated:
+            logger.warning("[%s] %s 有%d/%d个分块超出模型容量%d token，将被截断",
+                           self.__class__.__name__, ctx.file_name, truncated, len(counts), capacity)
+        ctx.report = ctx.report or {}
+        ctx.report["chunk"] = {
+            "chunks": len(counts),
+            "max_tokens": max(counts, default=0),
+            "capacity": capacity,
+            "truncated": truncated,
+        }
 
 
 class EmbedAStoreHandler(Handler):
@@ -1,4 +1,9 @@
 
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Tuple
+
 from langchain_community.vectorstores import FAISS
 
 from app.infra import embd
@@ -11,17 +16,38 @@ class RagService:
         self._embedding_func = embedding_func or embd.embed
         self._settings = settings or get_settings()
         self._chroma_func = chroma_func or get_chroma
+        # faiss索引缓存：collection_name -> (索引文件修改时间, 已加载的索引)
+        self._faiss_cache: OrderedDict[str, Tuple[int, FAISS]] = OrderedDict()
+        self._faiss_lock = threading.Lock()
+
+    def _load_faiss(self, collection_name: str) -> FAISS:
+        """按索引文件的修改时间缓存已加载的索引，文件被重新写入后下次查询重新加载"""
+        mtime = (Path(self._settings.FAISS_STORE_PATH) / f"{collection_name}.faiss").stat().st_mtime_ns
+        with self._faiss_lock:
+            cached = self._faiss_cache.get(collection_name)
+            if cached is not None and cached[0] == mtime:
+                self._faiss_cache.move_to_end(collection_name)
+                return cached[1]
+        vector_store = FAISS.load_local(
+            folder_path=self._settings.FAISS_STORE_PATH,
+            embeddings=self._embedding_func,
+            index_name=collection_name, # todo faiss空间中没有文件时会报错
+            allow_dangerous_deserialization=True
+        )
+        cache_size = self._settings.RAG_FAISS_CACHE_SIZE
+        if cache_size > 0:
+            with self._faiss_lock:
+                self._faiss_cache[collection_name] = (mtime, vector_store)
+                self._faiss_cache.move_to_end(collection_name)
+                while len(self._faiss_cache) > cache_size:
+                    self._faiss_cache.popitem(last=False)
+        return vector_store
 
     def query_lite_mode(self, collection_name: str, question, k: int = 15):
-        # 懒加载磁盘，节省内存
+        # 懒加载磁盘，最近用过的索引缓存在内存
         if self._settings.VECTOR_STORE_MODE == "faiss":
             try:
-                vector_store = FAISS.load_local(
-                    folder_path=self._settings.FAISS_STORE_PATH,
-                    embeddings=self._embedding_func,
-                    index_name=collection_name, # todo faiss空间中没有文件时会报错
-                    allow_dangerous_deserialization=True
-                )
+                vector_store = self._load_faiss(collection_name)
             except Exception as e:
                 logger.warning(e)
                 raise Exception(f"加载知识库空间[{collection_name}]报错")
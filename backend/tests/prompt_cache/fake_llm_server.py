@@ -0,0 +1,112 @@
+"""
+本地假LLM服务（OpenAI兼容 /v1/chat/completions），模拟DashScope隐式前缀缓存
+
+- 1个字符算1个token
+- 记住最近的请求前缀，新请求与历史请求的最长公共前缀 >= MIN_CACHE_TOKENS 时算命中，
+  命中数放在 usage.prompt_tokens_details.cached_tokens
+- 带cache_control标记的内容块（显式缓存）按同样规则计算
+- 回复内容固定为一条路由json，支持stream（stream_options.include_usage时最后一块带usage）
+- 收到的请求体按顺序记录在received中，测试用来比较实际发出的前缀
+
+单独启动：python fake_llm_server.py [port]
+"""
+import json
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MIN_CACHE_TOKENS = 256
+REPLY = json.dumps({"route_agent_id": "daily_assistant", "reason_and_mode": "这是日常问题，我将转发给日常管家......"},
+                   ensure_ascii=False)
+
+app = FastAPI()
+_seen: deque = deque(maxlen=64)
+_lock = threading.Lock()
+# 收到的请求体（按到达顺序）
+received: list[dict] = []
+
+
+def _render(body: dict) -> str:
+    """把工具定义和消息拼成一段文本，作为前缀比较的对象"""
+    parts = [json.dumps(body.get("tools") or [], ensure_ascii=False, sort_keys=True)]
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            content = "".join(block.get("text", "") for block in content if isinstance(block, dict))
+        parts.append(f"<{message.get('role')}>{content or ''}")
+    return "\n".join(parts)
+
+
+def _cached_tokens(prompt: str) -> int:
+    best = 0
+    with _lock:
+        for previous in _seen:
+            n = 0
+            for a, b in zip(previous, prompt):
+                if a != b:
+                    break
+                n += 1
+            best = max(best, n)
+        _seen.append(prompt)
+    return best if best >= MIN_CACHE_TOKENS else 0
+
+
+def _usage(prompt: str, cached: int) -> dict:
+    return {
+        "prompt_tokens": len(prompt),
+        "completion_tokens": len(REPLY),
+        "total_tokens": len(prompt) + len(REPLY),
+        "prompt_tokens_details": {"cached_tokens": cached},
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    received.append(body)
+    prompt = _render(body)
+    usage = _usage(prompt, _cached_tokens(prompt))
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    model = body.get("model", "fake")
+
+    if not body.get("stream"):
+        return JSONResponse({
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": REPLY}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+    def events():
+        for i in range(0, len(REPLY), 8):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": REPLY[i:i + 8]}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        last = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        yield f"data: {json.dumps(last)}\n\n"
+        if (body.get("stream_options") or {}).get("include_usage"):
+            tail = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [], "usage": usage}
+            yield f"data: {json.dumps(tail)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def start_in_thread(port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=int(sys.argv[1]) if len(sys.argv) > 1 else 18080)
@@ -0,0 +1,198 @@
+"""
+提示词前缀缓存验证：走真实的路由节点和子agent（create_agent + PromptCacheMiddleware）调用本地假LLM服务，
+检查实际发出的请求中，缓存前缀（工具定义+系统提示词）跨轮次、跨注册顺序字节一致，
+并且请求级的PromptTokenTracker统计到第二次请求命中缓存；隐式缓存和显式缓存（cache_control）各跑一遍
+
+！！！需要灌入主项目环境变量（DASHSCOPE_COMPATIBLE_BASE_URL会被指向假服务）
+执行：python -m tests.prompt_cache.main（在backend目录）
+"""
+import asyncio
+import json
+import os
+
+from langchain_core.tools import tool
+
+FAKE_PORT = 18080
+SYSTEM_PROMPT = "你是一个乐于助人的助手。回答要简洁准确，需要查资料时先调用工具，再根据工具结果作答。" * 4
+
+
+@tool
+def search_weather(city: str) -> str:
+    """查询城市未来三天的天气预报，包括温度、降水概率、风力和空气质量，city为城市中文名"""
+    return f"{city}：晴"
+
+
+@tool
+def search_calendar(date: str) -> str:
+    """查询用户在指定日期的日程安排，包括会议、提醒和待办事项，date格式为YYYY-MM-DD"""
+    return f"{date}：无日程"
+
+
+@tool
+def search_notes(keyword: str) -> str:
+    """在用户的个人笔记中按关键词全文检索，返回最相关的五条笔记标题和摘要"""
+    return f"{keyword}：无笔记"
+
+
+def _explicit(enabled: bool) -> None:
+    from app.infra.settings import get_settings
+
+    # 配置实例进程内缓存，直接修改，对之后的模型调用生效
+    get_settings().LLM_PROMPT_CACHE_EXPLICIT = enabled
+
+
+def _prefix(body: dict) -> str:
+    """请求中的缓存前缀：工具定义+系统消息，按实际发出的字段顺序序列化"""
+    system = [message for message in body["messages"] if message.get("role") == "system"]
+    return json.dumps({"tools": body.get("tools") or [], "system": system}, ensure_ascii=False)
+
+
+def _check_system(body: dict, explicit: bool) -> None:
+    content = body["messages"][0]["content"]
+    assert body["messages"][0]["role"] == "system", "系统提示词必须在最前"
+    if explicit:
+        assert isinstance(content, list) and content[-1].get("cache_control"), "显式缓存时系统消息应带cache_control"
+    else:
+        assert isinstance(content, str), "隐式缓存时系统消息应为纯文本"
+
+
+def _register(order: list[str]) -> None:
+    from app.agent.router_agent import RouterRegistry
+
+    RouterRegistry._routers = {}
+    for agent_id in order:
+        RouterRegistry.register(id=agent_id, name=f"模式{agent_id}", description=f"{agent_id}的描述" * 20,
+                                trigger_conditions=[f"- {agent_id}的条件"],
+                                example=f"用户：'{agent_id}示例', 你：{{'route_agent_id': '{agent_id}'}}",
+                                agent=None)
+
+
+async def _router_turn(question: str) -> dict:
+    """和create_router一样按当前注册信息构建路由提示词、从注册表取路由模型，经路由节点（_route -> _llm_route）路由一次"""
+    from langgraph.constants import END, START
+    from langgraph.graph.state import StateGraph
+
+    from app.agent.prompt_cache import PromptTokenTracker
+    from app.agent.router_agent import RouterRegistry, RouterService, RouterState
+    from app.infra.llm import LLM_ROUTER, get_llm
+
+    service = RouterService()
+    _, conditions, examples = RouterRegistry.list()
+    router_prompt = service.build_routing_prompt(conditions, examples)
+    router_model = get_llm(LLM_ROUTER)
+
+    async def route_node(state: RouterState):
+        decision = await service._route(state, router_model, router_prompt)
+        return {"router_ai_message": decision.to_message(), "route_agent_id": decision.agent_id}
+
+    graph = StateGraph(RouterState)
+    graph.add_node(RouterService.ROUTE_NODE, route_node)
+    graph.add_edge(START, RouterService.ROUTE_NODE)
+    graph.add_edge(RouterService.ROUTE_NODE, END)
+
+    tracker = PromptTokenTracker(question)
+    result = await graph.compile().ainvoke(RouterState(user_question=question, thread_id="prompt-cache"),
+                                           config={"callbacks": [tracker]})
+    # 提前分发时理由在后台接收，流读完后才有token用量（同aexec）
+    await service._pending_reason(result["router_ai_message"])
+    assert result["route_agent_id"] == "daily_assistant"
+    return tracker.summary()["total"]
+
+
+async def check_router(explicit: bool) -> None:
+    """子agent注册顺序不同，路由请求的前缀必须字节一致，第二次请求命中缓存"""
+    from tests.prompt_cache.fake_llm_server import received
+
+    _explicit(explicit)
+    _register(["daily_assistant", "coder"])
+    first = await _router_turn("明天上海天气怎么样？")
+    first_body = received[-1]
+    _register(["coder", "daily_assistant"])
+    second = await _router_turn("帮我写一句生日祝福")
+    second_body = received[-1]
+
+    for body in (first_body, second_body):
+        _check_system(body, explicit)
+    assert _prefix(first_body) == _prefix(second_body), "路由请求的前缀随注册顺序变化"
+    assert first_body["messages"][-1]["content"] != second_body["messages"][-1]["content"]
+    prompt_len = len(_prefix(second_body))
+    assert second["calls"] == 1 and second["cached_tokens"] > 0, "第二次路由请求的静态前缀应命中缓存"
+    assert second["uncached_tokens"] < first["prompt_tokens"]
+    print(f"路由（显式缓存={explicit}）：前缀{prompt_len}字节一致，统计 {first} -> {second}")
+
+
+async def _agent_turn(agent, question: str) -> dict:
+    from langchain_core.messages import HumanMessage
+
+    from app.agent.prompt_cache import PromptTokenTracker
+
+    tracker = PromptTokenTracker(question)
+    await agent.ainvoke({"messages": [HumanMessage(content=question)]}, config={"callbacks": [tracker]})
+    return tracker.summary()["total"]
+
+
+async def check_agent(explicit: bool) -> None:
+    """子agent同一个图多轮调用、工具注册顺序不同重建的图，请求的前缀（排序后的工具+系统提示词）都必须字节一致"""
+    from langchain.agents import create_agent
+
+    from app.agent.middlewares import PromptCacheMiddleware
+    from app.infra.llm import LLM_MAIN, get_llm
+    from tests.prompt_cache.fake_llm_server import received
+
+    def build(tools):
+        return create_agent(model=get_llm(LLM_MAIN), tools=tools, system_prompt=SYSTEM_PROMPT,
+                            middleware=[PromptCacheMiddleware()])
+
+    _explicit(explicit)
+    agent = build([search_weather, search_notes, search_calendar])
+    usages = [await _agent_turn(agent, "明天上海天气怎么样？"), await _agent_turn(agent, "后天呢？")]
+    bodies = received[-2:]
+    rebuilt = build([search_notes, search_calendar, search_weather])
+    usages.append(await _agent_turn(rebuilt, "我周五有什么安排？"))
+    bodies.append(received[-1])
+
+    for body in bodies:
+        _check_system(body, explicit)
+        names = [t["function"]["name"] for t in body["tools"]]
+        assert names == sorted(names), f"工具未按名称排序：{names}"
+    prefixes = {_prefix(body) for body in bodies}
+    assert len(prefixes) == 1, "子agent请求的前缀跨轮次或跨工具注册顺序不一致"
+    for usage in usages[1:]:
+        assert usage["calls"] == 1 and usage["cached_tokens"] >= len(SYSTEM_PROMPT), "后续轮次的静态前缀应命中缓存"
+    print(f"子agent（显式缓存={explicit}）：前缀{len(prefixes.pop())}字节一致，统计 {usages}")
+
+
+async def run() -> None:
+    from app.agent.prompt_cache import prompt_cache_stats
+
+    for explicit in (False, True):
+        await check_router(explicit)
+        await check_agent(explicit)
+    print("进程级统计：", prompt_cache_stats.stats())
+
+
+def main():
+    from tests.prompt_cache.fake_llm_server import start_in_thread
+
+    start_in_thread(FAKE_PORT)
+    asyncio.run(run())
+    print("提示词前缀缓存验证通过")
+
+
+if __name__ == "__main__":
+    # 0.模型请求发到本地假服务（OpenAI兼容协议）
+    os.environ["DASHSCOPE_COMPATIBLE_BASE_URL"] = f"http://127.0.0.1:{FAKE_PORT}/v1"
+    os.environ["LLM_DASHSCOPE_PROTOCOL"] = "openai"
+    os.environ.setdefault("DASHSCOPE_API_KEY", "fake")
+
+    # 1.初始化所有配置和环境变量
+    from app.infra.settings import init_settings
+
+    init_settings()
+
+    # 2.初始化日志
+    from app.infra import init_logger
+
+    init_logger()
+
+    main()